@@ -1,5 +1,8 @@
 from sqladmin import ModelView
+from sqlalchemy import select
 
+from shared.core.db import session_factory
+from shared.matching.deck import discard_candidate_everywhere
 from shared.models.chat import Chat, ChatMember, Message
 from shared.models.file import File, UserMedia
 from shared.models.user import Ban, Preferences, Reaction, Report, User
@@ -43,6 +46,14 @@ class BanAdmin(ModelView, model=Ban):
     column_sortable_list = [Ban.created_at, Ban.expires_at]
     column_default_sort = [(Ban.created_at, True)]
 
+    async def after_model_change(self, data, model, is_created, request):
+        async with session_factory() as session:
+            query = select(User.id).where(User.telegram_id == model.user_telegram_id)
+            user_id = await session.scalar(query)
+
+        if user_id:
+            await discard_candidate_everywhere(user_id)
+
 
 class ReactionAdmin(ModelView, model=Reaction):
     column_list = [
@@ -0,0 +1,200 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Awaitable, Callable, Iterable
+
+import asyncpg
+from sqlalchemy import func, select
+
+from shared.core.config import settings
+from shared.core.db import session_factory
+from shared.enums import BackplaneTypes
+
+logger = logging.getLogger(__name__)
+
+# delivers a message to the websockets of a user connected to this worker
+Deliver = Callable[[str, str], Awaitable[None]]
+
+
+class Backplane:
+    """
+    Relays websocket messages and presence between API workers. This base
+    class is used when there is a single worker, so there is nothing to relay.
+    """
+
+    async def run(self, deliver: Deliver, get_users: Callable[[], Iterable[str]]):
+        """Relay messages until cancelled, get_users returns the local users"""
+        await asyncio.Event().wait()
+
+    async def publish(self, user_id: str, message: str) -> None:
+        pass
+
+    async def announce(self, user_id: str, is_online: bool) -> None:
+        pass
+
+    def is_connected(self, user_id: str) -> bool:
+        """Whether the user is connected to another worker"""
+        return False
+
+
+class PostgresBackplane(Backplane):
+    """
+    Backplane over Postgres LISTEN/NOTIFY. Every worker announces the users
+    connected to it, so messages are only published for users connected to
+    another worker. Workers repeat their announcements every
+    settings.WEBSOCKET_PRESENCE_INTERVAL seconds, and other workers forget
+    users not announced for three intervals, e.g. after a worker crashed.
+    """
+
+    CHANNEL = "websocket"
+    # NOTIFY payloads must be shorter than 8000 bytes, longer messages are
+    # sent in parts
+    PAYLOAD_LIMIT = 7000
+    PRESENCE_BATCH_SIZE = 100
+    RECONNECT_DELAY = 5
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex
+        # user_id -> worker_id -> expires_at of the users on other workers
+        self.presence: dict[str, dict[str, float]] = {}
+        # (worker_id, message_id) -> parts received so far
+        self.parts: dict[tuple[str, str], list[str | None]] = {}
+        self.tasks: set[asyncio.Task] = set()
+        self.deliver: Deliver | None = None
+        self.get_users: Callable[[], Iterable[str]] = list
+
+    async def notify(self, data: dict) -> None:
+        payload = json.dumps({"worker": self.worker_id, **data}, ensure_ascii=False)
+        async with session_factory() as session:
+            await session.execute(select(func.pg_notify(self.CHANNEL, payload)))
+            await session.commit()
+
+    async def publish(self, user_id: str, message: str) -> None:
+        size = self.PAYLOAD_LIMIT // 4  # characters take up to 4 bytes
+        chunks = [message[i : i + size] for i in range(0, len(message), size)]
+        message_id = uuid.uuid4().hex
+        for i, chunk in enumerate(chunks or [""]):
+            await self.notify(
+                {
+                    "type": "message",
+                    "id": message_id,
+                    "user_id": user_id,
+                    "part": i,
+                    "parts": len(chunks) or 1,
+                    "text": chunk,
+                }
+            )
+
+    async def announce(self, user_id: str, is_online: bool) -> None:
+        await self.notify(
+            {"type": "presence", "user_ids": [user_id], "is_online": is_online}
+        )
+
+    async def announce_all(self) -> None:
+        user_ids = list(self.get_users())
+        for i in range(0, len(user_ids), self.PRESENCE_BATCH_SIZE):
+            await self.notify(
+                {
+                    "type": "presence",
+                    "user_ids": user_ids[i : i + self.PRESENCE_BATCH_SIZE],
+                    "is_online": True,
+                }
+            )
+
+    def is_connected(self, user_id: str) -> bool:
+        workers = self.presence.get(user_id)
+        if not workers:
+            return False
+
+        now = time.monotonic()
+        for worker_id, expires_at in list(workers.items()):
+            if expires_at < now:
+                del workers[worker_id]
+        if not workers:
+            del self.presence[user_id]
+        return bool(workers)
+
+    def run_task(self, coroutine: Awaitable) -> None:
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def on_message(self, data: dict) -> None:
+        key = (data["worker"], data["id"])
+        parts = self.parts.setdefault(key, [None] * data["parts"])
+        parts[data["part"]] = data["text"]
+        if any(part is None for part in parts):
+            return
+
+        del self.parts[key]
+        if self.deliver:
+            self.run_task(self.deliver(data["user_id"], "".join(parts)))
+
+    def on_presence(self, data: dict) -> None:
+        expires_at = time.monotonic() + 3 * settings.WEBSOCKET_PRESENCE_INTERVAL
+        for user_id in data["user_ids"]:
+            if data["is_online"]:
+                self.presence.setdefault(user_id, {})[data["worker"]] = expires_at
+            elif user_id in self.presence:
+                self.presence[user_id].pop(data["worker"], None)
+                if not self.presence[user_id]:
+                    del self.presence[user_id]
+
+    def on_notification(self, connection, pid, channel, payload: str) -> None:
+        data = json.loads(payload)
+        if data["worker"] == self.worker_id:
+            return
+
+        if data["type"] == "message":
+            self.on_message(data)
+        elif data["type"] == "presence":
+            self.on_presence(data)
+        elif data["type"] == "hello":
+            # a worker started, let it know who is connected here
+            self.run_task(self.announce_all())
+
+    async def send_heartbeats(self) -> None:
+        while True:
+            await asyncio.sleep(settings.WEBSOCKET_PRESENCE_INTERVAL)
+            try:
+                await self.announce_all()
+            except Exception:
+                logger.exception("Websocket presence announcement failed")
+
+    async def run(self, deliver: Deliver, get_users: Callable[[], Iterable[str]]):
+        self.deliver = deliver
+        self.get_users = get_users
+
+        dsn = settings.database_url.replace("postgresql+asyncpg", "postgresql")
+        heartbeat_task = asyncio.create_task(self.send_heartbeats())
+        try:
+            while True:
+                connection = None
+                try:
+                    connection = await asyncpg.connect(dsn)
+                    closed = asyncio.Event()
+                    connection.add_termination_listener(lambda _: closed.set())
+                    await connection.add_listener(self.CHANNEL, self.on_notification)
+                    await self.notify({"type": "hello"})
+                    await self.announce_all()
+                    await closed.wait()
+                except Exception:
+                    logger.exception("Websocket backplane connection failed")
+                finally:
+                    if connection is not None:
+                        connection.terminate()
+                # messages missed while disconnected are lost, presence is
+                # rebuilt from the announcements after reconnecting
+                self.presence.clear()
+                self.parts.clear()
+                await asyncio.sleep(self.RECONNECT_DELAY)
+        finally:
+            heartbeat_task.cancel()
+
+
+def get_backplane() -> Backplane:
+    if settings.WEBSOCKET_BACKPLANE == BackplaneTypes.postgres:
+        return PostgresBackplane()
+    return Backplane()
@@ -1,15 +1,36 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from api.routers.chats import router as chats_router
 from api.routers.users import router as users_router
+from api.websocket import acks, manager, send_receipts
+from bot.utils import close_bot
+from shared.bans import run_ban_registry
 from shared.core.config import settings
 from shared.core.db import engine
 from sqladmin import Admin
 from api.admin.views import UserAdmin, PreferencesAdmin, BanAdmin, ReactionAdmin, UserMediaAdmin, FileAdmin, ChatAdmin, ChatMemberAdmin, MessageAdmin, ReportAdmin
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ban_registry_task = asyncio.create_task(run_ban_registry())
+    backplane_task = asyncio.create_task(manager.run())
+    ack_task = asyncio.create_task(acks.run(send_receipts))
+    yield
+    ban_registry_task.cancel()
+    ack_task.cancel()
+    await asyncio.gather(ack_task, return_exceptions=True)
+    await acks.flush(send_receipts)
+    backplane_task.cancel()
+    await close_bot()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(users_router)
 app.include_router(chats_router)
 
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+from uuid import UUID
+
+from shared.core.config import settings
+from shared.core.db import session_factory
+from shared.queries import Receipt, update_receipts
+
+logger = logging.getLogger(__name__)
+
+# sends the updated cursors to the members of the chats
+SendReceipts = Callable[[list[Receipt]], Awaitable[None]]
+
+
+class AckBuffer:
+    """
+    Coalesces the delivery and read acks of websocket clients. Only the
+    highest acked message of each chat member is kept, and every
+    settings.WEBSOCKET_ACK_FLUSH_INTERVAL seconds the buffer is written with
+    one statement per settings.WEBSOCKET_ACK_BATCH_SIZE members, so a member
+    costs one row update per flush however many messages they acked.
+    """
+
+    def __init__(self):
+        # (chat_id, user_id) -> [delivered_id, read_id]
+        self.pending: dict[tuple[int, UUID], list[int]] = {}
+        self.flush_requested = asyncio.Event()
+
+    def ack(
+        self, chat_id: int, user_id: UUID, delivered_id: int = 0, read_id: int = 0
+    ) -> None:
+        ids = self.pending.setdefault((chat_id, user_id), [0, 0])
+        ids[0] = max(ids[0], delivered_id)
+        ids[1] = max(ids[1], read_id)
+        if len(self.pending) >= settings.WEBSOCKET_ACK_BATCH_SIZE:
+            self.flush_requested.set()
+
+    async def flush(self, send: SendReceipts) -> int:
+        """
+        Write the pending acks and send the receipts
+
+        Returns:
+            int: Number of chat members flushed
+        """
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+
+        # update_receipts locks the rows in key order, sorting keeps each
+        # batch to a range of chats
+        acks = sorted(
+            (chat_id, user_id, delivered_id, read_id)
+            for (chat_id, user_id), (delivered_id, read_id) in pending.items()
+        )
+        size = settings.WEBSOCKET_ACK_BATCH_SIZE
+        receipts = []
+        try:
+            # a statement takes up to 32767 parameters, 4 per ack
+            async with session_factory() as session:
+                for i in range(0, len(acks), size):
+                    receipts += await update_receipts(session, acks[i : i + size])
+        except BaseException:
+            # keep them for the next flush, merged with the newer acks. The
+            # update may have gone through, writing it again changes nothing
+            for chat_id, user_id, delivered_id, read_id in acks:
+                self.ack(chat_id, user_id, delivered_id, read_id)
+            raise
+
+        await send(receipts)
+        return len(acks)
+
+    async def run(self, send: SendReceipts) -> None:
+        """
+        Flush the acks until cancelled. Flush once more after cancelling it,
+        so the acks of the last interval aren't lost on shutdown.
+        """
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self.flush_requested.wait(), settings.WEBSOCKET_ACK_FLUSH_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                pass
+            self.flush_requested.clear()
+            try:
+                await self.flush(send)
+            except Exception:
+                logger.exception("Websocket ack flush failed")
@@ -1,16 +1,22 @@
 import json
+from datetime import datetime
 from typing import Annotated
 
 from aiogram.utils.web_app import WebAppInitData
-from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, WebSocket
+from fastapi import (APIRouter, BackgroundTasks, Depends, HTTPException, Query,
+                     WebSocket)
 from sqlalchemy import select
 
 from api.dependencies import validate_init_data, validate_websocket_init_data
-from api.websocket import handle_websocket
+from api.websocket import handle_websocket, send_receipts
 from shared.core.db import session_factory
-from shared.dto.chat import ChatDTO, ChatInDTO, ChatMemberDTO, MessageDTO
-from shared.models.chat import Chat, ChatMember, Message
-from shared.queries import can_write, get_chat_by_users, get_user, select_chat_members
+from shared.dto.chat import (ChatDTO, ChatInDTO, ChatMemberDTO, ChatReadDTO,
+                             InboxChatDTO, MessageDTO)
+from shared.models.chat import Chat, ChatMember
+from shared.queries import (can_write, get_chat_by_users, get_chat_messages,
+                            get_inbox, get_user, mark_chat_read,
+                            select_chat_members)
+from shared.validators import Params
 from api.websocket import manager
 
 router = APIRouter()
@@ -29,6 +35,49 @@ async def get_chats(
         return chats
 
 
+@router.get("/chats/inbox", response_model=list[InboxChatDTO])
+async def get_inbox_chats(
+    init_data: Annotated[WebAppInitData, Depends(validate_init_data)],
+    before_activity_at: datetime | None = None,
+    before_id: int | None = None,
+    limit: Annotated[
+        int, Query(ge=1, le=Params.chats_page_max_size)
+    ] = Params.chats_page_size,
+):
+    """
+    Return a page of chats with the other member's profile, the last message
+    and the unread count, most recently active first. Pass the last chat's
+    last_activity_at and id as before_activity_at and before_id to load the
+    next page.
+    """
+    assert init_data.user
+    user = await get_user(telegram_id=init_data.user.id, is_active=True)
+    if (before_activity_at is None) != (before_id is None):
+        raise HTTPException(
+            status_code=400,
+            detail="before_activity_at and before_id must be passed together",
+        )
+
+    before = None
+    if before_activity_at is not None and before_id is not None:
+        before = (before_activity_at, before_id)
+    async with session_factory() as session:
+        chats = await get_inbox(session, user.id, before=before, limit=limit)
+        return [
+            InboxChatDTO(
+                id=chat.chat.id,
+                peer=chat.peer,
+                last_message=chat.last_message,
+                unread_count=chat.unread_count,
+                last_read_message_id=chat.last_read_message_id,
+                peer_last_read_message_id=chat.peer_last_read_message_id,
+                peer_last_delivered_message_id=chat.peer_last_delivered_message_id,
+                last_activity_at=chat.last_activity_at,
+            )
+            for chat in chats
+        ]
+
+
 @router.post("/chats", response_model=ChatDTO)
 async def create_chat(
     init_data: Annotated[WebAppInitData, Depends(validate_init_data)],
@@ -101,7 +150,17 @@ async def delete_chat(
 async def get_messages(
     init_data: Annotated[WebAppInitData, Depends(validate_init_data)],
     chat_id: int,
+    before_id: int | None = None,
+    after_id: int | None = None,
+    limit: Annotated[
+        int, Query(ge=1, le=Params.messages_page_max_size)
+    ] = Params.messages_page_size,
 ):
+    """
+    Return a page of messages oldest first, the latest ones by default.
+    Use the first message's id as before_id to load older messages, or the
+    last known id as after_id to load newer ones.
+    """
     assert init_data.user
     user = await get_user(telegram_id=init_data.user.id, is_active=True)
     async with session_factory() as session:
@@ -115,10 +174,34 @@ async def get_messages(
                 status_code=403, detail="You are not a member of this chat"
             )
 
-        query = select(Message).where(Message.chat_id == chat_id)
-        res = await session.scalars(query)
-        messages = res.all()
-        return messages
+        return await get_chat_messages(
+            session,
+            chat_id=chat_id,
+            before_id=before_id,
+            after_id=after_id,
+            limit=limit,
+        )
+
+
+@router.put("/chats/{chat_id}/read")
+async def read_chat(
+    init_data: Annotated[WebAppInitData, Depends(validate_init_data)],
+    chat_id: int,
+    read: ChatReadDTO,
+):
+    """Mark the messages of the chat up to read.message_id as read"""
+    assert init_data.user
+    user = await get_user(telegram_id=init_data.user.id, is_active=True)
+    async with session_factory() as session:
+        receipt = await mark_chat_read(session, user.id, chat_id, read.message_id)
+    if receipt is None:
+        raise HTTPException(status_code=403, detail="You are not a member of this chat")
+
+    await send_receipts([receipt])
+    return {
+        "last_read_message_id": receipt.last_read_message_id,
+        "last_delivered_message_id": receipt.last_delivered_message_id,
+    }
 
 
 @router.get("/chats/{chat_id}/members", response_model=list[ChatMemberDTO])
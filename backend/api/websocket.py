@@ -1,44 +1,233 @@
 import asyncio
 import json
+import logging
 from collections import defaultdict
 from aiogram import types
 
 from aiogram.utils.web_app import WebAppInitData
 from fastapi import WebSocket, WebSocketDisconnect
 
-from bot.utils import send_message
+from api.backplane import Backplane, get_backplane
+from api.receipts import AckBuffer
+from shared.outbox import enqueue_message
 from shared.core.config import settings
 from shared.core.db import session_factory
 from shared.dto.chat import MessageAddDTO
-from shared.models.chat import Chat, ChatMember
-from shared.queries import can_write, get_chat_by_users, get_user, select_chat_members
-from sqlalchemy import exc
+from shared.models.chat import Chat, ChatMember, Message
+from shared.queries import (Receipt, can_write, get_chat_by_users,
+                            get_chat_messages, get_user, select_chat_members)
+from shared.validators import Params
+from sqlalchemy import exc, select
 from api.i18n import get_translator
 
+logger = logging.getLogger(__name__)
+
+
+class Connection:
+    """
+    A websocket with its own bounded send queue drained by a writer task, so
+    a slow client only holds up its own messages. Clients that fall too far
+    behind or take longer than settings.WEBSOCKET_SEND_TIMEOUT to accept a
+    message are disconnected and catch up after reconnecting.
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.queue: asyncio.Queue[str] = asyncio.Queue(
+            settings.WEBSOCKET_SEND_QUEUE_SIZE
+        )
+        self.writer = asyncio.create_task(self.write())
+        self.closer: asyncio.Task | None = None
+
+    async def write(self):
+        try:
+            while True:
+                message = await self.queue.get()
+                await asyncio.wait_for(
+                    self.websocket.send_text(message), settings.WEBSOCKET_SEND_TIMEOUT
+                )
+        except asyncio.TimeoutError:
+            logger.info("Disconnecting a websocket client that stopped reading")
+            self.abort()
+        except Exception:
+            # the client is gone, the receive loop cleans up
+            pass
+
+    def send(self, message: str):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            logger.info("Disconnecting a websocket client that fell behind")
+            self.abort()
+
+    def abort(self):
+        if not self.closer:
+            # 1013 "try again later"
+            self.closer = asyncio.create_task(self.close(code=1013))
+
+    async def close(self, code: int = 1000):
+        self.writer.cancel()
+        try:
+            # a slow client may not take the close frame either
+            await asyncio.wait_for(
+                self.websocket.close(code=code), settings.WEBSOCKET_SEND_TIMEOUT
+            )
+        except Exception:
+            pass
+
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: dict[str, list[WebSocket]] = defaultdict(list)
+    def __init__(self, backplane: Backplane):
+        self.active_connections: dict[str, list[Connection]] = defaultdict(list)
+        self.backplane = backplane
+
+    async def run(self):
+        """Relay messages to and from the other API workers until cancelled"""
+        await self.backplane.run(
+            self.send_local_message, lambda: list(self.active_connections)
+        )
+
+    async def announce(self, user_id: str, is_online: bool):
+        try:
+            await self.backplane.announce(user_id, is_online=is_online)
+        except Exception:
+            # the other workers catch up on the next presence heartbeat
+            logger.exception("Failed to announce websocket presence")
 
     async def connect(self, user_id: str, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections[user_id].append(websocket)
+        self.active_connections[user_id].append(Connection(websocket))
+        if len(self.active_connections[user_id]) == 1:
+            await self.announce(user_id, is_online=True)
 
     async def disconnect(self, user_id: str, websocket: WebSocket):
-        self.active_connections[user_id].remove(websocket)
-        if not self.active_connections[user_id]:
+        connections = self.active_connections.get(user_id, [])
+        for connection in connections:
+            if connection.websocket is websocket:
+                connections.remove(connection)
+                await connection.close()
+                break
+        else:
+            return
+
+        if not connections:
             del self.active_connections[user_id]
-        await websocket.close()
+            await self.announce(user_id, is_online=False)
+
+    def reply(self, user_id: str, websocket: WebSocket, message: str):
+        """Queue the message on one connection of the user"""
+        for connection in self.active_connections.get(user_id, []):
+            if connection.websocket is websocket:
+                connection.send(message)
+
+    async def send_local_message(self, user_id: str, message: str):
+        """Queue the message on every connection of the user without waiting"""
+        for connection in self.active_connections.get(user_id, []):
+            connection.send(message)
 
     async def send_message(self, user_id: str, message: str):
-        for connection in self.active_connections[user_id]:
-            await connection.send_text(message)
-    
+        await self.send_local_message(user_id, message)
+        if self.backplane.is_connected(user_id):
+            try:
+                await self.backplane.publish(user_id, message)
+            except Exception:
+                # the sender's request went through, the other workers'
+                # clients catch up with a sync frame after reconnecting
+                logger.exception("Failed to publish a websocket message")
+
     def is_connected(self, user_id: str) -> bool:
-        return user_id in self.active_connections and bool(self.active_connections[user_id])
+        if self.active_connections.get(user_id):
+            return True
+        return self.backplane.is_connected(user_id)
+
+
+manager = ConnectionManager(get_backplane())
+acks = AckBuffer()
+
+
+def serialize_message(message: Message) -> dict:
+    return {
+        "id": message.id,
+        "chat_id": message.chat_id,
+        "user_id": message.user_id,
+        "text": message.text,
+        "created_at": message.created_at.isoformat(),
+        "updated_at": message.updated_at.isoformat(),
+    }
+
+
+async def sync_messages(user_id, websocket: WebSocket, payload: dict):
+    """
+    Answer a sync frame with the messages after payload["after_id"], of
+    payload["chat_id"] or of every chat of the user. When has_more is set
+    the client syncs again from the last message it got.
+    """
+    limit = Params.messages_page_max_size
+    async with session_factory() as session:
+        messages = await get_chat_messages(
+            session,
+            chat_id=payload.get("chat_id"),
+            user_id=user_id,
+            after_id=payload.get("after_id") or 0,
+            limit=limit + 1,
+        )
+
+    ws_message = {
+        "type": "sync",
+        "payload": {
+            "chat_id": payload.get("chat_id"),
+            "messages": [serialize_message(message) for message in messages[:limit]],
+            "has_more": len(messages) > limit,
+        },
+    }
+    manager.reply(str(user_id), websocket, json.dumps(ws_message, default=str))
+
+
+async def send_receipts(receipts: list[Receipt]):
+    """
+    Send the cursors to every member of the chats, the other member shows
+    them as receipts and the member's other connections update their
+    unread counts
+    """
+    if not receipts:
+        return
+
+    async with session_factory() as session:
+        query = select(ChatMember.chat_id, ChatMember.user_id).where(
+            ChatMember.chat_id.in_({receipt.chat_id for receipt in receipts})
+        )
+        rows = (await session.execute(query)).all()
+    members = defaultdict(list)
+    for chat_id, user_id in rows:
+        members[chat_id].append(user_id)
+
+    for receipt in receipts:
+        ws_message = {
+            "type": "receipt",
+            "payload": {
+                "chat_id": receipt.chat_id,
+                "user_id": receipt.user_id,
+                "last_delivered_message_id": receipt.last_delivered_message_id,
+                "last_read_message_id": receipt.last_read_message_id,
+            },
+        }
+        for user_id in members[receipt.chat_id]:
+            await manager.send_message(
+                str(user_id), json.dumps(ws_message, default=str)
+            )
 
 
-manager = ConnectionManager()
+def ack_messages(user_id, payload: dict):
+    """
+    Buffer an ack frame, payload["delivered_id"] and payload["read_id"] are
+    the latest messages of payload["chat_id"] the client received and showed
+    """
+    acks.ack(
+        int(payload["chat_id"]),
+        user_id,
+        delivered_id=int(payload.get("delivered_id") or 0),
+        read_id=int(payload.get("read_id") or 0),
+    )
 
 
 async def handle_websocket(websocket: WebSocket, init_data: WebAppInitData):
@@ -68,14 +257,7 @@ async def handle_websocket(websocket: WebSocket, init_data: WebAppInitData):
 
                 ws_message = {
                     "type": "new_message",
-                    "payload": {
-                        "id": message_orm.id,
-                        "chat_id": message_orm.chat_id,
-                        "user_id": message_orm.user_id,
-                        "text": message_orm.text,
-                        "created_at": message_orm.created_at.isoformat(),
-                        "updated_at": message_orm.updated_at.isoformat(),
-                    },
+                    "payload": serialize_message(message_orm),
                 }
                 for member in members:
                     if not member.user.is_active: continue
@@ -94,12 +276,19 @@ async def handle_websocket(websocket: WebSocket, init_data: WebAppInitData):
                             ]
                         )
                         msg = _("You have a new message from {name}")
-                        asyncio.ensure_future(
-                            send_message(str(member.user.telegram_id), msg.format(name=user.name), reply_markup=mk)
+                        await enqueue_message(
+                            member.user.telegram_id,
+                            msg.format(name=user.name),
+                            reply_markup=mk,
+                            dedup_key=f"message:{member.user.telegram_id}:{user.id}",
                         )
                     await manager.send_message(
                         str(member.user_id), json.dumps(ws_message, default=str)
                     )
+            elif data.get("type") == "sync":
+                await sync_messages(user.id, websocket, data.get("payload") or {})
+            elif data.get("type") == "ack":
+                ack_messages(user.id, data.get("payload") or {})
     except WebSocketDisconnect:
         print("WebSocket disconnected")
     finally:
@@ -2,13 +2,10 @@ from aiogram.filters import Filter
 from aiogram.types import Message
 from sqlalchemy import exc
 
-from shared.queries import get_user
+from shared.cache import get_cached_user
 
 
 class IsHuman(Filter):
-    def __init__(self) -> None:
-        pass
-
     async def __call__(self, message: Message):
         if not message.from_user or message.from_user.is_bot:
             return False
@@ -16,28 +13,19 @@ class IsHuman(Filter):
 
 
 class IsBot(Filter):
-    def __init__(self) -> None:
-        pass
-
     async def __call__(self, message: Message):
         return bool(message.from_user and message.from_user.is_bot)
 
 
 class IsHumanUser(Filter):
-    def __init__(self, with_media=False, with_preferences=False) -> None:
-        self.with_media = with_media
-        self.with_preferences = with_preferences
+    """Passes the user with media and preferences loaded to the handler"""
 
     async def __call__(self, message: Message):
         if not await IsHuman().__call__(message):
             return False
 
         try:
-            user = await get_user(
-                telegram_id=message.from_user.id,  # type: ignore
-                with_media=self.with_media,
-                with_preferences=self.with_preferences,
-            )
+            user = await get_cached_user(message.from_user.id)  # type: ignore
         except exc.NoResultFound:
             return False
 
@@ -45,14 +33,8 @@ class IsHumanUser(Filter):
 
 
 class IsActiveHumanUser(Filter):
-    def __init__(self, with_media=False, with_preferences=False) -> None:
-        self.with_media = with_media
-        self.with_preferences = with_preferences
-
     async def __call__(self, message: Message):
-        result = await IsHumanUser(self.with_media, self.with_preferences).__call__(
-            message
-        )
+        result = await IsHumanUser().__call__(message)
         if not result:
             return False
 
@@ -63,14 +45,8 @@ class IsActiveHumanUser(Filter):
 
 
 class IsInactiveHumanUser(Filter):
-    def __init__(self, with_media=False, with_preferences=False) -> None:
-        self.with_media = with_media
-        self.with_preferences = with_preferences
-
     async def __call__(self, message: Message):
-        result = await IsHumanUser(self.with_media, self.with_preferences).__call__(
-            message
-        )
+        result = await IsHumanUser().__call__(message)
         if not result:
             return False
 
@@ -23,7 +23,7 @@ async def show_likes(
     with_keyboard: bool | None = True,
 ):
     await state.update_data(match_id=None)
-    await state.update_data(rewind_index=0)
+    await state.update_data(rewind_index=0, rewind_cursor=None)
 
     likes = await get_likes(user, limit=1)
     if not likes:
@@ -33,7 +33,7 @@ async def show_likes(
     if with_keyboard:
         await message.answer(_("Likes"), reply_markup=get_search_keyboard())
 
-    match = likes[0]
+    match = likes[0].User
     profile = await get_profile_card(match, user)
     await state.update_data(match_id=match.id)
     await message.answer_media_group(profile)
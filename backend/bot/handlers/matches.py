@@ -7,7 +7,7 @@ from bot.filters import IsActiveHumanUser, IsHuman
 from bot.handlers.menu import show_menu
 from bot.keyboards import get_matches_keyboard
 from bot.states import AppStates
-from bot.utils import get_profile_card
+from bot.utils import dump_cursor, get_profile_card, load_cursor
 from shared.core.config import settings
 from shared.models.user import User
 from shared.queries import get_matches
@@ -19,25 +19,38 @@ router.message.filter(IsHuman())
 @router.message(AppStates.matches, F.text.in_(["⬅️", "➡️"]), IsActiveHumanUser())
 @router.message(AppStates.menu, F.text == __("❤️ Matches"), IsActiveHumanUser())
 async def show_matches(message: types.Message, state: FSMContext, user: User):
+    # the cursor points at the match being shown, "⬅️" goes to older matches
+    cursor = load_cursor(await state.get_value("matches_cursor"))
     if message.text == _("❤️ Matches"):
-        index = 0
-    else:
-        index = await state.get_value("index") or 0
+        cursor = None
 
-    if message.text == "⬅️":
-        index += 1
-    elif message.text == "➡️" and index > 0:
-        index -= 1
+    if message.text == "⬅️" and cursor:
+        matches = await get_matches(user, limit=2, before=cursor)
+        has_previous, has_next = len(matches) == 2, True
+    elif message.text == "➡️" and cursor:
+        matches = await get_matches(user, limit=2, after=cursor)
+        has_previous, has_next = True, len(matches) == 2
+    elif cursor:
+        # stay in place, after 👎 the next older match takes the shown one's
+        matches = await get_matches(user, limit=2, before=cursor, inclusive=True)
+        has_previous = len(matches) == 2
+        has_next = bool(
+            matches
+            and await get_matches(
+                user, limit=1, after=(matches[0].matched_at, matches[0].User.id)
+            )
+        )
+    else:
+        matches = []
 
-    has_previous, has_next = False, index > 0
-    matches = await get_matches(user, limit=2, offset=index)
+    if not matches:
+        matches = await get_matches(user, limit=2)
+        has_previous, has_next = len(matches) == 2, False
     if not matches:  # TODO: Return the last match instead
         await message.answer(_("No matches found"))
         return await show_menu(message, state)
-    if len(matches) == 2:
-        has_previous = True
 
-    match = matches[0]
+    match, matched_at = matches[0]
     profile = await get_profile_card(match, user)
     await state.update_data(match_id=match.id)
     await message.answer_media_group(profile)
@@ -66,4 +79,4 @@ async def show_matches(message: types.Message, state: FSMContext, user: User):
     )
 
     await state.set_state(AppStates.matches)
-    await state.update_data(index=index)
+    await state.update_data(matches_cursor=dump_cursor((matched_at, match.id)))
@@ -15,6 +15,9 @@ from bot.keyboards import (
     make_keyboard,
 )
 from bot.middlewares import i18n_middleware
+from shared.cache import invalidate_user
+from shared.matching.deck import discard_candidate
+from shared.matching.exclusions import add_exclusion
 from shared.models.user import Report, User
 from shared.queries import get_user
 from bot.states import AppStates
@@ -56,6 +59,11 @@ async def report_reason(message: types.Message, state: FSMContext, user: User):
         session.add(report)
         await session.commit()
 
+    add_exclusion(user.id, match.id)
+    add_exclusion(match.id, user.id)
+    await discard_candidate(user.id, match.id)
+    await discard_candidate(match.id, user.id)
+
     await message.answer(_("User has been reported"))
     await show_menu(message, state)
 
@@ -89,6 +97,8 @@ async def deactivate_account_confirm(
         user.is_active = False
         session.add(user)
         await session.commit()
+
+    invalidate_user(user.telegram_id)
     await activate_account_start(message, state)
 
 
@@ -101,6 +111,8 @@ async def activate_account(message: types.Message, state: FSMContext, user: User
         session.add(user)
         await session.commit()
 
+    invalidate_user(user.telegram_id)
+
     await message.answer(_("Your account has been activated"))
     await show_menu(message, state)
 
@@ -137,6 +149,8 @@ async def change_language(
         )
         await session.execute(query)
         await session.commit()
+
+    invalidate_user(from_user.id)
     await show_settings(message, state)
 
 
@@ -159,6 +173,8 @@ async def delete_account_confirm(message: types.Message, state: FSMContext, user
     async with session_factory() as session:
         await session.delete(user)
         await session.commit()
+
+    invalidate_user(user.telegram_id)
     await start_registration_start(message, state)
 
 
@@ -20,10 +20,15 @@ from bot.utils import clear_state, get_profile_card
 from shared.core.db import session_factory
 from shared.dto.file import FileAddDTO
 from shared.enums import FileTypes, UILanguages
-from shared.geocoding import get_place, get_place_id, get_places
+from shared.geocoding import (GeocodingError, get_place, get_place_id,
+                               get_places)
+from shared.cache import invalidate_user
+from shared.matching.deck import clear_deck
+from shared.places import request_place_name_backfill
 from shared.models.user import Place, PlaceName, Preferences, User
 from shared.queries import get_user
 from shared.validators import (Params, validate_bio, validate_birth_date,
+                               validate_max_distance_string,
                                validate_media_size, validate_name,
                                validate_preference_age_string,
                                validate_video_duration)
@@ -35,7 +40,7 @@ router.message.filter(IsHuman())
 @router.message(
     AppStates.settings,
     F.text == __("👤 My profile"),
-    IsActiveHumanUser(with_media=True),
+    IsActiveHumanUser(),
 )
 async def show_profile(message: types.Message, state: FSMContext, user: User):
     profile = await get_profile_card(user)
@@ -94,6 +99,8 @@ async def update_name(message: types.Message, state: FSMContext):
         user = (await session.execute(query)).scalar_one()
         await session.commit()
 
+    invalidate_user(message.from_user.id)
+
     await message.answer(_("Your profile has been updated"))
     await show_profile(message, state, user)
 
@@ -133,6 +140,9 @@ async def update_birth_date(message: types.Message, state: FSMContext):
         user = (await session.execute(query)).scalar_one()
         await session.commit()
 
+    invalidate_user(message.from_user.id)
+    await clear_deck(user.id)
+
     await message.answer(_("Your profile has been updated"))
     await show_profile(message, state, user)
 
@@ -163,6 +173,9 @@ async def update_gender(message: types.Message, state: FSMContext):
         user = (await session.execute(query)).scalar_one()
         await session.commit()
 
+    invalidate_user(message.from_user.id)
+    await clear_deck(user.id)
+
     await message.answer(_("Your profile has been updated"))
     await show_profile(message, state, user)
 
@@ -199,6 +212,8 @@ async def update_bio(message: types.Message, state: FSMContext):
         user = (await session.execute(query)).scalar_one()
         await session.commit()
 
+    invalidate_user(message.from_user.id)
+
     await message.answer(_("Your profile has been updated"))
     await show_profile(message, state, user)
 
@@ -228,10 +243,14 @@ async def update_gender_preferences(message: types.Message, state: FSMContext):
             .where(Preferences.user_id == User.id)
             .where(User.telegram_id == message.from_user.id)
             .values(preferred_gender=preferred_gender)
+            .returning(Preferences.user_id)
         )
-        await session.execute(query)
+        user_id = (await session.execute(query)).scalar_one()
         await session.commit()
 
+    invalidate_user(message.from_user.id)
+    await clear_deck(user_id)
+
     await message.answer(
         _("Search settings have been updated"),
         reply_markup=get_preferences_update_keyboard(),
@@ -265,10 +284,55 @@ async def update_age_preferences(message: types.Message, state: FSMContext):
             .where(Preferences.user_id == User.id)
             .where(User.telegram_id == message.from_user.id)
             .values(min_age=min_age, max_age=max_age)
+            .returning(Preferences.user_id)
         )
-        await session.execute(query)
+        user_id = (await session.execute(query)).scalar_one()
         await session.commit()
 
+    invalidate_user(message.from_user.id)
+    await clear_deck(user_id)
+
+    await message.answer(
+        _("Search settings have been updated"),
+        reply_markup=get_preferences_update_keyboard(),
+    )
+    await update_preferences(message, state, with_keyboard=False)
+
+
+@router.message(AppStates.preferences, F.text == __("📏 Max distance"))
+async def update_max_distance_start(message: types.Message, state: FSMContext):
+    await message.answer(
+        _("How far away can your matches be? Enter the distance in km (e.g. 30)"),
+        reply_markup=make_keyboard([[CLEAR_TXT]]),
+    )
+    await state.set_state(AppStates.update_max_distance)
+
+
+@router.message(AppStates.update_max_distance, F.text)
+async def update_max_distance(message: types.Message, state: FSMContext):
+    assert message.text and message.from_user
+    if message.text == CLEAR_TXT:
+        max_distance_km = None
+    else:
+        try:
+            max_distance_km = validate_max_distance_string(message.text)
+        except ValueError as e:
+            return await message.answer(str(e))
+
+    async with session_factory() as session:
+        query = (
+            update(Preferences)
+            .where(Preferences.user_id == User.id)
+            .where(User.telegram_id == message.from_user.id)
+            .values(max_distance_km=max_distance_km)
+            .returning(Preferences.user_id)
+        )
+        user_id = (await session.execute(query)).scalar_one()
+        await session.commit()
+
+    invalidate_user(message.from_user.id)
+    await clear_deck(user_id)
+
     await message.answer(
         _("Search settings have been updated"),
         reply_markup=get_preferences_update_keyboard(),
@@ -291,7 +355,12 @@ async def update_location_by_name(message: types.Message, state: FSMContext):
 
     language = await state.get_value("locale") or "en"
     assert language
-    cities = get_places(message.text, UILanguages[language])
+    try:
+        cities = await get_places(message.text, UILanguages[language])
+    except GeocodingError:
+        return await message.answer(
+            _("Couldn't look up the city right now, please try again later")
+        )
     if not cities:
         return await message.answer(_("City not found"))
 
@@ -312,7 +381,12 @@ async def set_location_by_name_selected(
     assert callback.data and isinstance(callback.message, types.Message)
 
     place_id = callback.data.split(":")[1]
-    latitude, longitude, city_name = get_place(place_id, UILanguages.en)
+    try:
+        latitude, longitude, city_name = await get_place(place_id, UILanguages.en)
+    except ValueError:
+        return await callback.message.answer(
+            _("Couldn't look up the city right now, please try again later")
+        )
 
     async with session_factory() as session:
         if place_id:
@@ -344,6 +418,10 @@ async def set_location_by_name_selected(
         user = (await session.execute(query)).scalar_one()
         await session.commit()
 
+    invalidate_user(callback.from_user.id)
+    await clear_deck(user.id)
+    request_place_name_backfill()
+
     await callback.message.answer(_("Your profile has been updated"))
     await show_profile(callback.message, state, user)
 
@@ -356,7 +434,7 @@ async def update_location(message: types.Message, state: FSMContext):
 
     latitude = message.location.latitude
     longitude = message.location.longitude
-    place_id = get_place_id(latitude, longitude)
+    place_id = await get_place_id(latitude, longitude)
 
     async with session_factory() as session:
         if place_id:
@@ -382,6 +460,11 @@ async def update_location(message: types.Message, state: FSMContext):
         user = (await session.execute(query)).scalar_one()
         await session.commit()
 
+    invalidate_user(message.from_user.id)
+    await clear_deck(user.id)
+    if place_id:
+        request_place_name_backfill()
+
     await message.answer(_("Your profile has been updated"))
     await show_profile(message, state, user)
 
@@ -488,5 +571,7 @@ async def update_media_finish(message: types.Message, state: FSMContext):
         user.media = media
         await session.commit()
 
+    invalidate_user(message.from_user.id)
+
     await message.answer(_("Your profile has been updated"))
     await show_profile(message, state, user)
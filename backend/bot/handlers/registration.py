@@ -6,7 +6,7 @@ from aiogram.fsm.context import FSMContext
 from aiogram.utils.i18n import gettext as _
 from aiogram.utils.i18n import lazy_gettext as __
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import NoResultFound
 
 from bot.filters import IsHuman
@@ -22,8 +22,10 @@ from shared.core.db import session_factory
 from shared.dto.file import FileAddDTO
 from shared.dto.user import PreferenceAddDTO, UserRelAddDTO
 from shared.enums import FileTypes, UILanguages
-from shared.geocoding import get_place, get_place_id, get_places
-from shared.models.user import Place, PlaceName
+from shared.geocoding import (GeocodingError, get_place, get_place_id,
+                               get_places)
+from shared.models.user import Place
+from shared.places import request_place_name_backfill
 from shared.queries import get_user, is_user_banned
 from shared.validators import (Params, validate_bio, validate_birth_date,
                                validate_media_size, validate_name,
@@ -268,7 +270,12 @@ async def set_location_by_name(message: types.Message, state: FSMContext):
 
     language = await state.get_value("language")
     assert language
-    cities = get_places(message.text, UILanguages[language])
+    try:
+        cities = await get_places(message.text, UILanguages[language])
+    except GeocodingError:
+        return await message.answer(
+            _("Couldn't look up the city right now, please try again later")
+        )
     if not cities:
         return await message.answer(_("City not found"))
 
@@ -286,7 +293,12 @@ async def set_location_by_name(message: types.Message, state: FSMContext):
 async def set_location_by_name_selected(query: types.CallbackQuery, state: FSMContext):
     assert query.data and isinstance(query.message, types.Message)
     place_id = query.data.split(":")[1]
-    lat, lng, _ = get_place(place_id)
+    try:
+        lat, lng, _city_name = await get_place(place_id)
+    except ValueError:
+        return await query.message.answer(
+            _("Couldn't look up the city right now, please try again later")
+        )
 
     await state.update_data(place_id=place_id)
     await state.update_data(latitude=lat)
@@ -306,7 +318,7 @@ async def set_location(message: types.Message, state: FSMContext):
     await state.update_data(longitude=lng)
     await state.update_data(is_location_precise=True)
 
-    place_id = get_place_id(lat, lng)
+    place_id = await get_place_id(lat, lng)
     if place_id:
         await state.update_data(place_id=place_id)
 
@@ -441,25 +453,23 @@ async def finish_registration(message: types.Message, state: FSMContext):
 
     user_db = user.to_orm()
 
+    place_id = data.get("place_id")
     async with session_factory() as session:
-        if "place_id" in data and data["place_id"] is not None:
-            query = select(Place).where(Place.id == data["place_id"])
-            result = await session.scalars(query)
-            place = result.one_or_none()
-            if not place:
-                place = Place(id=data["place_id"])
-                lat, lng, place_name = get_place(place.id, UILanguages.en)
-                place_name_db = PlaceName(
-                    place_id=place.id,
-                    language=UILanguages.en,
-                    name=place_name,
-                )
-                session.add(place)
-                session.add(place_name_db)
-            user_db.place = place
+        if place_id:
+            # the backfill names new places, geocoding here would fail the
+            # registration while the geocoder is down
+            query = (
+                insert(Place)
+                .values(id=place_id)
+                .on_conflict_do_nothing(index_elements=["id"])
+            )
+            await session.execute(query)
+            user_db.place_id = place_id
 
         session.add(user_db)
         await session.commit()
+    if place_id:
+        request_place_name_backfill()
 
     await message.answer(
         _("Registration has been completed!"), reply_markup=get_menu_keyboard()
@@ -1,7 +1,5 @@
-import asyncio
 from aiogram import F, Router, types
 
-from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.i18n import gettext as _
 from aiogram.utils.i18n import gettext as _v
@@ -15,17 +13,17 @@ from bot.handlers.matches import show_matches
 from bot.handlers.menu import show_menu
 from bot.keyboards import get_empty_search_keyboard, get_search_keyboard
 from bot.states import AppStates
-from bot.utils import get_profile_card, send_message
+from bot.utils import dump_cursor, get_profile_card, load_cursor
+from shared.cache import get_cached_user
 from shared.core.config import settings
-from shared.core.db import session_factory
 from shared.enums import ReactionType
-from shared.matching.algorithm import get_best_match
+from shared.matching.deck import pop_candidate
 from shared.models.user import User
+from shared.outbox import enqueue_message
 from shared.queries import (
     create_or_update_reaction,
-    get_nth_last_reacted_match,
+    get_last_reacted_match,
     get_user,
-    is_mutual,
     delete_chat_between_users
 )
 
@@ -38,9 +36,9 @@ async def search(
     message: types.Message, state: FSMContext, user: User, with_keyboard: bool = True
 ):
     await state.update_data(match_id=None)
-    await state.update_data(rewind_index=0)
+    await state.update_data(rewind_index=0, rewind_cursor=None)
 
-    match = await get_best_match(user)
+    match = await get_next_match(user)
     if not match:
         await message.answer(
             _("No one left to match with right now."), reply_markup=get_empty_search_keyboard()
@@ -56,6 +54,16 @@ async def search(
     await state.set_state(AppStates.search)
 
 
+async def get_next_match(user: User) -> User | None:
+    # deck entries can go stale, e.g. when a candidate deactivates their account
+    while candidate_id := await pop_candidate(user):
+        try:
+            return await get_user(id=candidate_id, is_active=True)
+        except exc.NoResultFound:
+            continue
+    return None
+
+
 @router.message(AppStates.search, F.text == __("⏪ Rewind"), IsActiveHumanUser())
 async def rewind_empty(message: types.Message, state: FSMContext, user: User):
     await rewind(message, state, user, with_keyboard=True)
@@ -77,19 +85,25 @@ async def rewind(
         )
         return await show_menu(message, state)
 
-    match = await get_nth_last_reacted_match(user, rewind_index)
-    if not match:
+    rewind_cursor = load_cursor(await state.get_value("rewind_cursor"))
+    row = await get_last_reacted_match(user, before=rewind_cursor)
+    if not row:
         await message.answer(_("No more matches to rewind"))
         await show_menu(message, state)
         return
 
+    match = row.User
+
     if with_keyboard:
         await message.answer(_("⏪ Rewinding"), reply_markup=get_search_keyboard())
 
     card = await get_profile_card(match, user)
     await message.answer_media_group(card)
     await state.update_data(match_id=match.id)
-    await state.update_data(rewind_index=rewind_index + 1)
+    await state.update_data(
+        rewind_index=rewind_index + 1,
+        rewind_cursor=dump_cursor((row.reacted_at, match.id)),
+    )
 
 
 @router.message(AppStates.search, F.text.in_(["👎", "👍"]), IsActiveHumanUser())
@@ -116,19 +130,14 @@ async def react(message: types.Message, state: FSMContext, user: User):
             return await show_matches(message, state, user)
         return await search(message, state, user, with_keyboard=False)
 
-    is_created, reaction = await create_or_update_reaction(user, match, reactions[message.text])
+    result = await create_or_update_reaction(user, match, reactions[message.text])
 
-    if message.text == "👍" and not reaction.is_match_notified:
-        mutual = await is_mutual(reaction)
-        if mutual:
-            asyncio.ensure_future(notify_mutual(user, match))
+    if result.should_notify:
+        if result.is_mutual:
+            await notify_mutual(user, match)
         else:
-            asyncio.ensure_future(notify_match(match))
-        async with session_factory() as session:
-            reaction.is_match_notified = True
-            session.add(reaction)
-            await session.commit()
-    if not is_created and message.text == "👎":
+            await notify_match(match)
+    if not result.is_created and message.text == "👎":
         try:
             await delete_chat_between_users(user.id, match.id)
         except exc.NoResultFound:
@@ -178,25 +187,18 @@ async def notify_mutual(user: User, match: User):
         locale=match.ui_language.name,
     )
 
-    try:
-        await send_message(
-            user.telegram_id,
-            msg1.format(match=match),
-            parse_mode="HTML",
-            reply_markup=mk1,
-        )
-    except (TelegramBadRequest, TelegramForbiddenError):
-        pass
-
-    try:
-        await send_message(
-            match.telegram_id,
-            msg2.format(match=user),
-            parse_mode="HTML",
-            reply_markup=mk2,
-        )
-    except (TelegramBadRequest, TelegramForbiddenError):
-        pass
+    await enqueue_message(
+        user.telegram_id,
+        msg1.format(match=match),
+        parse_mode="HTML",
+        reply_markup=mk1,
+    )
+    await enqueue_message(
+        match.telegram_id,
+        msg2.format(match=user),
+        parse_mode="HTML",
+        reply_markup=mk2,
+    )
 
 
 async def notify_match(match: User):
@@ -213,10 +215,13 @@ async def notify_match(match: User):
         "Someone liked your profile. Do you want to see who liked you?",
         locale=match.ui_language.name,
     )
-    try:
-        await send_message(match.telegram_id, msg, reply_markup=builder.as_markup())
-    except (TelegramBadRequest, TelegramForbiddenError):
-        pass
+    # one pending "someone liked you" per user is enough
+    await enqueue_message(
+        match.telegram_id,
+        msg,
+        reply_markup=builder.as_markup(),
+        dedup_key=f"like:{match.telegram_id}",
+    )
 
 
 @router.callback_query(F.data == "delete_message")
@@ -229,12 +234,12 @@ async def delete_message(callback: types.CallbackQuery):
 @router.callback_query(F.data == "show_matches")
 async def show_matches_callback(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
-    user = await get_user(telegram_id=callback.from_user.id, is_active=True)
+    user = await get_cached_user(callback.from_user.id, is_active=True)
     await show_matches(callback.message, state, user)
 
 
 @router.callback_query(F.data == "show_likes")
 async def show_likes_callback(callback: types.CallbackQuery, state: FSMContext):
     await callback.answer()
-    user = await get_user(telegram_id=callback.from_user.id, is_active=True)
+    user = await get_cached_user(callback.from_user.id, is_active=True)
     await show_likes(callback.message, state, user)
@@ -4,6 +4,7 @@ from aiogram.fsm.context import FSMContext
 
 from bot.filters import IsHumanUser
 from bot.handlers.menu import show_menu
+from shared.geocoding import get_cache_stats
 from shared.models.user import User
 from bot.utils import get_profile_card
 
@@ -22,6 +23,12 @@ async def get_state(message: types.Message, state: FSMContext):
     await message.answer(f"Current state: {current_state}")
 
 
+@router.message(Command("geocache"))
+async def get_geocoding_cache_stats(message: types.Message):
+    stats = get_cache_stats()
+    await message.answer("\n".join(f"{key}: {value}" for key, value in stats.items()))
+
+
 @router.message(Command("me"), IsHumanUser())
 async def get_me(message: types.Message, state: FSMContext, user: User):
     assert message.from_user
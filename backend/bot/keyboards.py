@@ -111,5 +111,9 @@ def get_profile_update_keyboard() -> ReplyKeyboardMarkup:
 
 
 def get_preferences_update_keyboard() -> ReplyKeyboardMarkup:
-    items = [[_("👩‍❤️‍👨 Gender preferences"), _("🔢 Age preferences")], [_("⬅️ Back")]]
+    items = [
+        [_("👩‍❤️‍👨 Gender preferences"), _("🔢 Age preferences")],
+        [_("📏 Max distance")],
+        [_("⬅️ Back")],
+    ]
     return make_keyboard(items)
@@ -1,12 +1,9 @@
 import asyncio
 import logging
 
-from aiogram import Bot, Dispatcher
-from aiogram.client.session.aiohttp import AiohttpSession
-from aiogram.client.telegram import TEST
+from aiogram import Dispatcher
 from aiogram.fsm.storage.mongo import MongoStorage
 from aiogram.types import MenuButtonWebApp, WebAppInfo
-from motor.motor_asyncio import AsyncIOMotorClient
 
 from bot.bot_commands import set_bot_profile
 from bot.handlers.default import router as default_router
@@ -17,31 +14,42 @@ from bot.handlers.profile import router as profile_router
 from bot.handlers.registration import router as registration_router
 from bot.handlers.search import router as search_router
 from bot.handlers.test import router as test_router
-from bot.middlewares import i18n_middleware
-from shared.core.config import EnvironmentTypes, settings
+from bot.middlewares import UserCacheMiddleware, i18n_middleware
+from bot.outbox import run_outbox
+from bot.utils import close_bot, get_bot
+from shared.bans import ban_listeners, run_ban_registry
+from shared.cache import invalidate_user
+from shared.core.config import settings
+from shared.core.mongo import mongo_client
+from shared.gazetteer import get_gazetteer
+from shared.geocoding import close_http_session
+from shared.matching.deck import setup_decks
+from shared.places import run_place_name_backfill
 
 logging.basicConfig(level=logging.INFO)
 
 
 async def main():
-    bot = Bot(token=settings.BOT_TOKEN)
-    if settings.ENVIRONMENT == EnvironmentTypes.testing:
-        session = AiohttpSession(api=TEST)
-        bot = Bot(token=settings.BOT_TOKEN, session=session)
+    bot = get_bot()
 
     try:
         await set_bot_profile(bot)
     except:
         pass
 
-    mongo = AsyncIOMotorClient(
-        host=settings.mongo_url,
-        uuidRepresentation="standard",
-    )
-    mongo_storage = MongoStorage(mongo)
+    await setup_decks()
+    get_gazetteer()
+
+    ban_listeners.append(invalidate_user)
+    ban_registry_task = asyncio.create_task(run_ban_registry())
+    place_name_task = asyncio.create_task(run_place_name_backfill())
+    outbox_task = asyncio.create_task(run_outbox())
+
+    mongo_storage = MongoStorage(mongo_client)
     dp = Dispatcher(storage=mongo_storage)
 
     i18n_middleware.setup(dp)
+    dp.update.outer_middleware(UserCacheMiddleware())
 
     dp.include_router(registration_router)
     dp.include_router(menu_router)
@@ -54,7 +62,14 @@ async def main():
     if settings.DEBUG:
         dp.include_router(test_router)
 
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        ban_registry_task.cancel()
+        place_name_task.cancel()
+        outbox_task.cancel()
+        await close_http_session()
+        await close_bot()
 
 
 if __name__ == "__main__":
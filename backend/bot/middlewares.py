@@ -1,4 +1,9 @@
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
 from aiogram.utils.i18n import I18n, FSMI18nMiddleware
+from shared.cache import request_users
 from shared.core.config import settings
 
 
@@ -8,3 +13,19 @@ i18n = I18n(
     domain="messages",
 )
 i18n_middleware = FSMI18nMiddleware(i18n)
+
+
+class UserCacheMiddleware(BaseMiddleware):
+    """Scopes the request level user cache to a single update"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        token = request_users.set({})
+        try:
+            return await handler(event, data)
+        finally:
+            request_users.reset(token)
@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import timedelta
+
+from aiogram.exceptions import (TelegramBadRequest, TelegramForbiddenError,
+                                TelegramNetworkError, TelegramNotFound,
+                                TelegramRetryAfter, TelegramServerError)
+from aiogram.types import InlineKeyboardMarkup
+from sqlalchemy import delete, func, select, update
+
+from bot.utils import send_message
+from shared.core.config import settings
+from shared.core.db import session_factory
+from shared.models.outbox import OutboxMessage
+from shared.outbox import outbox_changed
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    def refill(self, now: float) -> None:
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def is_idle(self) -> bool:
+        now = time.monotonic()
+        self.refill(now)
+        return now >= self.paused_until and self.tokens >= self.capacity
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token can be taken"""
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+async def acquire(*buckets: TokenBucket) -> None:
+    """
+    Take a token from every bucket at once. Taking them one after another
+    would let a message that waited for one bucket be sent right after
+    another one, bursting over the first bucket's rate.
+    """
+    while True:
+        now = time.monotonic()
+        wait = max(bucket.wait_time(now) for bucket in buckets)
+        if wait <= 0:
+            for bucket in buckets:
+                bucket.tokens -= 1
+            return
+        await asyncio.sleep(wait)
+
+
+# a capacity of 1 paces the messages evenly, a bigger one would let a burst
+# after an idle period exceed the rate within a second
+global_bucket = TokenBucket(settings.OUTBOX_RATE)
+chat_buckets: dict[int, TokenBucket] = {}
+
+
+def get_chat_bucket(chat_id: int) -> TokenBucket:
+    if chat_id not in chat_buckets:
+        chat_buckets[chat_id] = TokenBucket(settings.OUTBOX_CHAT_RATE)
+    return chat_buckets[chat_id]
+
+
+async def claim_messages() -> list[OutboxMessage]:
+    """
+    Take a batch of due messages. They are leased for settings.OUTBOX_LEASE
+    seconds, so other dispatchers skip them and they come back if this one
+    dies before sending them.
+    """
+    # sending a batch takes up to its size / OUTBOX_RATE seconds, it must be
+    # done well before the lease runs out or another dispatcher sends it again
+    batch_size = min(
+        settings.OUTBOX_BATCH_SIZE,
+        max(1, int(settings.OUTBOX_LEASE * settings.OUTBOX_RATE / 2)),
+    )
+    async with session_factory() as session:
+        due = (
+            select(OutboxMessage.id)
+            .where(OutboxMessage.next_attempt_at <= func.now())
+            .order_by(OutboxMessage.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+            .cte("due")
+        )
+        query = (
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_(select(due.c.id)))
+            .values(
+                attempts=OutboxMessage.attempts + 1,
+                next_attempt_at=func.now()
+                + timedelta(seconds=settings.OUTBOX_LEASE),
+            )
+            .returning(OutboxMessage)
+        )
+        messages = (await session.scalars(query)).all()
+        await session.commit()
+
+    return sorted(messages, key=lambda message: message.id)
+
+
+def retry_delay(message: OutboxMessage, error: Exception) -> float | None:
+    """Back off exponentially, None once the message is out of attempts"""
+    if message.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        logger.warning("Giving up on message %s: %s", message.id, error)
+        return None
+    return min(2**message.attempts, 300)
+
+
+async def deliver(message: OutboxMessage) -> float | None:
+    """
+    Send the message within the rate limits
+
+    Returns:
+        float | None: Seconds to retry the message in, None when it is done
+    """
+    await acquire(global_bucket, get_chat_bucket(message.chat_id))
+
+    try:
+        payload = dict(message.payload)
+        if "reply_markup" in payload:
+            payload["reply_markup"] = InlineKeyboardMarkup.model_validate(
+                payload["reply_markup"]
+            )
+        await send_message(message.chat_id, **payload)
+    except TelegramRetryAfter as e:
+        # OUTBOX_RATE keeps under the global limit, so this is the chat's one
+        get_chat_bucket(message.chat_id).pause(e.retry_after)
+        return e.retry_after
+    except (TelegramBadRequest, TelegramForbiddenError, TelegramNotFound) as e:
+        logger.info("Dropping message %s to %s: %s", message.id, message.chat_id, e)
+        return None
+    except (TelegramNetworkError, TelegramServerError) as e:
+        return retry_delay(message, e)
+    except Exception as e:
+        # anything else may be fixed by then, but must not retry forever
+        logger.exception("Failed to send message %s", message.id)
+        return retry_delay(message, e)
+
+    return None
+
+
+def defer_messages(messages: list[OutboxMessage]) -> dict[int, float]:
+    """
+    Pick the messages to send now, at most one per chat with a token in its
+    bucket, so a paused or busy chat doesn't hold up the batch
+
+    Returns:
+        dict[int, float]: Seconds until the chat's turn by id of the others
+    """
+    deferred = {}
+    earlier = Counter()
+    for message in messages:
+        bucket = get_chat_bucket(message.chat_id)
+        wait = bucket.wait_time(time.monotonic())
+        if wait > 0 or earlier[message.chat_id]:
+            deferred[message.id] = wait + earlier[message.chat_id] / bucket.rate
+        earlier[message.chat_id] += 1
+    return deferred
+
+
+async def dispatch_batch() -> int:
+    messages = await claim_messages()
+    if not messages:
+        return 0
+
+    deferred = defer_messages(messages)
+    sending = [message for message in messages if message.id not in deferred]
+    # deliver handles its errors, so every message's result is recorded
+    delays = await asyncio.gather(*(deliver(message) for message in sending))
+
+    async with session_factory() as session:
+        done_ids = [m.id for m, delay in zip(sending, delays) if delay is None]
+        if done_ids:
+            await session.execute(
+                delete(OutboxMessage).where(OutboxMessage.id.in_(done_ids))
+            )
+        for message, delay in zip(sending, delays):
+            if delay is not None:
+                query = (
+                    update(OutboxMessage)
+                    .where(OutboxMessage.id == message.id)
+                    .values(next_attempt_at=func.now() + timedelta(seconds=delay))
+                )
+                await session.execute(query)
+        for id, delay in deferred.items():
+            # waiting for the chat's turn isn't a failed attempt
+            query = (
+                update(OutboxMessage)
+                .where(OutboxMessage.id == id)
+                .values(
+                    attempts=OutboxMessage.attempts - 1,
+                    next_attempt_at=func.now() + timedelta(seconds=delay),
+                )
+            )
+            await session.execute(query)
+        await session.commit()
+
+    for chat_id in [id for id, bucket in chat_buckets.items() if bucket.is_idle()]:
+        del chat_buckets[chat_id]
+    return len(messages)
+
+
+async def run_outbox() -> None:
+    """
+    Send the queued messages. Run it as a background task in the bot, it
+    wakes up when this process queues a message and every
+    settings.OUTBOX_POLL_INTERVAL seconds.
+    """
+    while True:
+        outbox_changed.clear()
+        try:
+            if await dispatch_batch():
+                continue
+        except Exception:
+            logger.exception("Outbox dispatch failed")
+
+        try:
+            await asyncio.wait_for(
+                outbox_changed.wait(), settings.OUTBOX_POLL_INTERVAL
+            )
+        except asyncio.TimeoutError:
+            pass
@@ -37,3 +37,4 @@ class AppStates(StatesGroup):
     preferences = State()
     update_gender_preferences = State()
     update_age_preferences = State()
+    update_max_distance = State()
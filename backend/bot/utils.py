@@ -1,32 +1,20 @@
 import math
-from math import atan2, cos, radians, sin, sqrt
+from datetime import datetime
+from uuid import UUID
 
 from aiogram import Bot
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.i18n import gettext as _
 from aiogram.utils.media_group import MediaGroupBuilder
 from aiogram.client.session.aiohttp import AiohttpSession
-from aiogram.client.telegram import TEST
+from aiogram.client.telegram import PRODUCTION, TEST, TelegramAPIServer
 
 from shared.core.config import EnvironmentTypes, settings
 from shared.core.db import session_factory
 from shared.enums import FileTypes
+from shared.geo import haversine_distance
 from shared.models.user import User
-from shared.queries import get_city_name
-
-
-
-def haversine_distance(lat1, lon1, lat2, lon2):
-    R = 6371
-
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-
-    a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    distance = R * c
-    return distance
+from shared.queries import Cursor, get_city_name
 
 
 async def get_profile_card(user: User, from_user: User | None = None):
@@ -60,6 +48,19 @@ async def get_profile_card(user: User, from_user: User | None = None):
     return album_builder.build()
 
 
+def dump_cursor(cursor: Cursor) -> list[str]:
+    """Convert a pagination cursor to a form the FSM storage keeps losslessly"""
+    timestamp, id = cursor
+    return [timestamp.isoformat(), str(id)]
+
+
+def load_cursor(value: list[str] | None) -> Cursor | None:
+    if not value:
+        return None
+    timestamp, id = value
+    return datetime.fromisoformat(timestamp), UUID(id)
+
+
 async def clear_state(state: FSMContext, except_locale=False):
     data = {}
     if except_locale:
@@ -68,12 +69,32 @@ async def clear_state(state: FSMContext, except_locale=False):
     await state.set_data(data)
 
 
-async def send_message(*args, **kwargs):
-    bot = Bot(token=settings.BOT_TOKEN)
-    if settings.ENVIRONMENT == EnvironmentTypes.testing:
-        session = AiohttpSession(api=TEST)
+# One bot per process, so requests to the Bot API reuse pooled connections
+bot: Bot | None = None
+
+
+def get_bot() -> Bot:
+    global bot
+
+    if bot is None:
+        api = PRODUCTION
+        if settings.BOT_API_URL:
+            api = TelegramAPIServer.from_base(settings.BOT_API_URL)
+        elif settings.ENVIRONMENT == EnvironmentTypes.testing:
+            api = TEST
+        session = AiohttpSession(api=api, limit=settings.BOT_CONNECTION_LIMIT)
         bot = Bot(token=settings.BOT_TOKEN, session=session)
-    try:
-        await bot.send_message(*args, **kwargs)
-    finally:
-        await bot.session.close()
\ No newline at end of file
+    return bot
+
+
+async def close_bot() -> None:
+    """Close the bot's connections, call it on shutdown"""
+    global bot
+
+    if bot is not None:
+        await bot.session.close()
+        bot = None
+
+
+async def send_message(*args, **kwargs):
+    await get_bot().send_message(*args, **kwargs)
\ No newline at end of file
@@ -0,0 +1,42 @@
+"""Add geo_cell to user_account
+
+Revision ID: 6f2b8c41d0e7
+Revises: 2e3dc8d939a6
+Create Date: 2026-10-18 10:12:44.518203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "6f2b8c41d0e7"
+down_revision: Union[str, None] = "2e3dc8d939a6"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # postgres backfills existing rows when a stored generated column is added
+    op.add_column(
+        "user_account",
+        sa.Column(
+            "geo_cell",
+            sa.Integer(),
+            sa.Computed(
+                "least(floor((latitude + 90) / 0.25), 719)::integer * 1440"
+                " + mod(floor((longitude + 180) / 0.25)::integer, 1440)",
+                persisted=True,
+            ),
+            nullable=False,
+        ),
+    )
+    op.create_index(
+        op.f("ix_user_account_geo_cell"), "user_account", ["geo_cell"], unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_user_account_geo_cell"), table_name="user_account")
+    op.drop_column("user_account", "geo_cell")
@@ -0,0 +1,48 @@
+"""Notify ban changes
+
+Revision ID: e5d93b7f1a26
+Revises: c47a0e9d5f18
+Create Date: 2026-10-18 14:21:53.117480
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "e5d93b7f1a26"
+down_revision: Union[str, None] = "c47a0e9d5f18"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # processes listening on ban_changed refresh their ban registry,
+    # see shared/bans.py
+    op.execute(
+        """
+        CREATE FUNCTION notify_ban_changed() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP <> 'INSERT' THEN
+                PERFORM pg_notify('ban_changed', OLD.user_telegram_id::text);
+            END IF;
+            IF TG_OP <> 'DELETE' THEN
+                PERFORM pg_notify('ban_changed', NEW.user_telegram_id::text);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER ban_changed
+        AFTER INSERT OR UPDATE OR DELETE ON ban
+        FOR EACH ROW EXECUTE FUNCTION notify_ban_changed()
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER ban_changed ON ban")
+    op.execute("DROP FUNCTION notify_ban_changed()")
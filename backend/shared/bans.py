@@ -0,0 +1,188 @@
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timezone
+from typing import Callable
+
+import asyncpg
+from sqlalchemy import ARRAY, BIGINT, all_, bindparam, exists, func, or_, select, true
+
+from shared.core.config import settings
+from shared.core.db import session_factory
+from shared.models.user import Ban, User
+
+logger = logging.getLogger(__name__)
+
+# Postgres channel a trigger on the ban table notifies with the telegram id
+BAN_CHANNEL = "ban_changed"
+# seconds between attempts to reconnect the listening connection
+RECONNECT_DELAY = 5
+
+# Active bans of every process: telegram_id -> expires_at, None if permanent.
+# Bans are rare, so the whole set is kept in memory. Expired bans are removed
+# by a timer driven by expiry_heap, which may hold outdated entries that are
+# skipped when popped.
+banned: dict[int, datetime | None] = {}
+expiry_heap: list[tuple[datetime, int]] = []
+expiry_changed = asyncio.Event()
+
+# The registry is only used while it is in sync with the database, queries
+# fall back to the ban subquery otherwise
+is_loaded = False
+
+# called with the telegram id whenever a user's ban changes
+ban_listeners: list[Callable[[int], None]] = []
+
+refresh_tasks: set[asyncio.Task] = set()
+
+
+def get_active_bans_query():
+    return select(Ban.user_telegram_id, Ban.expires_at).where(
+        or_(Ban.expires_at == None, Ban.expires_at > func.now())
+    )
+
+
+def set_ban(telegram_id: int, expires_at: datetime | None) -> None:
+    banned[telegram_id] = expires_at
+    if expires_at:
+        heapq.heappush(expiry_heap, (expires_at, telegram_id))
+        expiry_changed.set()
+
+
+def add_bans(rows) -> None:
+    for telegram_id, expires_at in rows:
+        # a permanent ban or the one expiring last wins
+        if telegram_id in banned and (
+            banned[telegram_id] is None
+            or (expires_at is not None and expires_at <= banned[telegram_id])
+        ):
+            continue
+        set_ban(telegram_id, expires_at)
+
+
+async def load_bans() -> None:
+    global is_loaded
+
+    async with session_factory() as session:
+        rows = (await session.execute(get_active_bans_query())).all()
+
+    banned.clear()
+    expiry_heap.clear()
+    add_bans(rows)
+    is_loaded = True
+    logger.info("Loaded %s active bans", len(banned))
+
+
+async def refresh_ban(telegram_id: int) -> None:
+    async with session_factory() as session:
+        query = get_active_bans_query().where(Ban.user_telegram_id == telegram_id)
+        rows = (await session.execute(query)).all()
+
+    banned.pop(telegram_id, None)
+    add_bans(rows)
+
+    for listener in ban_listeners:
+        listener(telegram_id)
+
+
+def on_refresh_done(connection: asyncpg.Connection, task: asyncio.Task) -> None:
+    refresh_tasks.discard(task)
+    if task.cancelled() or not task.exception():
+        return
+
+    # the change is lost, reconnecting reloads every ban
+    logger.error("Ban refresh failed", exc_info=task.exception())
+    connection.terminate()
+
+
+def on_notification(connection, pid, channel, payload: str) -> None:
+    task = asyncio.create_task(refresh_ban(int(payload)))
+    refresh_tasks.add(task)
+    task.add_done_callback(lambda task: on_refresh_done(connection, task))
+
+
+async def expire_bans() -> None:
+    while True:
+        now = datetime.now(timezone.utc)
+        while expiry_heap and expiry_heap[0][0] <= now:
+            expires_at, telegram_id = heapq.heappop(expiry_heap)
+            if telegram_id in banned and banned[telegram_id] == expires_at:
+                del banned[telegram_id]
+                for listener in ban_listeners:
+                    listener(telegram_id)
+
+        expiry_changed.clear()
+        timeout = None
+        if expiry_heap:
+            timeout = (expiry_heap[0][0] - now).total_seconds()
+        try:
+            await asyncio.wait_for(expiry_changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_ban_registry() -> None:
+    """
+    Keep the registry in sync with the ban table. Run it as a background task
+    in every process that checks bans.
+    """
+    global is_loaded
+
+    dsn = settings.database_url.replace("postgresql+asyncpg", "postgresql")
+    expiry_task = asyncio.create_task(expire_bans())
+    try:
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(dsn)
+                closed = asyncio.Event()
+                connection.add_termination_listener(lambda _: closed.set())
+                # listen before loading, so no change is missed in between
+                await connection.add_listener(BAN_CHANNEL, on_notification)
+                await load_bans()
+                await closed.wait()
+            except Exception:
+                logger.exception("Ban registry connection failed")
+            finally:
+                is_loaded = False
+                if connection is not None:
+                    connection.terminate()
+            await asyncio.sleep(RECONNECT_DELAY)
+    finally:
+        expiry_task.cancel()
+
+
+def get_banned_ids() -> list[int]:
+    now = datetime.now(timezone.utc)
+    return [
+        telegram_id
+        for telegram_id, expires_at in banned.items()
+        if expires_at is None or expires_at > now
+    ]
+
+
+def is_banned(telegram_id: int) -> bool:
+    """Registry lookup, only meaningful while is_loaded is set"""
+    if telegram_id not in banned:
+        return False
+    expires_at = banned[telegram_id]
+    return expires_at is None or expires_at > datetime.now(timezone.utc)
+
+
+def get_not_banned_clause(telegram_id_column=User.telegram_id):
+    """
+    Clause excluding banned users. Uses the ids from the registry, or the ban
+    subquery while the registry is not loaded.
+    """
+    if not is_loaded:
+        return ~exists().where(
+            Ban.user_telegram_id == telegram_id_column,
+            or_(Ban.expires_at == None, Ban.expires_at > func.now()),
+        )
+
+    banned_ids = get_banned_ids()
+    if not banned_ids:
+        return true()
+
+    banned_ids = bindparam("banned_ids", banned_ids, type_=ARRAY(BIGINT))
+    return telegram_id_column != all_(banned_ids)
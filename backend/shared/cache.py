@@ -0,0 +1,72 @@
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+
+from sqlalchemy import exc
+from sqlalchemy.orm import Session
+
+from shared.core.config import settings
+from shared.models.user import User
+from shared.queries import get_user
+
+# telegram_id -> (expires_at, user). Users are loaded with their media and
+# preferences and are never handed out directly, callers get copies they are
+# free to modify or add to a session.
+users: OrderedDict[int, tuple[float, User]] = OrderedDict()
+
+# users already returned while handling the current update, so every filter
+# and handler of the update sees the same instance
+request_users: ContextVar[dict[int, User] | None] = ContextVar(
+    "request_users", default=None
+)
+
+
+def copy_user(user: User) -> User:
+    """Return a detached copy of the user with its loaded relationships"""
+    session = Session()
+    copy = session.merge(user, load=False)
+    session.expunge_all()
+    return copy
+
+
+async def get_cached_user(telegram_id: int, is_active: bool | None = None) -> User:
+    """
+    Cached get_user(telegram_id=...) with media and preferences loaded.
+    Entries live for settings.USER_CACHE_TTL seconds unless invalidated earlier.
+
+    Raises:
+        NoResultFound: Same as get_user
+    """
+    request_cache = request_users.get()
+    if request_cache is not None and telegram_id in request_cache:
+        user = request_cache[telegram_id]
+    else:
+        entry = users.get(telegram_id)
+        if not entry or entry[0] < time.monotonic():
+            cached_user = await get_user(
+                telegram_id=telegram_id, with_media=True, with_preferences=True
+            )
+            expires_at = time.monotonic() + settings.USER_CACHE_TTL
+            users[telegram_id] = (expires_at, cached_user)
+            users.move_to_end(telegram_id)
+            while len(users) > settings.USER_CACHE_SIZE:
+                users.popitem(last=False)
+        else:
+            cached_user = entry[1]
+
+        user = copy_user(cached_user)
+        if request_cache is not None:
+            request_cache[telegram_id] = user
+
+    if is_active is not None and user.is_active != is_active:
+        raise exc.NoResultFound()
+    return user
+
+
+def invalidate_user(telegram_id: int) -> None:
+    """Drop the cached user, call it after every change to the user's row"""
+    users.pop(telegram_id, None)
+
+    request_cache = request_users.get()
+    if request_cache is not None:
+        request_cache.pop(telegram_id, None)
@@ -4,6 +4,8 @@ from urllib.parse import quote_plus
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+from shared.enums import BackplaneTypes, ScoringModes
+
 
 class EnvironmentTypes(Enum):
     development = "development"
@@ -17,6 +19,9 @@ class Settings(BaseSettings):
     BASE_DIR: Path = Path(__file__).resolve().parent.parent.parent
 
     BOT_TOKEN: str
+    # base URL of a local Bot API server, e.g. http://localhost:8081
+    BOT_API_URL: str | None = None
+    BOT_CONNECTION_LIMIT: int = 100
 
     POSTGRES_USER: str
     POSTGRES_PASSWORD: str
@@ -28,6 +33,7 @@ class Settings(BaseSettings):
     MONGO_ADMIN: str
     MONGO_PASSWORD: str
     MONGO_REMOTE: bool = False
+    MONGO_DB: str = "anordating"
 
     MEDIA_PATH: Path = BASE_DIR / "media"
     DOMAIN: str
@@ -48,6 +54,49 @@ class Settings(BaseSettings):
     # App settings
     REWIND_LIMIT: int = 5
     DEFAULT_RATING: int = 1400
+    SCORING_MODE: ScoringModes = ScoringModes.database
+    SWIPE_DECK_SIZE: int = 20
+    SWIPE_DECK_LOW_WATER: int = 5
+    MATCH_SEARCH_RADII: list[int] = [10, 25, 50]
+    EXCLUSION_CACHE_SIZE: int = 2000
+    USER_CACHE_TTL: int = 30
+    USER_CACHE_SIZE: int = 10000
+
+    # Geocoding settings
+    GOOGLE_API_KEY: str = ""
+    GEOCODING_URL: str = "https://maps.googleapis.com/maps/api/geocode/json"
+    GEOCODING_TIMEOUT: float = 10
+    GEOCODING_CONNECT_TIMEOUT: float = 3
+    GEOCODING_CONCURRENCY: int = 10
+    GEOCODING_RETRIES: int = 2
+    GEOCODING_BACKOFF: float = 0.5
+    GEOCODING_CACHE_TTL: int = 30 * 24 * 60 * 60
+    GEOCODING_CACHE_SIZE: int = 10000
+    # degrees reverse geocoding coordinates are rounded to, 0.01 is about 1 km
+    GEOCODING_GRID: float = 0.01
+    # localities CSV resolving shared locations offline, see shared.gazetteer
+    GAZETTEER_PATH: Path | None = None
+    GAZETTEER_MAX_DISTANCE: float = 30
+    PLACE_NAME_BACKFILL_INTERVAL: int = 10 * 60
+
+    # Notification outbox settings, Telegram allows about 30 messages per
+    # second overall and 1 per second to a chat
+    OUTBOX_RATE: float = 25
+    OUTBOX_CHAT_RATE: float = 1
+    OUTBOX_BATCH_SIZE: int = 100
+    OUTBOX_POLL_INTERVAL: float = 1
+    OUTBOX_LEASE: int = 60
+    OUTBOX_MAX_ATTEMPTS: int = 8
+
+    # Relays websocket messages between API workers, see api.backplane
+    WEBSOCKET_BACKPLANE: BackplaneTypes = BackplaneTypes.postgres
+    WEBSOCKET_PRESENCE_INTERVAL: float = 10
+    WEBSOCKET_SEND_QUEUE_SIZE: int = 100
+    WEBSOCKET_SEND_TIMEOUT: float = 10
+    # Delivery and read acks are coalesced and written every interval, or
+    # sooner once this many chat members have pending acks
+    WEBSOCKET_ACK_FLUSH_INTERVAL: float = 1
+    WEBSOCKET_ACK_BATCH_SIZE: int = 500
 
     model_config = SettingsConfigDict(env_file="../.env", extra="ignore")
 
@@ -0,0 +1,10 @@
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from shared.core.config import settings
+
+mongo_client = AsyncIOMotorClient(
+    host=settings.mongo_url,
+    uuidRepresentation="standard",
+)
+
+mongo_db = mongo_client[settings.MONGO_DB]
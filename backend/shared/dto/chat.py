@@ -2,10 +2,11 @@ from datetime import datetime
 from typing import Annotated
 from uuid import UUID
 
-from pydantic import AfterValidator, BaseModel
+from pydantic import AfterValidator, BaseModel, ConfigDict
 
 from shared.validators import validate_message_text
 from shared.dto.base import BaseModelWithOrm
+from shared.enums import Genders
 from shared.models.chat import Chat, Message
 
 
@@ -45,5 +46,35 @@ class MessageDTO(MessageAddDTO):
 class ChatMemberDTO(BaseModel):
     user_id: UUID
     chat_id: int
+    last_read_message_id: int | None
+    last_delivered_message_id: int | None
     created_at: datetime
     updated_at: datetime
+
+
+class ChatReadDTO(BaseModel):
+    message_id: int
+
+
+class ChatPeerDTO(BaseModel):
+    """The public profile of the other member of a chat"""
+
+    id: UUID
+    name: str
+    age: int
+    gender: Genders
+    bio: str | None
+    is_active: bool
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class InboxChatDTO(BaseModel):
+    id: int
+    peer: ChatPeerDTO
+    last_message: MessageDTO | None
+    unread_count: int
+    last_read_message_id: int | None
+    peer_last_read_message_id: int | None
+    peer_last_delivered_message_id: int | None
+    last_activity_at: datetime
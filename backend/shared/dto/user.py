@@ -21,6 +21,7 @@ class PreferenceAddDTO(BaseModelWithOrm[Preferences]):
     min_age: Annotated[int | None, AfterValidator(validate_preference_age)]
     max_age: Annotated[int | None, AfterValidator(validate_preference_age)]
     preferred_gender: PreferredGenders
+    max_distance_km: int | None = None
 
     @model_validator(mode="after")
     def validate_min_max_age(self):
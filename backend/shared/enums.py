@@ -39,3 +39,15 @@ class ReportStatusTypes(str, Enum):
     invalid = "invalid"
     resolved = "resolved"
     closed = "closed"
+
+
+class ScoringModes(str, Enum):
+    python = "python"
+    database = "database"
+    numpy = "numpy"
+
+
+class BackplaneTypes(str, Enum):
+    # a single API worker
+    local = "local"
+    postgres = "postgres"
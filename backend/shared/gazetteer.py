@@ -0,0 +1,108 @@
+import csv
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from shared.core.config import settings
+from shared.enums import UILanguages
+from shared.geo import get_geo_cells_within
+from shared.matching.vectorized import get_geo_cells, haversine_distances
+
+logger = logging.getLogger(__name__)
+
+# The gazetteer is a CSV file of localities with a header row:
+# place_id,latitude,longitude,name_en,name_ru,name_uz
+# place_id is the Google place id of the locality, so places resolved offline
+# are the same Place rows as the ones found by the remote API. Empty names are
+# looked up remotely.
+
+
+@dataclass
+class Gazetteer:
+    """
+    Localities sorted by their shared.geo grid cell, so the ones in a cell
+    are a contiguous slice found by a binary search over `cells`
+    """
+
+    cells: np.ndarray
+    latitudes: np.ndarray
+    longitudes: np.ndarray
+    place_ids: list[str]
+    names: dict[UILanguages, list[str]]
+    rows: dict[str, int]
+
+    def find_place_id(self, latitude: float, longitude: float) -> str | None:
+        """Return the nearest locality within settings.GAZETTEER_MAX_DISTANCE km"""
+        cells = np.asarray(
+            get_geo_cells_within(latitude, longitude, settings.GAZETTEER_MAX_DISTANCE)
+        )
+        starts = np.searchsorted(self.cells, cells, side="left")
+        ends = np.searchsorted(self.cells, cells, side="right")
+        ranges = [
+            np.arange(start, end) for start, end in zip(starts, ends) if end > start
+        ]
+        if not ranges:
+            return None
+
+        candidates = np.concatenate(ranges)
+        distances = haversine_distances(
+            latitude,
+            longitude,
+            self.latitudes[candidates],
+            self.longitudes[candidates],
+        )
+        nearest = distances.argmin()
+        if distances[nearest] > settings.GAZETTEER_MAX_DISTANCE:
+            return None
+        return self.place_ids[candidates[nearest]]
+
+    def get_name(self, place_id: str, language: UILanguages) -> str | None:
+        row = self.rows.get(place_id)
+        if row is None:
+            return None
+        return self.names[language][row] or None
+
+
+def load_gazetteer(path: Path) -> Gazetteer:
+    with open(path, newline="", encoding="utf-8") as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        columns = list(zip(*reader)) or [()] * len(header)
+    columns = dict(zip(header, columns))
+
+    latitudes = np.array(columns["latitude"], dtype=np.float64)
+    longitudes = np.array(columns["longitude"], dtype=np.float64)
+    cells = get_geo_cells(latitudes, longitudes)
+    order = np.argsort(cells, kind="stable")
+
+    def sort(values) -> list[str]:
+        return [values[i] for i in order.tolist()]
+
+    place_ids = sort(columns["place_id"])
+    empty = [""] * len(place_ids)
+    return Gazetteer(
+        cells=cells[order],
+        latitudes=latitudes[order],
+        longitudes=longitudes[order],
+        place_ids=place_ids,
+        names={
+            language: sort(columns.get(f"name_{language.name}", empty))
+            for language in UILanguages
+        },
+        rows={place_id: row for row, place_id in enumerate(place_ids)},
+    )
+
+
+gazetteer: Gazetteer | None = None
+
+
+def get_gazetteer() -> Gazetteer | None:
+    """Return the gazetteer from settings.GAZETTEER_PATH, loading it on first use"""
+    global gazetteer
+
+    if gazetteer is None and settings.GAZETTEER_PATH:
+        gazetteer = load_gazetteer(settings.GAZETTEER_PATH)
+        logger.info("Loaded %s localities into the gazetteer", len(gazetteer.place_ids))
+    return gazetteer
@@ -0,0 +1,62 @@
+from math import asin, atan2, cos, degrees, floor, radians, sin, sqrt
+
+EARTH_RADIUS = 6371
+
+# The globe is split into a grid of GEO_CELL_SIZE x GEO_CELL_SIZE degree cells
+# numbered row by row from the south-west corner. User.geo_cell is computed by
+# the database with the same formula.
+GEO_CELL_SIZE = 0.25
+GEO_CELL_ROWS = int(180 / GEO_CELL_SIZE)
+GEO_CELL_COLUMNS = int(360 / GEO_CELL_SIZE)
+GEO_CELL_EXPRESSION = (
+    f"least(floor((latitude + 90) / {GEO_CELL_SIZE}), {GEO_CELL_ROWS - 1})::integer"
+    f" * {GEO_CELL_COLUMNS}"
+    f" + mod(floor((longitude + 180) / {GEO_CELL_SIZE})::integer, {GEO_CELL_COLUMNS})"
+)
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    R = EARTH_RADIUS
+
+    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
+    c = 2 * atan2(sqrt(a), sqrt(1 - a))
+    distance = R * c
+    return distance
+
+
+def get_geo_cell(latitude: float, longitude: float) -> int:
+    row = min(floor((latitude + 90) / GEO_CELL_SIZE), GEO_CELL_ROWS - 1)
+    column = floor((longitude + 180) / GEO_CELL_SIZE) % GEO_CELL_COLUMNS
+    return row * GEO_CELL_COLUMNS + column
+
+
+def get_geo_cells_within(latitude: float, longitude: float, radius: float) -> list[int]:
+    """
+    Return the grid cells covering every point within `radius` km of the
+    given point. The cells cover the bounding box of the circle, so some
+    points a little further away are covered as well.
+    """
+    lat_delta = degrees(radius / EARTH_RADIUS)
+    min_row = max(floor((latitude - lat_delta + 90) / GEO_CELL_SIZE), 0)
+    max_row = min(floor((latitude + lat_delta + 90) / GEO_CELL_SIZE), GEO_CELL_ROWS - 1)
+
+    # the circle contains a pole or is wider than a hemisphere at this latitude
+    angle = radius / EARTH_RADIUS
+    if abs(latitude) + lat_delta >= 90 or sin(angle) >= cos(radians(latitude)):
+        columns = range(GEO_CELL_COLUMNS)
+    else:
+        lon_delta = degrees(asin(sin(angle) / cos(radians(latitude))))
+        first = floor((longitude - lon_delta + 180) / GEO_CELL_SIZE)
+        last = floor((longitude + lon_delta + 180) / GEO_CELL_SIZE)
+        count = min(last - first + 1, GEO_CELL_COLUMNS)
+        columns = [(first + i) % GEO_CELL_COLUMNS for i in range(count)]
+
+    return [
+        row * GEO_CELL_COLUMNS + column
+        for row in range(min_row, max_row + 1)
+        for column in columns
+    ]
@@ -1,59 +1,256 @@
-import os
+import asyncio
+import logging
+import random
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable
 
-import googlemaps
-from dotenv import load_dotenv
-from googlemaps.geocoding import geocode, reverse_geocode
+import aiohttp
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
 
+from shared.core.config import settings
+from shared.core.db import session_factory
 from shared.enums import UILanguages
+from shared.gazetteer import get_gazetteer
+from shared.models.user import GeocodingCache
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
+# Statuses of the Geocoding API worth retrying, the others are final
+RETRY_STATUSES = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR"}
 
-def get_maps_client() -> googlemaps.Client:
-    return googlemaps.Client(key=os.getenv("GOOGLE_API_KEY"))
+# One session per process, so connections to the API are pooled and reused
+http_session: aiohttp.ClientSession | None = None
+semaphore = asyncio.Semaphore(settings.GEOCODING_CONCURRENCY)
 
+# Results are cached in two tiers, key -> (expires_at, value) in process and
+# the geocoding_cache table shared by every process. Both expire after
+# settings.GEOCODING_CACHE_TTL seconds. Failed lookups are never cached.
+results: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+cache_stats: Counter[str] = Counter()
 
-def get_place_id(latitude: float, longitude: float) -> str | None:
-    client = get_maps_client()
-    result = reverse_geocode(
-        client,
-        (latitude, longitude),
-        result_type=["locality", "administrative_area_level_2"],
+
+class GeocodingError(Exception):
+    pass
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    global http_session
+
+    if http_session is None or http_session.closed:
+        http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=settings.GEOCODING_CONCURRENCY, ttl_dns_cache=300
+            ),
+            timeout=aiohttp.ClientTimeout(
+                total=settings.GEOCODING_TIMEOUT,
+                connect=settings.GEOCODING_CONNECT_TIMEOUT,
+            ),
+        )
+    return http_session
+
+
+async def close_http_session() -> None:
+    """Close the pooled connections, call it on shutdown"""
+    if http_session is not None and not http_session.closed:
+        await http_session.close()
+
+
+async def request_geocoding(params: dict[str, str]) -> list[dict]:
+    """
+    Call the Geocoding API and return its results. At most
+    settings.GEOCODING_CONCURRENCY requests run at once, timeouts, server
+    errors and rate limiting are retried with exponential backoff.
+
+    Raises:
+        GeocodingError: The request was rejected or kept failing
+    """
+    params = {**params, "key": settings.GOOGLE_API_KEY}
+    error = None
+    for attempt in range(settings.GEOCODING_RETRIES + 1):
+        if attempt:
+            delay = settings.GEOCODING_BACKOFF * 2 ** (attempt - 1)
+            await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+
+        try:
+            async with semaphore:
+                async with get_http_session().get(
+                    settings.GEOCODING_URL, params=params
+                ) as response:
+                    if response.status == 429 or response.status >= 500:
+                        error = f"HTTP {response.status}"
+                        continue
+                    if response.status >= 400:
+                        # a ClientResponseError would be retried below
+                        raise GeocodingError(f"HTTP {response.status}")
+                    body = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = repr(e)
+            continue
+
+        status = body.get("status")
+        if status in ("OK", "ZERO_RESULTS"):
+            return body.get("results", [])
+        if status not in RETRY_STATUSES:
+            raise GeocodingError(f"{status}: {body.get('error_message', '')}")
+        error = status
+
+    logger.warning("Geocoding failed after %s attempts: %s", attempt + 1, error)
+    raise GeocodingError(error)
+
+
+def remember(key: str, value: Any) -> None:
+    results[key] = (time.monotonic() + settings.GEOCODING_CACHE_TTL, value)
+    results.move_to_end(key)
+    while len(results) > settings.GEOCODING_CACHE_SIZE:
+        results.popitem(last=False)
+
+
+async def get_cached(key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+    """Return the cached value of the key, calling fetch on a miss of both tiers"""
+    entry = results.get(key)
+    if entry and entry[0] > time.monotonic():
+        results.move_to_end(key)
+        cache_stats["memory_hits"] += 1
+        return entry[1]
+
+    async with session_factory() as session:
+        query = select(GeocodingCache).where(
+            GeocodingCache.key == key,
+            GeocodingCache.expires_at > datetime.now(timezone.utc),
+        )
+        row = (await session.scalars(query)).one_or_none()
+    if row:
+        cache_stats["db_hits"] += 1
+        remember(key, row.value)
+        return row.value
+
+    cache_stats["misses"] += 1
+    value = await fetch()
+    remember(key, value)
+
+    expires_at = datetime.now(timezone.utc) + timedelta(
+        seconds=settings.GEOCODING_CACHE_TTL
     )
+    async with session_factory() as session:
+        query = (
+            insert(GeocodingCache)
+            .values(key=key, value=value, expires_at=expires_at)
+            .on_conflict_do_update(
+                index_elements=["key"],
+                set_={"value": value, "expires_at": expires_at},
+            )
+        )
+        await session.execute(query)
+        await session.commit()
+    return value
+
+
+def get_cache_stats() -> dict[str, float]:
+    lookups = cache_stats.total()
+    hits = cache_stats["memory_hits"] + cache_stats["db_hits"]
+    return {
+        **cache_stats,
+        "size": len(results),
+        "hit_rate": hits / lookups if lookups else 0,
+    }
+
+
+async def get_place_id(latitude: float, longitude: float) -> str | None:
+    gazetteer = get_gazetteer()
+    if gazetteer:
+        place_id = gazetteer.find_place_id(latitude, longitude)
+        if place_id:
+            return place_id
+
+    # nearby points share a cache entry, so the lookup is done for the cell
+    grid = settings.GEOCODING_GRID
+    latitude, longitude = round(latitude / grid), round(longitude / grid)
+
+    async def fetch() -> str | None:
+        result = await request_geocoding(
+            {
+                "latlng": f"{latitude * grid:.6f},{longitude * grid:.6f}",
+                "result_type": "locality|administrative_area_level_2",
+            }
+        )
+        try:
+            return result[0]["place_id"]
+        except (IndexError, KeyError):
+            return None
+
     try:
-        return result[0]["place_id"]
-    except (IndexError, KeyError):
+        return await get_cached(f"reverse:{grid}:{latitude}:{longitude}", fetch)
+    except GeocodingError:
+        # the place is optional, the location itself is enough
         return None
 
 
-def get_places(
+async def get_places(
     city_name: str, language: UILanguages = UILanguages.en, max_results: int = 5
 ) -> list[tuple[str, str]]:
-    client = get_maps_client()
-    result = geocode(client, city_name, language=language.name)
-    cities = []
-    for res in result:
-        if "locality" in res["types"] or "administrative_area_level_2" in res["types"]:
-            cities.append(
-                (
-                    res["formatted_address"],
-                    res["place_id"],
+    """
+    Raises:
+        GeocodingError: Same as request_geocoding
+    """
+    city_name = " ".join(city_name.casefold().split())
+
+    async def fetch() -> list[tuple[str, str]]:
+        result = await request_geocoding(
+            {"address": city_name, "language": language.name}
+        )
+        cities = []
+        for res in result:
+            if (
+                "locality" in res["types"]
+                or "administrative_area_level_2" in res["types"]
+            ):
+                cities.append(
+                    (
+                        res["formatted_address"],
+                        res["place_id"],
+                    )
                 )
-            )
+        return cities
 
-    return cities[:max_results]
+    cities = await get_cached(f"search:{language.name}:{city_name}", fetch)
+    return [(city, place_id) for city, place_id in cities[:max_results]]
 
 
-def get_place(
+async def get_place(
     place_id: str, language: UILanguages = UILanguages.en
 ) -> tuple[float, float, str]:
-    client = get_maps_client()
-    result = geocode(client, place_id=place_id, language=language.name)
+    """
+    Raises:
+        ValueError: The place wasn't found or couldn't be looked up
+    """
     try:
+        result = await request_geocoding(
+            {"place_id": place_id, "language": language.name}
+        )
         return (
             result[0]["geometry"]["location"]["lat"],
             result[0]["geometry"]["location"]["lng"],
             result[0]["address_components"][0]["long_name"],
         )
-    except (IndexError, KeyError):
+    except (IndexError, KeyError, GeocodingError):
         raise ValueError("Location not found")
+
+
+async def get_place_name(place_id: str, language: UILanguages) -> str:
+    """
+    Return the place's name from the gazetteer, or from the remote API when
+    the gazetteer doesn't have it
+
+    Raises:
+        ValueError: Same as get_place
+    """
+    gazetteer = get_gazetteer()
+    name = gazetteer.get_name(place_id, language) if gazetteer else None
+    if name:
+        return name
+
+    _, _, name = await get_place(place_id, language)
+    return name
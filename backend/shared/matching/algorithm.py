@@ -1,107 +1,134 @@
-from dataclasses import dataclass
+from math import cos, radians
+from typing import Collection, Sequence
+from uuid import UUID
 
-from sqlalchemy import and_, exists, func, or_, select
+import numpy as np
+from sqlalchemy import (ARRAY, Numeric, all_, and_, bindparam, cast, exists,
+                        func, or_, select)
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
 
-from bot.utils import haversine_distance
+from shared.bans import get_not_banned_clause
+from shared.core.config import settings
 from shared.core.db import session_factory
-from shared.enums import PreferredGenders, ReactionType
-from shared.models.user import Ban, Preferences, Reaction, Report, User
-
+from shared.enums import PreferredGenders, ReactionType, ScoringModes
+from shared.geo import get_geo_cells_within, haversine_distance
+from shared.matching.exclusions import get_excluded_ids
+from shared.matching.vectorized import score_pool
+from shared.matching.weights import (
+    BASE_RATING,
+    EARTH_RADIUS,
+    MAX_AGE_DIFF,
+    MAX_DISTANCE,
+    RATING_RANGE,
+    ScoreWeights,
+    SimilarityWeights,
+)
+from shared.models.user import Preferences, Reaction, Report, User
+
+
+def get_potential_matches_query(
+    current_user: User, excluded_ids: Collection[UUID] | None = None
+):
+    """
+    Build the query selecting every user that can be shown to current_user.
+    Preferences of current_user must already be loaded.
 
-async def get_potential_matches(current_user: User):
-    assert current_user.is_active
+    excluded_ids are the ids from get_excluded_ids. When they are not given,
+    reactions and reports are checked with subqueries instead.
+    """
+    query = (
+        select(User)
+        .join(Preferences)
+        .where(
+            User.id != current_user.id,
+            User.is_active,
+            or_(
+                Preferences.preferred_gender == current_user.gender,
+                Preferences.preferred_gender == PreferredGenders.both,
+            ),
+            get_not_banned_clause(),
+        )
+    )
 
-    async with session_factory() as session:
-        session.add(current_user)
-        await current_user.awaitable_attrs.preferences
-
-        query = (
-            select(User)
-            .join(Preferences)
-            .where(
-                User.id != current_user.id,
-                User.is_active,
-                or_(
-                    Preferences.preferred_gender == current_user.gender,
-                    Preferences.preferred_gender == PreferredGenders.both,
-                ),
-                ~exists().where(
-                    and_(
-                        Reaction.from_user_id == current_user.id,
-                        Reaction.to_user_id == User.id,
-                    )
-                ),
-                ~exists().where(
-                    and_(
-                        Reaction.from_user_id == User.id,
-                        Reaction.to_user_id == current_user.id,
-                        Reaction.reaction_type == ReactionType.dislike,
-                    )
-                ),
-                ~exists().where(
-                    and_(
-                        Report.from_user_id == current_user.id,
-                        Report.to_user_id == User.id,
-                    )
-                ),
-                ~exists().where(
-                    and_(
-                        Report.from_user_id == User.id,
-                        Report.to_user_id == current_user.id,
-                    )
-                ),
-                ~exists().where(
-                    and_(
-                        Ban.user_telegram_id == User.telegram_id,
-                        or_(Ban.expires_at == None, Ban.expires_at > func.now()),
-                    )
+    if excluded_ids is not None:
+        excluded_ids = bindparam(
+            "excluded_ids", list(excluded_ids), type_=ARRAY(PG_UUID(as_uuid=True))
+        )
+        query = query.where(User.id != all_(excluded_ids))
+    else:
+        query = query.where(
+            ~exists().where(
+                and_(
+                    Reaction.from_user_id == current_user.id,
+                    Reaction.to_user_id == User.id,
                 )
-            )
+            ),
+            ~exists().where(
+                and_(
+                    Reaction.from_user_id == User.id,
+                    Reaction.to_user_id == current_user.id,
+                    Reaction.reaction_type == ReactionType.dislike,
+                )
+            ),
+            ~exists().where(
+                and_(
+                    Report.from_user_id == current_user.id,
+                    Report.to_user_id == User.id,
+                )
+            ),
+            ~exists().where(
+                and_(
+                    Report.from_user_id == User.id,
+                    Report.to_user_id == current_user.id,
+                )
+            ),
         )
 
-        min_age, max_age = (
-            current_user.preferences.min_age,
-            current_user.preferences.max_age,
+    min_age, max_age = (
+        current_user.preferences.min_age,
+        current_user.preferences.max_age,
+    )
+    if min_age and max_age:
+        query = query.where(User.age_between(min_age, max_age))
+
+    if not current_user.preferences.preferred_gender == PreferredGenders.both:
+        query = query.where(
+            User.gender == current_user.preferences.preferred_gender,
         )
-        if min_age and max_age:
-            query = query.where(User.age.between(min_age, max_age))
 
-        if not current_user.preferences.preferred_gender == PreferredGenders.both:
-            query = query.where(
-                User.gender == current_user.preferences.preferred_gender,
-            )
+    max_distance = current_user.preferences.max_distance_km
+    if max_distance:
+        # the indexed cell lookup narrows the rows, the exact distance trims
+        # the corners of the covered cells
+        cells = get_geo_cells_within(
+            current_user.latitude, current_user.longitude, max_distance
+        )
+        query = query.where(
+            User.geo_cell.in_(cells),
+            get_distance_expression(current_user.latitude, current_user.longitude)
+            <= max_distance,
+        )
 
-        res = await session.scalars(query)
-        potential_matches = res.all()
-        return potential_matches
+    return query
 
 
 def calculate_age_similarity(age1: int, age2: int):
-    max_age_diff = 10
     age_diff = abs(age1 - age2)
-    age_score = max(0, 1 - (age_diff / max_age_diff))
+    age_score = max(0, 1 - (age_diff / MAX_AGE_DIFF))
 
     return age_score
 
 
 def calculate_location_similarity(lat1, lon1, lat2, lon2):
     distance = haversine_distance(lat1, lon1, lat2, lon2)
-    max_distance = 50
-    location_score = max(0, 1 - (distance / max_distance))
+    location_score = max(0, 1 - (distance / MAX_DISTANCE))
 
     return location_score
 
 
-async def calculate_similarity(current_user: User, potential_match: User) -> float:
-    async with session_factory() as session:
-        session.add(current_user)
-        await current_user.awaitable_attrs.preferences
-
-    @dataclass
-    class SimilarityWeights:
-        location = 0.6
-        age = 0.4
-
+def calculate_similarity(
+    current_user: User, preferences: Preferences, potential_match: User
+) -> float:
     total_score, total_weight = 0, 0
 
     total_score += (
@@ -115,7 +142,7 @@ async def calculate_similarity(current_user: User, potential_match: User) -> flo
     )
     total_weight += SimilarityWeights.location
 
-    if not current_user.preferences.min_age:
+    if not preferences.min_age:
         total_score += (
             calculate_age_similarity(current_user.age, potential_match.age)
             * SimilarityWeights.age
@@ -129,29 +156,24 @@ async def calculate_similarity(current_user: User, potential_match: User) -> flo
     return round(final_score, 2)
 
 
-async def calculate_total_score(user1: User, user2: User) -> float:
+def calculate_total_score(
+    user1: User, preferences: Preferences, user2: User
+) -> float:
     """
     Calculate total score combining similarity and Elo rating.
     Returns a score between 0 and 1.
 
     Args:
         user1: First user
+        preferences: Preferences of the first user
         user2: Second user
-        weights: Optional custom weights for different factors
 
     Returns:
         float: Combined score between 0 and 1
     """
+    similarity_score = calculate_similarity(user1, preferences, user2)
 
-    @dataclass
-    class ScoreWeights:
-        similarity = 0.6
-        rating = 0.4
-
-    similarity_score = await calculate_similarity(user1, user2)
-
-    rating_range = 800
-    normalized_rating = (user2.rating - 1000) / rating_range
+    normalized_rating = (user2.rating - BASE_RATING) / RATING_RANGE
     normalized_rating = max(0, min(1, normalized_rating))
 
     total_score = (
@@ -162,17 +184,178 @@ async def calculate_total_score(user1: User, user2: User) -> float:
     return round(total_score, 3)
 
 
-async def get_best_match(current_user: User):
+def score_candidates(
+    current_user: User, preferences: Preferences, candidates: Sequence[User]
+) -> list[float]:
+    """
+    Score a batch of candidates against current_user. Does no I/O, so
+    preferences and every attribute used for scoring must already be loaded.
+
+    Returns:
+        list[float]: Total score of each candidate, in the order given
+    """
+    return [
+        calculate_total_score(current_user, preferences, candidate)
+        for candidate in candidates
+    ]
+
+
+def get_distance_expression(latitude: float, longitude: float):
+    """SQL counterpart of haversine_distance to User's location"""
+    lat1, lon1 = radians(latitude), radians(longitude)
+    lat2, lon2 = func.radians(User.latitude), func.radians(User.longitude)
+
+    a = func.power(func.sin((lat2 - lat1) / 2), 2) + cos(lat1) * func.cos(
+        lat2
+    ) * func.power(func.sin((lon2 - lon1) / 2), 2)
+    return EARTH_RADIUS * 2 * func.atan2(func.sqrt(a), func.sqrt(1 - a))
+
+
+def get_location_similarity_expression(latitude: float, longitude: float):
+    """SQL counterpart of calculate_location_similarity against User's location"""
+    distance = get_distance_expression(latitude, longitude)
+    return func.greatest(0, 1 - distance / float(MAX_DISTANCE))
+
+
+def get_age_similarity_expression(age: int):
+    """SQL counterpart of calculate_age_similarity against User's age"""
+    return func.greatest(0, 1 - func.abs(User.age - age) / float(MAX_AGE_DIFF))
+
+
+def get_similarity_expression(current_user: User, preferences: Preferences):
+    """SQL counterpart of calculate_similarity"""
+    total_score = (
+        get_location_similarity_expression(
+            current_user.latitude, current_user.longitude
+        )
+        * SimilarityWeights.location
+    )
+    total_weight = SimilarityWeights.location
+
+    if not preferences.min_age:
+        total_score += (
+            get_age_similarity_expression(current_user.age) * SimilarityWeights.age
+        )
+        total_weight += SimilarityWeights.age
+
+    return func.round(cast(total_score / total_weight, Numeric), 2)
+
+
+def get_total_score_expression(current_user: User, preferences: Preferences):
+    """
+    SQL counterpart of calculate_total_score, so candidates can be ranked
+    by the database. Both implementations round at the same steps. Postgres
+    rounds ties half away from zero while Python rounds the binary float, so
+    a score lying on a rounding tie can differ in the last digit.
+    """
+    normalized_rating = func.greatest(
+        0, func.least(1, (User.rating - BASE_RATING) / float(RATING_RANGE))
+    )
+
+    similarity_score = get_similarity_expression(current_user, preferences)
+    total_score = (
+        similarity_score * ScoreWeights.similarity
+        + normalized_rating * ScoreWeights.rating
+    )
+    return func.round(cast(total_score, Numeric), 3)
+
+
+async def rank_candidates(
+    session, query, current_user: User, preferences: Preferences, limit: int
+) -> list[User]:
+    """
+    Rank the users selected by `query` and return the best `limit` of them.
+    See get_best_matches for the scoring modes.
+    """
+    if settings.SCORING_MODE == ScoringModes.database:
+        score = get_total_score_expression(current_user, preferences).label("score")
+        query = query.add_columns(score).order_by(score.desc()).limit(limit)
+        res = await session.execute(query)
+        return [match for match, score in res.all() if score > 0]
+
+    if settings.SCORING_MODE == ScoringModes.numpy:
+        query = query.with_only_columns(
+            User.id, User.latitude, User.longitude, User.birth_date, User.rating
+        )
+        rows = (await session.execute(query)).all()
+        if not rows:
+            return []
+
+        ids, latitudes, longitudes, birth_dates, ratings = zip(*rows)
+        _, best_indices = score_pool(
+            current_user,
+            preferences,
+            np.array(latitudes, dtype=np.float64),
+            np.array(longitudes, dtype=np.float64),
+            np.array(birth_dates, dtype="datetime64[D]"),
+            np.array(ratings, dtype=np.float64),
+            k=limit,
+        )
+        best_ids = [ids[i] for i in best_indices]
+
+        res = await session.scalars(select(User).where(User.id.in_(best_ids)))
+        best_matches = {match.id: match for match in res.all()}
+        return [best_matches[id] for id in best_ids]
+
+    res = await session.scalars(query)
+    potential_matches = res.all()
+
+    scores = score_candidates(current_user, preferences, potential_matches)
+    scored_matches = [
+        (score, match) for score, match in zip(scores, potential_matches) if score > 0
+    ]
+    scored_matches.sort(key=lambda x: x[0], reverse=True)
+    return [match for _, match in scored_matches[:limit]]
+
+
+async def get_best_matches(current_user: User, limit: int = 1) -> list[User]:
+    """
+    Return up to `limit` potential matches ordered by their total score.
+    Candidates scoring 0 are never returned.
+
+    Depending on settings.SCORING_MODE the candidates are ranked by the
+    database with a single `ORDER BY score DESC LIMIT k` query, scored as
+    column arrays with the vectorized engine, or loaded into Python and
+    ranked with score_candidates, which is the reference implementation.
+
+    Only candidates in the grid cells around current_user are looked at
+    first. The radius widens through settings.MATCH_SEARCH_RADII while fewer
+    than `limit` candidates are found, and the last attempt is unbounded or
+    limited to the user's max_distance_km preference.
+    """
+    assert current_user.is_active
+
     async with session_factory() as session:
         session.add(current_user)
-        await current_user.awaitable_attrs.preferences
+        preferences = await current_user.awaitable_attrs.preferences
+        excluded_ids = await get_excluded_ids(current_user.id)
+        query = get_potential_matches_query(current_user, excluded_ids)
+
+        radii = [
+            radius
+            for radius in settings.MATCH_SEARCH_RADII
+            if not preferences.max_distance_km or radius < preferences.max_distance_km
+        ]
+        for radius in radii:
+            cells = get_geo_cells_within(
+                current_user.latitude, current_user.longitude, radius
+            )
+            best_matches = await rank_candidates(
+                session,
+                query.where(User.geo_cell.in_(cells)),
+                current_user,
+                preferences,
+                limit,
+            )
+            if len(best_matches) >= limit:
+                return best_matches
+
+        return await rank_candidates(session, query, current_user, preferences, limit)
 
-    potential_matches = await get_potential_matches(current_user)
-    best_match, best_score = None, 0
-    for match in potential_matches:
-        score = await calculate_total_score(current_user, match)
-        if score > best_score:
-            best_match = match
-            best_score = score
 
-    return best_match
+async def get_best_match(current_user: User):
+    best_matches = await get_best_matches(current_user, limit=1)
+    if not best_matches:
+        return None
+
+    return best_matches[0]
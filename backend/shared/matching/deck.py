@@ -0,0 +1,127 @@
+import asyncio
+from uuid import UUID
+
+from shared.core.config import settings
+from shared.core.db import session_factory
+from shared.core.mongo import mongo_db
+from shared.matching.algorithm import get_best_matches
+from shared.models.user import User
+
+# Every user has a deck document holding the ids of the next candidates to
+# show, best first, and the ids that were recently popped but may not have
+# been reacted to yet:
+# {"_id": user_id, "candidates": [candidate_id, ...], "shown": [candidate_id, ...]}
+decks = mongo_db["swipe_deck"]
+
+refill_tasks: dict[UUID, asyncio.Task] = {}
+
+
+async def setup_decks():
+    await decks.create_index("candidates")
+
+
+async def fill_deck(user: User) -> None:
+    """
+    Top up the user's deck with the best candidates that are neither in the
+    deck already nor recently shown. When the only candidates left were
+    shown without a reaction, e.g. the user left the search, they are shown
+    again.
+    """
+    deck = await decks.find_one({"_id": user.id}) or {}
+    known = set(deck.get("candidates", [])) | set(deck.get("shown", []))
+
+    best_matches = await get_best_matches(
+        user, limit=settings.SWIPE_DECK_SIZE + len(known)
+    )
+    candidates = [match.id for match in best_matches if match.id not in known]
+    if best_matches and not candidates and not deck.get("candidates"):
+        # reacted candidates are excluded by get_best_matches already
+        candidates = [match.id for match in best_matches]
+        await decks.update_one({"_id": user.id}, {"$set": {"shown": []}})
+
+    free_slots = settings.SWIPE_DECK_SIZE - len(deck.get("candidates", []))
+
+    await decks.update_one(
+        {"_id": user.id},
+        {"$push": {"candidates": {"$each": candidates[: max(free_slots, 0)]}}},
+        upsert=True,
+    )
+
+    # candidates popped while the deck was being built are shown already
+    deck = await decks.find_one({"_id": user.id})
+    if deck and deck.get("shown"):
+        await decks.update_one(
+            {"_id": user.id}, {"$pullAll": {"candidates": deck["shown"]}}
+        )
+
+
+async def refill_deck(user_id: UUID) -> None:
+    # load a fresh instance, the caller's one may be attached to a session
+    async with session_factory() as session:
+        user = await session.get(User, user_id)
+
+    if user and user.is_active:
+        await fill_deck(user)
+
+
+def refill_deck_in_background(user_id: UUID) -> None:
+    task = refill_tasks.get(user_id)
+    if task and not task.done():
+        return
+
+    task = asyncio.create_task(refill_deck(user_id))
+    refill_tasks[user_id] = task
+    task.add_done_callback(lambda _: refill_tasks.pop(user_id, None))
+
+
+async def pop_candidate(user: User) -> UUID | None:
+    """
+    Pop the best remaining candidate id from the user's deck. The deck is
+    built on first use and refilled in the background once it drops below
+    settings.SWIPE_DECK_LOW_WATER.
+    """
+    for _ in range(2):
+        deck = await decks.find_one_and_update(
+            {"_id": user.id, "candidates.0": {"$exists": True}},
+            {"$pop": {"candidates": -1}},
+        )
+        if deck:
+            break
+        await fill_deck(user)
+    else:
+        return None
+
+    candidate_id = deck["candidates"][0]
+    await decks.update_one(
+        {"_id": user.id},
+        {
+            "$push": {
+                "shown": {
+                    "$each": [candidate_id],
+                    "$slice": -settings.SWIPE_DECK_SIZE,
+                }
+            }
+        },
+    )
+
+    if len(deck["candidates"]) - 1 < settings.SWIPE_DECK_LOW_WATER:
+        refill_deck_in_background(user.id)
+
+    return candidate_id
+
+
+async def discard_candidate(user_id: UUID, candidate_id: UUID) -> None:
+    """Remove a candidate from one user's deck"""
+    await decks.update_one({"_id": user_id}, {"$pull": {"candidates": candidate_id}})
+
+
+async def discard_candidate_everywhere(candidate_id: UUID) -> None:
+    """Remove a candidate from every deck, e.g. after they get banned"""
+    await decks.update_many(
+        {"candidates": candidate_id}, {"$pull": {"candidates": candidate_id}}
+    )
+
+
+async def clear_deck(user_id: UUID) -> None:
+    """Drop the user's deck, e.g. after their search settings change"""
+    await decks.delete_one({"_id": user_id})
@@ -0,0 +1,82 @@
+from collections import OrderedDict
+from uuid import UUID
+
+from sqlalchemy import select, union
+
+from shared.core.config import settings
+from shared.core.db import session_factory
+from shared.enums import ReactionType
+from shared.models.user import Reaction, Report
+
+# Ids of the users that must never be suggested to a user: the ones they
+# reacted to or reported, the ones who disliked or reported them.
+# The sets are exact, so there are no false positives or negatives, and are
+# kept for the settings.EXCLUSION_CACHE_SIZE most recently used users. Each id
+# takes about 160 bytes, so 2000 users with 1000 reactions each take ~320 MB.
+# The cache is per process, reactions and reports must be written through
+# the functions below by the process that selects candidates (the bot).
+exclusions: OrderedDict[UUID, set[UUID]] = OrderedDict()
+
+# changes made while a user's set is being loaded, None if it got invalidated
+pending_changes: dict[UUID, set[UUID] | None] = {}
+
+
+def get_exclusions_query(user_id: UUID):
+    return union(
+        select(Reaction.to_user_id).where(Reaction.from_user_id == user_id),
+        select(Reaction.from_user_id).where(
+            Reaction.to_user_id == user_id,
+            Reaction.reaction_type == ReactionType.dislike,
+        ),
+        select(Report.to_user_id).where(Report.from_user_id == user_id),
+        select(Report.from_user_id).where(Report.to_user_id == user_id),
+    )
+
+
+async def get_excluded_ids(user_id: UUID) -> set[UUID]:
+    """Return the ids excluded for the user, loading them with one query on a miss"""
+    if user_id in exclusions:
+        exclusions.move_to_end(user_id)
+        return exclusions[user_id]
+
+    is_loading = user_id in pending_changes
+    if not is_loading:
+        pending_changes[user_id] = set()
+
+    async with session_factory() as session:
+        res = await session.scalars(get_exclusions_query(user_id))
+        excluded_ids = set(res.all())
+
+    # a concurrent load of the same user owns the pending changes
+    if is_loading:
+        return excluded_ids
+
+    changes = pending_changes.pop(user_id)
+    if changes is None:
+        return excluded_ids
+
+    excluded_ids |= changes
+    exclusions[user_id] = excluded_ids
+    while len(exclusions) > settings.EXCLUSION_CACHE_SIZE:
+        exclusions.popitem(last=False)
+    return excluded_ids
+
+
+def add_exclusion(user_id: UUID, excluded_id: UUID) -> None:
+    """Record that excluded_id must not be suggested to the user anymore"""
+    if user_id in exclusions:
+        exclusions[user_id].add(excluded_id)
+
+    changes = pending_changes.get(user_id)
+    if changes is not None:
+        changes.add(excluded_id)
+
+
+def invalidate_exclusions(user_id: UUID) -> None:
+    """
+    Drop the user's cached set, e.g. when an exclusion may have gone away.
+    It is reloaded on the next use.
+    """
+    exclusions.pop(user_id, None)
+    if user_id in pending_changes:
+        pending_changes[user_id] = None
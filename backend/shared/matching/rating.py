@@ -1,5 +1,11 @@
+from math import copysign, floor
+
+from sqlalchemy import func
+
 from shared.enums import ReactionType
 
+K_FACTOR = 32
+
 
 def calculate_expected_score(rating_a, rating_b):
     """
@@ -30,7 +36,24 @@ def get_new_rating(user_rating, swiper_rating, reaction_type: ReactionType):
     actual_score = 1 if reaction_type == ReactionType.like else 0
     expected_score = calculate_expected_score(user_rating, swiper_rating)
 
-    k_factor = 32
-    rating_change = k_factor * (actual_score - expected_score)
+    rating_change = K_FACTOR * (actual_score - expected_score)
 
     return user_rating + rating_change
+
+
+def get_rating_change(user_rating, swiper_rating, reaction_type: ReactionType) -> int:
+    """
+    Change applied by a reaction, rounded half away from zero like Postgres
+    does in get_rating_change_expression
+    """
+    new_rating = get_new_rating(user_rating, swiper_rating, reaction_type)
+    rating_change = new_rating - user_rating
+    return int(copysign(floor(abs(rating_change) + 0.5), rating_change))
+
+
+def get_rating_change_expression(user_rating, swiper_rating, reaction_type):
+    """SQL counterpart of get_new_rating, returns the change rounded to an integer"""
+    actual_score = 1 if reaction_type == ReactionType.like else 0
+    expected_score = 1 / (1 + func.power(10, (swiper_rating - user_rating) / 400.0))
+
+    return func.round(K_FACTOR * (actual_score - expected_score))
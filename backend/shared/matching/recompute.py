@@ -0,0 +1,133 @@
+"""
+Recompute every User.rating and Reaction.added_rating by replaying the
+reaction table in updated_at order.
+
+Only the latest state of each reaction is stored, so a flipped reaction is
+replayed once, with its current type. Reactions are streamed with a server
+side cursor and written back in batches, so memory only grows with the number
+of users. Run it while the bot is stopped, reactions made during the replay
+would be overwritten.
+
+Usage:
+    python -m shared.matching.recompute [--dry-run] [--batch-size N]
+"""
+
+import argparse
+import asyncio
+import logging
+from uuid import UUID
+
+from sqlalchemy import bindparam, select, update
+
+from shared.core.config import settings
+from shared.core.db import session_factory
+import shared.models.chat  # noqa: F401, User's relationships refer to chat models
+from shared.matching.rating import get_rating_change
+from shared.models.user import Reaction, User
+
+logger = logging.getLogger(__name__)
+
+
+async def write_batch(model, column: str, values: list[dict], dry_run: bool) -> None:
+    """
+    Set `column` of the rows by id, values are {"row_id": ..., "value": ...}.
+    updated_at is kept as is, it orders the replay and the keyset pages.
+    """
+    if dry_run or not values:
+        return
+
+    table = model.__table__
+    query = (
+        update(table)
+        .where(table.c.id == bindparam("row_id"))
+        .values({column: bindparam("value"), "updated_at": table.c.updated_at})
+    )
+    async with session_factory() as session:
+        await session.execute(query, values)
+        await session.commit()
+
+
+async def recompute_ratings(batch_size: int = 10_000, dry_run: bool = False):
+    live_ratings: dict[UUID, int] = {}
+    async with session_factory() as session:
+        res = await session.stream(
+            select(User.id, User.rating).execution_options(yield_per=batch_size)
+        )
+        async for partition in res.partitions():
+            live_ratings.update(partition)
+
+    ratings = dict.fromkeys(live_ratings, settings.DEFAULT_RATING)
+    replayed, changed_reactions = 0, 0
+
+    async with session_factory() as session:
+        query = (
+            select(
+                Reaction.id,
+                Reaction.from_user_id,
+                Reaction.to_user_id,
+                Reaction.reaction_type,
+                Reaction.added_rating,
+            )
+            .order_by(Reaction.updated_at, Reaction.id)
+            .execution_options(yield_per=batch_size)
+        )
+        res = await session.stream(query)
+
+        async for partition in res.partitions():
+            values = []
+            for id, from_user_id, to_user_id, reaction_type, added_rating in partition:
+                rating_change = get_rating_change(
+                    ratings[to_user_id], ratings[from_user_id], reaction_type
+                )
+                ratings[to_user_id] += rating_change
+                if rating_change != added_rating:
+                    values.append({"row_id": id, "value": rating_change})
+
+            await write_batch(Reaction, "added_rating", values, dry_run)
+            replayed += len(partition)
+            changed_reactions += len(values)
+            logger.info("Replayed %s reactions", replayed)
+
+    drifts = {
+        id: rating - live_ratings[id]
+        for id, rating in ratings.items()
+        if rating != live_ratings[id]
+    }
+    drifted_ids = list(drifts)
+    for i in range(0, len(drifted_ids), batch_size):
+        values = [
+            {"row_id": id, "value": ratings[id]}
+            for id in drifted_ids[i : i + batch_size]
+        ]
+        await write_batch(User, "rating", values, dry_run)
+
+    logger.info(
+        "Reactions: %s replayed, %s with a different added_rating",
+        replayed,
+        changed_reactions,
+    )
+    logger.info("Users: %s total, %s with a drifted rating", len(ratings), len(drifts))
+    if drifts:
+        logger.info(
+            "Drift: max %s, mean absolute %.2f",
+            max(drifts.values(), key=abs),
+            sum(map(abs, drifts.values())) / len(drifts),
+        )
+    if dry_run:
+        logger.info("Dry run, nothing was written")
+
+    return drifts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute ratings from reactions")
+    parser.add_argument("--dry-run", action="store_true", help="only report the drift")
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(recompute_ratings(args.batch_size, args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+from datetime import date
+
+import numpy as np
+
+from shared.geo import GEO_CELL_COLUMNS, GEO_CELL_ROWS, GEO_CELL_SIZE
+from shared.matching.weights import (
+    BASE_RATING,
+    EARTH_RADIUS,
+    MAX_AGE_DIFF,
+    MAX_DISTANCE,
+    RATING_RANGE,
+    ScoreWeights,
+    SimilarityWeights,
+)
+from shared.models.user import Preferences, User
+
+
+def haversine_distances(
+    latitude: float, longitude: float, latitudes: np.ndarray, longitudes: np.ndarray
+) -> np.ndarray:
+    """Vectorized shared.geo.haversine_distance from one point to many"""
+    lat1, lon1 = np.radians(latitude), np.radians(longitude)
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return EARTH_RADIUS * c
+
+
+def get_geo_cells(latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """Vectorized shared.geo.get_geo_cell"""
+    rows = np.minimum(np.floor((latitudes + 90) / GEO_CELL_SIZE), GEO_CELL_ROWS - 1)
+    columns = np.floor((longitudes + 180) / GEO_CELL_SIZE) % GEO_CELL_COLUMNS
+    return rows.astype(np.int64) * GEO_CELL_COLUMNS + columns.astype(np.int64)
+
+
+def calculate_ages(birth_dates: np.ndarray, today: date | None = None) -> np.ndarray:
+    """Vectorized User.age for an array of birth dates"""
+    today = today or date.today()
+    birth_dates = np.asarray(birth_dates, dtype="datetime64[D]")
+
+    months = birth_dates.astype("datetime64[M]")
+    years = birth_dates.astype("datetime64[Y]").astype(np.int64) + 1970
+    month = months.astype(np.int64) % 12 + 1
+    day = (birth_dates - months).astype(np.int64) + 1
+
+    before_birthday = (today.month < month) | (
+        (today.month == month) & (today.day < day)
+    )
+    return today.year - years - before_birthday
+
+
+def round_scores(values: np.ndarray, decimals: int) -> np.ndarray:
+    """
+    Round like Python's round(). np.round scales the values first, which
+    decides ties differently, so values close to a tie are rounded one by one.
+    """
+    rounded = np.round(values, decimals)
+
+    scaled = values * 10**decimals
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if near_tie.any():
+        rounded[near_tie] = [round(float(x), decimals) for x in values[near_tie]]
+    return rounded
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Return indices of the k highest positive scores, best first.
+    Equal scores keep their original order, like the sort in get_best_matches.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    indices = np.argpartition(-scores, k - 1)[:k]
+    indices = indices[np.lexsort((indices, -scores[indices]))]
+    return indices[scores[indices] > 0]
+
+
+def score_pool(
+    current_user: User,
+    preferences: Preferences,
+    latitudes: np.ndarray,
+    longitudes: np.ndarray,
+    birth_dates: np.ndarray,
+    ratings: np.ndarray,
+    k: int = 1,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Score a whole candidate pool given as column arrays in one call.
+    Mirrors calculate_total_score, which stays the reference implementation.
+    When several candidates tie at the k-th place any of them may be picked.
+
+    Returns:
+        tuple: Scores of every candidate and indices of the top k candidates
+    """
+    distances = haversine_distances(
+        current_user.latitude, current_user.longitude, latitudes, longitudes
+    )
+    location_scores = np.maximum(0, 1 - distances / MAX_DISTANCE)
+
+    total_score = location_scores * SimilarityWeights.location
+    total_weight = SimilarityWeights.location
+
+    if not preferences.min_age:
+        ages = calculate_ages(birth_dates)
+        age_scores = np.maximum(0, 1 - np.abs(ages - current_user.age) / MAX_AGE_DIFF)
+        total_score = total_score + age_scores * SimilarityWeights.age
+        total_weight += SimilarityWeights.age
+
+    similarity_scores = round_scores(total_score / total_weight, 2)
+
+    normalized_ratings = np.clip(
+        (np.asarray(ratings, dtype=np.float64) - BASE_RATING) / RATING_RANGE, 0, 1
+    )
+
+    scores = round_scores(
+        similarity_scores * ScoreWeights.similarity
+        + normalized_ratings * ScoreWeights.rating,
+        3,
+    )
+    return scores, top_k(scores, k)
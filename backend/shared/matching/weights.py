@@ -0,0 +1,19 @@
+from dataclasses import dataclass
+
+EARTH_RADIUS = 6371
+MAX_DISTANCE = 50
+MAX_AGE_DIFF = 10
+BASE_RATING = 1000
+RATING_RANGE = 800
+
+
+@dataclass
+class SimilarityWeights:
+    location = 0.6
+    age = 0.4
+
+
+@dataclass
+class ScoreWeights:
+    similarity = 0.6
+    rating = 0.4
@@ -1,6 +1,6 @@
 from uuid import UUID
 
-from sqlalchemy import ForeignKey, UniqueConstraint
+from sqlalchemy import ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from shared.models.base import Base, created_at, intpk, updated_at
@@ -32,6 +32,10 @@ class ChatMember(Base):
     user_id: Mapped[UUID] = mapped_column(
         ForeignKey("user_account.id", ondelete="CASCADE"), index=True
     )
+    # high-water marks of the messages the member's client has received and
+    # read, so receipts cost one row per member instead of one per message
+    last_read_message_id: Mapped[int | None]
+    last_delivered_message_id: Mapped[int | None]
 
     created_at: Mapped[created_at]
     updated_at: Mapped[updated_at]
@@ -46,9 +50,7 @@ class Message(Base):
     __tablename__ = "message"
 
     id: Mapped[intpk]
-    chat_id: Mapped[int] = mapped_column(
-        ForeignKey("chat.id", ondelete="CASCADE"), index=True
-    )
+    chat_id: Mapped[int] = mapped_column(ForeignKey("chat.id", ondelete="CASCADE"))
     user_id: Mapped[str] = mapped_column(
         ForeignKey("user_account.id", ondelete="CASCADE"), index=True
     )
@@ -58,3 +60,6 @@ class Message(Base):
     text: Mapped[str]
     created_at: Mapped[created_at]
     updated_at: Mapped[updated_at]
+
+    # message pages of a chat, also serves lookups by chat_id
+    __table_args__ = (Index("ix_message_chat_id_id", "chat_id", "id"),)
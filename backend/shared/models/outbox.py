@@ -0,0 +1,25 @@
+from datetime import datetime
+
+from sqlalchemy import BIGINT, TIMESTAMP, String, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Mapped, mapped_column
+
+from shared.models.base import Base, created_at, intpk
+
+
+class OutboxMessage(Base):
+    """A Telegram message waiting to be sent by the dispatcher in bot.outbox"""
+
+    __tablename__ = "outbox_message"
+
+    id: Mapped[intpk]
+    chat_id: Mapped[int] = mapped_column(BIGINT)
+    # send_message arguments besides chat_id
+    payload: Mapped[dict] = mapped_column(JSONB)
+    # messages with the same key are coalesced while one of them is queued
+    dedup_key: Mapped[str | None] = mapped_column(String(128), unique=True)
+    attempts: Mapped[int] = mapped_column(server_default=text("0"))
+    next_attempt_at: Mapped[datetime] = mapped_column(
+        TIMESTAMP(timezone=True), server_default=text("now()"), index=True
+    )
+    created_at: Mapped[created_at]
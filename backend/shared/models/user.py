@@ -1,19 +1,28 @@
 import uuid
 from datetime import date, datetime
 
-from sqlalchemy import (BIGINT, TIMESTAMP, ForeignKey, String,
-                        UniqueConstraint, func, text)
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import (BIGINT, TIMESTAMP, Computed, ForeignKey, Index,
+                        String, UniqueConstraint, and_, func, text)
+from sqlalchemy.dialects.postgresql import JSONB, UUID
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from shared.core.config import settings
 from shared.enums import (Genders, PreferredGenders, ReactionType,
                           ReportStatusTypes, UILanguages)
+from shared.geo import GEO_CELL_EXPRESSION
 from shared.models.base import Base, created_at, intpk, updated_at
 from shared.models.file import File
 
 
+def subtract_years(day: date, years: int) -> date:
+    """Go back whole years, Feb 29 becomes Feb 28 in a common year"""
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:
+        return day.replace(year=day.year - years, day=28)
+
+
 class Place(Base):
     __tablename__ = "place"
 
@@ -37,6 +46,14 @@ class PlaceName(Base):
     __table_args__ = (UniqueConstraint("place_id", "language"),)
 
 
+class GeocodingCache(Base):
+    __tablename__ = "geocoding_cache"
+
+    key: Mapped[str] = mapped_column(primary_key=True)
+    value: Mapped[list | str | None] = mapped_column(JSONB)
+    expires_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True))
+
+
 class User(Base):
     __tablename__ = "user_account"
 
@@ -56,6 +73,9 @@ class User(Base):
 
     latitude: Mapped[float]
     longitude: Mapped[float]
+    geo_cell: Mapped[int] = mapped_column(
+        Computed(GEO_CELL_EXPRESSION, persisted=True), index=True
+    )
     place_id: Mapped[str | None] = mapped_column(
         ForeignKey("place.id", ondelete="SET NULL"), index=True
     )
@@ -89,6 +109,28 @@ class User(Base):
     def _age_expression(cls):
         return func.date_part("year", func.age(func.current_date(), cls.birth_date))
 
+    @classmethod
+    def age_between(cls, min_age: int, max_age: int, today: date | None = None):
+        """
+        Same as cls.age.between(min_age, max_age), but written as bounds on
+        birth_date so it can be served by an index. The bounds are computed
+        from the same day as the age property.
+        """
+        today = today or date.today()
+        return and_(
+            cls.birth_date <= subtract_years(today, min_age),
+            cls.birth_date > subtract_years(today, max_age + 1),
+        )
+
+    __table_args__ = (
+        Index(
+            "ix_user_account_gender_is_active_birth_date",
+            "gender",
+            "is_active",
+            "birth_date",
+        ),
+    )
+
 
 class Preferences(Base):
     __tablename__ = "user_preferences"
@@ -100,6 +142,7 @@ class Preferences(Base):
     min_age: Mapped[int | None] = mapped_column(index=True)
     max_age: Mapped[int | None] = mapped_column(index=True)
     preferred_gender: Mapped[PreferredGenders] = mapped_column(index=True)
+    max_distance_km: Mapped[int | None]
 
     user = relationship("User", back_populates="preferences")
 
@@ -121,7 +164,22 @@ class Reaction(Base):
     created_at: Mapped[created_at]
     updated_at: Mapped[updated_at]
 
-    __table_args__ = (UniqueConstraint("from_user_id", "to_user_id"),)
+    __table_args__ = (
+        UniqueConstraint("from_user_id", "to_user_id"),
+        # keyset pagination of the reactions a user made and received
+        Index(
+            "ix_reaction_from_user_id_updated_at_to_user_id",
+            "from_user_id",
+            "updated_at",
+            "to_user_id",
+        ),
+        Index(
+            "ix_reaction_to_user_id_updated_at_from_user_id",
+            "to_user_id",
+            "updated_at",
+            "from_user_id",
+        ),
+    )
 
 
 class Report(Base):
@@ -0,0 +1,42 @@
+import asyncio
+from typing import Any
+
+from aiogram.types import InlineKeyboardMarkup
+from sqlalchemy.dialects.postgresql import insert
+
+from shared.core.db import session_factory
+from shared.models.outbox import OutboxMessage
+
+# set when a message is queued, wakes up the dispatcher of this process early.
+# Dispatchers in other processes pick it up on their next poll.
+outbox_changed = asyncio.Event()
+
+
+async def enqueue_message(
+    chat_id: int,
+    text: str,
+    reply_markup: InlineKeyboardMarkup | None = None,
+    dedup_key: str | None = None,
+    **kwargs: Any,
+) -> None:
+    """
+    Queue a message to be sent by bot.outbox, which retries it and keeps to
+    Telegram's rate limits. While a message with the same dedup_key is queued
+    the new one is dropped.
+    """
+    payload = {"text": text, **kwargs}
+    if reply_markup:
+        payload["reply_markup"] = reply_markup.model_dump(
+            mode="json", exclude_none=True
+        )
+
+    async with session_factory() as session:
+        query = (
+            insert(OutboxMessage)
+            .values(chat_id=chat_id, payload=payload, dedup_key=dedup_key)
+            .on_conflict_do_nothing(index_elements=["dedup_key"])
+        )
+        await session.execute(query)
+        await session.commit()
+
+    outbox_changed.set()
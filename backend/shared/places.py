@@ -0,0 +1,128 @@
+import asyncio
+import logging
+from collections import Counter
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from shared.core.config import settings
+from shared.core.db import session_factory
+from shared.enums import UILanguages
+from shared.geocoding import get_place_name
+from shared.models.user import Place, PlaceName
+
+logger = logging.getLogger(__name__)
+
+# set when a place may be missing names, wakes the backfill up early
+backfill_requested = asyncio.Event()
+
+
+def request_place_name_backfill() -> None:
+    backfill_requested.set()
+
+
+async def get_places_missing_names(
+    batch_size: int, skip: set[str]
+) -> list[tuple[str, set[UILanguages]]]:
+    """Return up to batch_size places without a name in some language"""
+    async with session_factory() as session:
+        query = (
+            select(Place.id, func.array_agg(PlaceName.language))
+            .outerjoin(PlaceName, PlaceName.place_id == Place.id)
+            .group_by(Place.id)
+            .having(func.count(PlaceName.id) < len(UILanguages))
+            .order_by(Place.id)
+            .limit(batch_size)
+        )
+        if skip:
+            query = query.where(Place.id.not_in(skip))
+        rows = (await session.execute(query)).all()
+
+    return [
+        (place_id, set(UILanguages) - set(languages)) for place_id, languages in rows
+    ]
+
+
+async def resolve_place_name(
+    place_id: str, language: UILanguages
+) -> tuple[str, UILanguages, str] | None:
+    try:
+        return place_id, language, await get_place_name(place_id, language)
+    except ValueError:
+        logger.warning(
+            "Couldn't resolve the %s name of place %s", language.name, place_id
+        )
+        return None
+
+
+async def backfill_place_names(batch_size: int = 50) -> int:
+    """
+    Look up the names of places missing some UILanguages name, a batch of
+    places at a time, and store them. Places whose names can't be resolved
+    are skipped until the next call.
+
+    Returns:
+        int: Number of names stored
+    """
+    stored = 0
+    failed: set[str] = set()
+    while places := await get_places_missing_names(batch_size, failed):
+        # the geocoding client limits how many of these run at once
+        results = await asyncio.gather(
+            *(
+                resolve_place_name(place_id, language)
+                for place_id, languages in places
+                for language in languages
+            )
+        )
+        names = [result for result in results if result]
+
+        # places with every name resolved leave the query, the rest is skipped
+        resolved = Counter(place_id for place_id, _, _ in names)
+        failed.update(
+            place_id
+            for place_id, languages in places
+            if resolved[place_id] < len(languages)
+        )
+        if not names:
+            continue
+
+        async with session_factory() as session:
+            query = (
+                insert(PlaceName)
+                .values(
+                    [
+                        {"place_id": place_id, "language": language, "name": name}
+                        for place_id, language, name in names
+                    ]
+                )
+                .on_conflict_do_nothing(index_elements=["place_id", "language"])
+            )
+            await session.execute(query)
+            await session.commit()
+        stored += len(names)
+
+    return stored
+
+
+async def run_place_name_backfill() -> None:
+    """
+    Keep every place named in every UILanguages. Run it as a background task
+    in the bot, it wakes up on request_place_name_backfill and every
+    settings.PLACE_NAME_BACKFILL_INTERVAL seconds.
+    """
+    while True:
+        backfill_requested.clear()
+        try:
+            stored = await backfill_place_names()
+            if stored:
+                logger.info("Stored %s place names", stored)
+        except Exception:
+            logger.exception("Place name backfill failed")
+
+        try:
+            await asyncio.wait_for(
+                backfill_requested.wait(), settings.PLACE_NAME_BACKFILL_INTERVAL
+            )
+        except asyncio.TimeoutError:
+            pass
@@ -1,14 +1,23 @@
+from dataclasses import dataclass
+from datetime import datetime
+from hashlib import blake2b
 from uuid import UUID
 
-from sqlalchemy import and_, exc, exists, func, or_, select
+from sqlalchemy import (Integer, Uuid, and_, cast, column, exists, func,
+                        literal, or_, select, true, tuple_, update, values)
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import aliased, joinedload, selectinload
 
+from shared import bans
+from shared.bans import get_not_banned_clause
 from shared.core.db import session_factory
 from shared.enums import ReactionType, UILanguages
-from shared.geocoding import get_place
-from shared.matching.rating import get_new_rating
-from shared.models.chat import Chat, ChatMember
+from shared.places import request_place_name_backfill
+from shared.matching.deck import discard_candidate
+from shared.matching.exclusions import add_exclusion, invalidate_exclusions
+from shared.matching.rating import get_rating_change_expression
+from shared.models.chat import Chat, ChatMember, Message
 from shared.models.user import Ban, PlaceName, Reaction, Report, User
 
 
@@ -20,14 +29,7 @@ async def get_user(
     with_preferences=False,
 ):
     async with session_factory() as session:
-        query = select(User).where(
-            ~exists().where(
-                and_(
-                    Ban.user_telegram_id == User.telegram_id,
-                    or_(Ban.expires_at == None, Ban.expires_at > func.now()),
-                )
-            )
-        )
+        query = select(User).where(get_not_banned_clause())
         if id:
             query = query.where(User.id == id)
         else:
@@ -45,6 +47,9 @@ async def get_user(
     
 
 async def is_user_banned(telegram_id: int):
+    if bans.is_loaded:
+        return bans.is_banned(telegram_id)
+
     async with session_factory() as session:
         query = select(Ban).where(
             Ban.user_telegram_id == telegram_id,
@@ -54,13 +59,24 @@ async def is_user_banned(telegram_id: int):
         return res.one_or_none() is not None
 
 
-async def get_likes(user: User, limit: int | None = None):
+# keyset pagination position: the sort timestamp and id of the last row seen
+Cursor = tuple[datetime, UUID]
+
+
+async def get_likes(
+    user: User, limit: int | None = None, before: Cursor | None = None
+):
+    """
+    Return (user, liked_at) rows of users who liked the user and haven't been
+    reacted to, latest first. Pass the (liked_at, id) of a row as `before` to
+    get older ones.
+    """
     async with session_factory() as session:
         their_reaction = aliased(Reaction)
         my_reaction = aliased(Reaction)
 
         query = (
-            select(User)
+            select(User, their_reaction.updated_at.label("liked_at"))
             .join(
                 their_reaction,
                 and_(
@@ -89,30 +105,39 @@ async def get_likes(user: User, limit: int | None = None):
                         Report.to_user_id == user.id,
                     )
                 ),
-                ~exists().where(
-                    and_(
-                        Ban.user_telegram_id == User.telegram_id,
-                        or_(Ban.expires_at == None, Ban.expires_at > func.now()),
-                    )
-                )
+                get_not_banned_clause(),
             )
-            .order_by(their_reaction.updated_at.desc())
+            .order_by(their_reaction.updated_at.desc(), User.id.desc())
         )
 
+        if before:
+            query = query.where(tuple_(their_reaction.updated_at, User.id) < before)
         if limit:
             query = query.limit(limit)
 
-        res = await session.scalars(query)
-        return res.all()
+        return (await session.execute(query)).all()
 
 
-async def get_matches(user: User, limit: int | None = None, offset: int | None = None):
+async def get_matches(
+    user: User,
+    limit: int | None = None,
+    before: Cursor | None = None,
+    after: Cursor | None = None,
+    inclusive: bool = False,
+):
+    """
+    Return (user, matched_at) rows of the user's matches, latest first.
+    Pass the (matched_at, id) of a row as `before` to get older matches, or as
+    `after` to get newer ones, which are then returned oldest first. With
+    `inclusive` the row of `before` itself is returned too.
+    """
     async with session_factory() as session:
         their_reaction = aliased(Reaction)
         my_reaction = aliased(Reaction)
+        matched_at = func.greatest(my_reaction.updated_at, their_reaction.updated_at)
 
         query = (
-            select(User)
+            select(User, matched_at.label("matched_at"))
             .join(
                 my_reaction,
                 and_(
@@ -143,92 +168,199 @@ async def get_matches(user: User, limit: int | None = None, offset: int | None =
                         Report.to_user_id == user.id,
                     )
                 ),
-                ~exists().where(
-                    and_(
-                        Ban.user_telegram_id == User.telegram_id,
-                        or_(Ban.expires_at == None, Ban.expires_at > func.now()),
-                    )
-                )
-            )
-            .order_by(
-                func.greatest(my_reaction.updated_at, their_reaction.updated_at).desc()
+                get_not_banned_clause(),
             )
         )
 
+        if after:
+            query = query.where(tuple_(matched_at, User.id) > after).order_by(
+                matched_at, User.id
+            )
+        else:
+            query = query.order_by(matched_at.desc(), User.id.desc())
+        if before and inclusive:
+            query = query.where(tuple_(matched_at, User.id) <= before)
+        elif before:
+            query = query.where(tuple_(matched_at, User.id) < before)
         if limit:
             query = query.limit(limit)
-        if offset:
-            query = query.offset(offset)
 
-        return (await session.scalars(query)).all()
+        return (await session.execute(query)).all()
+
+
+@dataclass
+class ReactionResult:
+    is_created: bool
+    # False if the reaction already existed with the same type
+    is_changed: bool
+    previous_reaction_type: ReactionType | None
+    added_rating: int
+    is_mutual: bool
+    # set once per reaction, the caller must send the like or match notification
+    should_notify: bool
+
+
+def get_pair_lock_key(user_id: UUID, match_id: UUID) -> int:
+    """Key for pg_advisory_xact_lock, the same for both directions of a pair"""
+    first, second = sorted((user_id, match_id))
+    digest = blake2b(first.bytes + second.bytes, digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
 
 
 async def create_or_update_reaction(
     user: User, match: User, reaction_type: ReactionType
-):
+) -> ReactionResult:
+    """
+    Create or update the reaction and the match's rating in a single statement.
+
+    Reactions between the same pair are serialized with an advisory lock taken
+    before the statement. The statement's snapshot is taken after the lock is
+    acquired, so of two concurrent likes the second one always sees the first
+    and reports the match as mutual.
+
+    Ratings are read from the database, not from the given instances, and the
+    match's rating is changed relatively, so concurrent reactions never
+    overwrite each other's changes.
+    """
     assert user.is_active and match.is_active
-    is_created = False
+    is_like = reaction_type == ReactionType.like
+
+    old = (
+        select(
+            Reaction.id,
+            Reaction.reaction_type,
+            Reaction.added_rating,
+            Reaction.is_match_notified,
+        )
+        .where(Reaction.from_user_id == user.id, Reaction.to_user_id == match.id)
+        .with_for_update()
+        .cte("old")
+    )
+
+    # the match's row is locked, so concurrent reactions to the same user apply
+    # their changes one after another, each against the latest rating.
+    # NO KEY UPDATE does not block the foreign key checks of other inserts.
+    current = (
+        select(User.rating)
+        .where(User.id == match.id)
+        .with_for_update(key_share=True)
+        .cte("current")
+    )
+    old_added_rating = func.coalesce(select(old.c.added_rating).scalar_subquery(), 0)
+    previous_rating = select(current.c.rating).scalar_subquery() - old_added_rating
+    swiper_rating = select(User.rating).where(User.id == user.id).scalar_subquery()
+    change = select(
+        old_added_rating.label("old_added_rating"),
+        cast(
+            get_rating_change_expression(previous_rating, swiper_rating, reaction_type),
+            Integer,
+        ).label("added_rating"),
+    ).cte("change")
+
+    insert_query = insert(Reaction).values(
+        from_user_id=user.id,
+        to_user_id=match.id,
+        reaction_type=reaction_type,
+        added_rating=select(change.c.added_rating).scalar_subquery(),
+        is_match_notified=is_like,
+    )
+    upsert = (
+        insert_query.on_conflict_do_update(
+            index_elements=[Reaction.from_user_id, Reaction.to_user_id],
+            set_={
+                Reaction.reaction_type: insert_query.excluded.reaction_type,
+                Reaction.added_rating: insert_query.excluded.added_rating,
+                Reaction.is_match_notified: or_(
+                    Reaction.is_match_notified,
+                    insert_query.excluded.is_match_notified,
+                ),
+                Reaction.updated_at: func.now(),
+            },
+            where=Reaction.reaction_type != insert_query.excluded.reaction_type,
+        )
+        .returning(Reaction.id)
+        .cte("upsert")
+    )
+
+    rating_change = select(
+        change.c.added_rating - change.c.old_added_rating
+    ).scalar_subquery()
+    rating_update = (
+        update(User)
+        .where(User.id == match.id, exists(select(upsert.c.id)))
+        .values(rating=User.rating + rating_change)
+        .returning(User.rating)
+        .cte("rating_update")
+    )
+
+    their_like = exists().where(
+        Reaction.from_user_id == match.id,
+        Reaction.to_user_id == user.id,
+        Reaction.reaction_type == ReactionType.like,
+    )
+    query = select(
+        ~exists(select(old.c.id)).label("is_created"),
+        exists(select(upsert.c.id)).label("is_changed"),
+        select(old.c.reaction_type).scalar_subquery().label("previous_reaction_type"),
+        select(change.c.added_rating).scalar_subquery().label("added_rating"),
+        select(rating_update.c.rating).scalar_subquery().label("rating"),
+        and_(literal(is_like), their_like).label("is_mutual"),
+        and_(
+            literal(is_like),
+            exists(select(upsert.c.id)),
+            ~func.coalesce(select(old.c.is_match_notified).scalar_subquery(), False),
+        ).label("should_notify"),
+    )
+
     async with session_factory() as session:
-        res = await session.scalars(
-            select(Reaction).where(
-                Reaction.from_user_id == user.id, Reaction.to_user_id == match.id
-            )
+        await session.execute(
+            select(func.pg_advisory_xact_lock(get_pair_lock_key(user.id, match.id)))
         )
-        try:
-            reaction = res.one()
-            if reaction.reaction_type == reaction_type:
-                return is_created, reaction
-
-            previous_rating = match.rating - reaction.added_rating
-            match.rating = get_new_rating(previous_rating, user.rating, reaction_type)
-
-            reaction.reaction_type = reaction_type
-            reaction.added_rating = match.rating - previous_rating
-        except exc.NoResultFound:
-            previous_rating = match.rating
-            match.rating = get_new_rating(match.rating, user.rating, reaction_type)
-            reaction = Reaction(
-                from_user_id=user.id,
-                to_user_id=match.id,
-                reaction_type=reaction_type,
-                added_rating=match.rating - previous_rating,
-            )
-            is_created = True
-        session.add_all((reaction, match))
+        row = (await session.execute(query)).one()
         await session.commit()
-    return is_created, reaction
+
+    if row.rating is not None:
+        match.rating = row.rating
+
+    add_exclusion(user.id, match.id)
+    if reaction_type == ReactionType.dislike:
+        add_exclusion(match.id, user.id)
+    elif row.previous_reaction_type == ReactionType.dislike:
+        # user may be suggested to match again unless excluded for other reasons
+        invalidate_exclusions(match.id)
+
+    await discard_candidate(user.id, match.id)
+    if reaction_type == ReactionType.dislike:
+        await discard_candidate(match.id, user.id)
+
+    return ReactionResult(
+        is_created=row.is_created,
+        is_changed=row.is_changed,
+        previous_reaction_type=row.previous_reaction_type,
+        added_rating=row.added_rating if row.is_changed else 0,
+        is_mutual=row.is_mutual,
+        should_notify=row.should_notify,
+    )
 
 
-async def get_nth_last_reacted_match(user: User, n: int):
+async def get_last_reacted_match(user: User, before: Cursor | None = None):
+    """
+    Return the (user, reacted_at) row of the latest user the user reacted to.
+    Pass the (reacted_at, id) of a row as `before` to step further back.
+    """
     async with session_factory() as session:
         query = (
-            select(User)
+            select(User, Reaction.updated_at.label("reacted_at"))
             .join(Reaction, Reaction.to_user_id == User.id)
             .where(and_(Reaction.from_user_id == user.id, User.is_active))
-            .order_by(Reaction.updated_at.desc())
+            .order_by(Reaction.updated_at.desc(), Reaction.to_user_id.desc())
             .limit(1)
-            .offset(n)
         )
-        matches = (await session.scalars(query)).all()
-
-    if not matches:
-        return None
-
-    return matches[0]
-
-
-async def is_mutual(reaction: Reaction):
-    if reaction.reaction_type != ReactionType.like:
-        return False
-
-    async with session_factory() as session:
-        query = select(Reaction).where(
-            Reaction.from_user_id == reaction.to_user_id,
-            Reaction.to_user_id == reaction.from_user_id,
-            Reaction.reaction_type == ReactionType.like,
-        )
-        res = await session.scalars(query)
-        return res.one_or_none() is not None
+        if before:
+            query = query.where(
+                tuple_(Reaction.updated_at, Reaction.to_user_id) < before
+            )
+        return (await session.execute(query)).one_or_none()
 
 
 async def can_write(session: AsyncSession, user_id: UUID, match_id: UUID):
@@ -294,25 +426,270 @@ async def get_chat_member(session: AsyncSession, user_id: UUID, chat_id: int):
     return res.one_or_none()
 
 
+async def get_chat_messages(
+    session: AsyncSession,
+    chat_id: int | None = None,
+    user_id: UUID | None = None,
+    before_id: int | None = None,
+    after_id: int | None = None,
+    limit: int = 50,
+):
+    """
+    Return up to `limit` messages of a chat, or of every chat of a user,
+    oldest first. By default the latest messages are returned, pass the id
+    of a message as before_id to get the ones before it or as after_id to
+    get the ones after it.
+    """
+    query = select(Message)
+    if chat_id is not None:
+        query = query.where(Message.chat_id == chat_id)
+    if user_id is not None:
+        query = query.join(
+            ChatMember,
+            and_(ChatMember.chat_id == Message.chat_id, ChatMember.user_id == user_id),
+        )
+    if before_id is not None:
+        query = query.where(Message.id < before_id)
+
+    if after_id is not None:
+        query = query.where(Message.id > after_id).order_by(Message.id).limit(limit)
+        return list((await session.scalars(query)).all())
+
+    query = query.order_by(Message.id.desc()).limit(limit)
+    return list(reversed((await session.scalars(query)).all()))
+
+
+@dataclass
+class InboxChat:
+    chat: Chat
+    peer: User
+    last_message: Message | None
+    unread_count: int
+    last_read_message_id: int | None
+    # how far the other member got, for the receipts of the user's messages
+    peer_last_read_message_id: int | None
+    peer_last_delivered_message_id: int | None
+    last_activity_at: datetime
+
+
+async def get_inbox(
+    session: AsyncSession,
+    user_id: UUID,
+    before: tuple[datetime, int] | None = None,
+    limit: int = 20,
+) -> list[InboxChat]:
+    """
+    Return up to `limit` chats of a user with the other member, the last
+    message and the number of unread messages, most recently active first,
+    in one query. Pass the (last_activity_at, chat id) of the last chat as
+    `before` to get the next page.
+    """
+    member = aliased(ChatMember)
+    peer_member = aliased(ChatMember)
+    last_message = (
+        select(Message)
+        .where(Message.chat_id == Chat.id)
+        .order_by(Message.id.desc())
+        .limit(1)
+        .lateral("last_message")
+    )
+    unread_count = (
+        select(func.count(Message.id))
+        .where(
+            Message.chat_id == Chat.id,
+            Message.id > func.coalesce(member.last_read_message_id, 0),
+            Message.user_id != member.user_id,
+        )
+        .scalar_subquery()
+    )
+    last_activity_at = func.coalesce(last_message.c.created_at, Chat.created_at)
+
+    query = (
+        select(
+            Chat,
+            User,
+            aliased(Message, last_message),
+            unread_count,
+            member.last_read_message_id,
+            peer_member.last_read_message_id,
+            peer_member.last_delivered_message_id,
+            last_activity_at,
+        )
+        .join(member, and_(member.chat_id == Chat.id, member.user_id == user_id))
+        .join(
+            peer_member,
+            and_(peer_member.chat_id == Chat.id, peer_member.user_id != user_id),
+        )
+        .join(User, User.id == peer_member.user_id)
+        .outerjoin(last_message, true())
+        .order_by(last_activity_at.desc(), Chat.id.desc())
+        .limit(limit)
+    )
+    if before is not None:
+        query = query.where(tuple_(last_activity_at, Chat.id) < before)
+
+    rows = (await session.execute(query)).all()
+    return [InboxChat(*row) for row in rows]
+
+
+@dataclass
+class Receipt:
+    chat_id: int
+    user_id: UUID
+    last_delivered_message_id: int
+    last_read_message_id: int
+
+
+async def mark_chat_read(
+    session: AsyncSession, user_id: UUID, chat_id: int, message_id: int
+) -> Receipt | None:
+    """
+    Move the member's read cursor forward to message_id, capped at the last
+    message of the chat so later messages still count as unread. Read
+    messages are delivered too, so the delivery cursor follows.
+
+    Returns:
+        Receipt | None: The member's cursors, None if the user isn't a member
+    """
+    # greatest and least skip nulls, so a chat without messages caps at 0
+    last_message_id = func.coalesce(
+        select(func.max(Message.id))
+        .where(Message.chat_id == chat_id)
+        .scalar_subquery(),
+        0,
+    )
+    read_id = func.least(message_id, last_message_id)
+    query = (
+        update(ChatMember)
+        .where(ChatMember.chat_id == chat_id, ChatMember.user_id == user_id)
+        .values(
+            last_read_message_id=func.greatest(
+                ChatMember.last_read_message_id, read_id
+            ),
+            last_delivered_message_id=func.greatest(
+                ChatMember.last_delivered_message_id, read_id
+            ),
+        )
+        .returning(
+            ChatMember.chat_id,
+            ChatMember.user_id,
+            ChatMember.last_delivered_message_id,
+            ChatMember.last_read_message_id,
+        )
+    )
+    row = (await session.execute(query)).one_or_none()
+    await session.commit()
+    return Receipt(*row) if row else None
+
+
+async def update_receipts(
+    session: AsyncSession, acks: list[tuple[int, UUID, int, int]]
+) -> list[Receipt]:
+    """
+    Move the cursors of many members forward with one statement. acks are
+    (chat_id, user_id, delivered_id, read_id), 0 when there is no ack of the
+    kind. Cursors never move back and are capped at the chat's last message,
+    acks of users that aren't members are ignored.
+
+    Returns:
+        list[Receipt]: The cursors of the updated members
+    """
+    if not acks:
+        return []
+
+    ack = values(
+        column("chat_id", Integer),
+        column("user_id", Uuid),
+        column("delivered_id", Integer),
+        column("read_id", Integer),
+        name="ack",
+    ).data(acks)
+    last_message_id = func.coalesce(
+        select(func.max(Message.id))
+        .where(Message.chat_id == ack.c.chat_id)
+        .scalar_subquery(),
+        0,
+    )
+    read_id = func.least(ack.c.read_id, last_message_id)
+    delivered_id = func.least(
+        func.greatest(ack.c.delivered_id, ack.c.read_id), last_message_id
+    )
+    # the planner picks the order the update visits the rows in, locking them
+    # in key order first keeps concurrent flushes of other workers from
+    # deadlocking
+    lock = (
+        select(ChatMember.id)
+        .where(ChatMember.chat_id == ack.c.chat_id, ChatMember.user_id == ack.c.user_id)
+        .order_by(ChatMember.chat_id, ChatMember.user_id)
+        .with_for_update(of=ChatMember)
+    )
+    await session.execute(lock)
+    query = (
+        update(ChatMember)
+        .where(ChatMember.chat_id == ack.c.chat_id, ChatMember.user_id == ack.c.user_id)
+        .values(
+            last_read_message_id=func.greatest(
+                ChatMember.last_read_message_id, read_id
+            ),
+            last_delivered_message_id=func.greatest(
+                ChatMember.last_delivered_message_id, delivered_id
+            ),
+        )
+        .returning(
+            ChatMember.chat_id,
+            ChatMember.user_id,
+            ChatMember.last_delivered_message_id,
+            ChatMember.last_read_message_id,
+        )
+    )
+    rows = (await session.execute(query)).all()
+    await session.commit()
+    return [Receipt(*row) for row in rows]
+
+
+async def get_city_names(
+    place_ids: list[str], language: UILanguages
+) -> dict[str, str]:
+    """
+    Return the names of many places with one query. Places without a name in
+    the language get their English or any other name, or are left out, and
+    a backfill is requested for them. Nothing is geocoded here.
+    """
+    if not place_ids:
+        return {}
+
+    async with session_factory() as session:
+        query = select(PlaceName.place_id, PlaceName.language, PlaceName.name).where(
+            PlaceName.place_id.in_(set(place_ids))
+        )
+        rows = (await session.execute(query)).all()
+
+    names: dict[str, dict[UILanguages, str]] = {}
+    for place_id, place_language, name in rows:
+        names.setdefault(place_id, {})[place_language] = name
+
+    city_names = {}
+    for place_id in place_ids:
+        place_names = names.get(place_id, {})
+        if language not in place_names:
+            request_place_name_backfill()
+
+        name = (
+            place_names.get(language)
+            or place_names.get(UILanguages.en)
+            or next(iter(place_names.values()), None)
+        )
+        if name:
+            city_names[place_id] = name
+    return city_names
+
+
 async def get_city_name(user: User, language: UILanguages):
     if not user.place_id:
         return None
 
-    async with session_factory() as session:
-        query = select(PlaceName).where(
-            PlaceName.place_id == user.place_id, PlaceName.language == language
-        )
-        res = await session.scalars(query)
-        try:
-            return res.one().name
-        except exc.NoResultFound:
-            _, _, place_name = get_place(user.place_id, language)
-            place = PlaceName(
-                place_id=user.place_id, language=language, name=place_name
-            )
-            session.add(place)
-            await session.commit()
-            return place_name
+    city_names = await get_city_names([user.place_id], language)
+    return city_names.get(user.place_id)
 
 
 async def delete_chat_between_users(user_id: UUID, match_id: UUID):
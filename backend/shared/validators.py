@@ -10,6 +10,9 @@ class Params:
     min_age = 18
     max_age = 100
 
+    min_distance_km = 1
+    max_distance_km = 500
+
     bio_max_length = 255
 
     media_min_count = 1
@@ -17,6 +20,11 @@ class Params:
     media_max_duration = 60
 
     message_max_length = 1000
+    messages_page_size = 50
+    messages_page_max_size = 100
+
+    chats_page_size = 20
+    chats_page_max_size = 50
 
 
 def validate_name(value: str) -> str:
@@ -161,6 +169,27 @@ def validate_preference_ages(min_age: int | None, max_age: int | None):
     return (min_age, max_age)
 
 
+def validate_max_distance_string(value: str) -> int:
+    try:
+        max_distance_km = int(value.strip().removesuffix("km").strip())
+    except ValueError:
+        raise ValueError(_("Please enter a valid distance"))
+
+    if max_distance_km < Params.min_distance_km:
+        raise ValueError(
+            _("Distance can't be lower than {min_distance} km").format(
+                min_distance=Params.min_distance_km
+            )
+        )
+    if max_distance_km > Params.max_distance_km:
+        raise ValueError(
+            _("Distance can't be higher than {max_distance} km").format(
+                max_distance=Params.max_distance_km
+            )
+        )
+    return max_distance_km
+
+
 def validate_video_duration(value: int | None):
     if value and value > Params.media_max_duration:
         raise ValueError(
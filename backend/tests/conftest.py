@@ -0,0 +1,219 @@
+import asyncio
+import random
+import uuid
+from datetime import datetime
+
+import asyncpg
+import pytest
+from sqlalchemy import insert, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from shared.core.config import settings
+
+# Tests that touch Postgres run against a database of their own next to the
+# configured one. It must be switched before shared.core.db creates the engine.
+settings.POSTGRES_DB = f"{settings.POSTGRES_DB}_test"
+
+import shared.models.chat  # noqa: E402, F401
+import shared.models.file  # noqa: E402, F401
+import shared.models.outbox  # noqa: E402, F401
+from shared.core.db import engine, session_factory  # noqa: E402
+from shared.enums import Genders, PreferredGenders, UILanguages  # noqa: E402
+from shared.models.base import Base  # noqa: E402
+from shared.models.chat import Chat, ChatMember, Message  # noqa: E402
+from shared.models.user import Preferences, User  # noqa: E402
+
+
+async def create_database() -> None:
+    connection = await asyncpg.connect(
+        user=settings.POSTGRES_USER,
+        password=settings.POSTGRES_PASSWORD,
+        host=settings.POSTGRES_HOST,
+        port=settings.POSTGRES_PORT,
+        database="postgres",
+    )
+    try:
+        await connection.execute(
+            f'DROP DATABASE IF EXISTS "{settings.POSTGRES_DB}" WITH (FORCE)'
+        )
+        await connection.execute(f'CREATE DATABASE "{settings.POSTGRES_DB}"')
+    finally:
+        await connection.close()
+
+    schema_engine = create_async_engine(settings.database_url)
+    async with schema_engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    await schema_engine.dispose()
+
+
+@pytest.fixture(scope="session")
+def database():
+    try:
+        asyncio.run(create_database())
+    except (OSError, asyncpg.PostgresError) as e:
+        pytest.skip(f"Postgres is not available: {e}")
+
+
+@pytest.fixture
+async def db(database):
+    """Empty tables for a test, pooled connections are closed after it"""
+    tables = ", ".join(f'"{table.name}"' for table in Base.metadata.sorted_tables)
+    async with engine.begin() as connection:
+        await connection.execute(text(f"TRUNCATE {tables} RESTART IDENTITY CASCADE"))
+    yield
+    # the pool is bound to the event loop of the test
+    await engine.dispose()
+
+
+@pytest.fixture
+def make_user(db):
+    """Create a user with preferences, random values unless given"""
+    telegram_ids = iter(range(1, 10**9))
+
+    async def make_user(
+        latitude: float = 41.3,
+        longitude: float = 69.24,
+        birth_date: datetime | None = None,
+        rating: int | None = None,
+        gender: Genders | None = None,
+        min_age: int | None = None,
+        max_age: int | None = None,
+        preferred_gender: PreferredGenders = PreferredGenders.both,
+        max_distance_km: int | None = None,
+    ) -> User:
+        user = User(
+            id=uuid.uuid4(),
+            telegram_id=next(telegram_ids),
+            name="Test",
+            birth_date=birth_date or datetime(random.randint(1980, 2005), 1, 1),
+            rating=rating if rating is not None else settings.DEFAULT_RATING,
+            gender=gender or random.choice(list(Genders)),
+            latitude=latitude,
+            longitude=longitude,
+            ui_language=UILanguages.en,
+            is_active=True,
+            preferences=Preferences(
+                min_age=min_age,
+                max_age=max_age,
+                preferred_gender=preferred_gender,
+                max_distance_km=max_distance_km,
+            ),
+        )
+        async with session_factory() as session:
+            session.add(user)
+            await session.commit()
+        return user
+
+    return make_user
+
+
+@pytest.fixture
+def make_users(db):
+    """
+    Bulk insert a user with preferences for every dict of User column values,
+    the other columns are random like in make_user. Returns the user ids.
+    """
+    telegram_ids = iter(range(10**9, 2 * 10**9))
+
+    async def make_users(rows: list[dict]) -> list[uuid.UUID]:
+        users = [
+            {
+                "id": uuid.uuid4(),
+                "telegram_id": next(telegram_ids),
+                "name": "Test",
+                "birth_date": datetime(random.randint(1980, 2005), 1, 1),
+                "rating": settings.DEFAULT_RATING,
+                "gender": random.choice(list(Genders)),
+                "latitude": 41.3,
+                "longitude": 69.24,
+                "ui_language": UILanguages.en,
+                **row,
+            }
+            for row in rows
+        ]
+        preferences = [
+            {"user_id": user["id"], "preferred_gender": PreferredGenders.both}
+            for user in users
+        ]
+        async with session_factory() as session:
+            await session.execute(insert(User), users)
+            await session.execute(insert(Preferences), preferences)
+            await session.commit()
+        return [user["id"] for user in users]
+
+    return make_users
+
+
+@pytest.fixture
+def make_chat(db):
+    """Create a chat between the users"""
+
+    async def make_chat(*users: User) -> Chat:
+        chat = Chat(members=[ChatMember(user_id=user.id) for user in users])
+        async with session_factory() as session:
+            session.add(chat)
+            await session.commit()
+        return chat
+
+    return make_chat
+
+
+@pytest.fixture
+def make_message(db):
+    """Add a message to a chat, created now unless given"""
+
+    async def make_message(
+        chat: Chat, user: User, text: str = "hi", created_at: datetime | None = None
+    ) -> Message:
+        message = Message(chat_id=chat.id, user_id=user.id, text=text)
+        if created_at:
+            message.created_at = created_at
+        async with session_factory() as session:
+            session.add(message)
+            await session.commit()
+        return message
+
+    return make_message
+
+
+@pytest.fixture
+async def api_client(db):
+    """
+    Return a client of the API for a user, the Telegram init data check is
+    skipped. The app's lifespan doesn't run.
+    """
+    from aiogram.utils.web_app import WebAppInitData, WebAppUser
+    from httpx import ASGITransport, AsyncClient
+
+    from api.dependencies import validate_init_data
+    from api.main import app
+
+    clients = []
+
+    def api_client(user: User) -> AsyncClient:
+        def init_data():
+            return WebAppInitData(
+                user=WebAppUser(id=user.telegram_id, first_name=user.name),
+                auth_date=datetime.now(),
+                hash="",
+            )
+
+        app.dependency_overrides[validate_init_data] = init_data
+        clients.append(AsyncClient(transport=ASGITransport(app), base_url="http://api"))
+        return clients[-1]
+
+    yield api_client
+
+    app.dependency_overrides.clear()
+    for client in clients:
+        await client.aclose()
+
+
+@pytest.fixture
+def without_decks(monkeypatch):
+    """Skip the swipe deck updates of reactions, they live in Mongo"""
+
+    async def discard_candidate(user_id, candidate_id):
+        pass
+
+    monkeypatch.setattr("shared.queries.discard_candidate", discard_candidate)
@@ -0,0 +1,88 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import func, literal, select
+
+from shared.core.db import session_factory
+from shared.models.user import User, subtract_years
+
+MIN_AGE, MAX_AGE = 18, 30
+TODAYS = [
+    date(2024, 2, 28),
+    date(2024, 2, 29),
+    date(2024, 3, 1),
+    date(2023, 2, 28),
+    date(2023, 3, 1),
+    date(2025, 6, 15),
+    date(2025, 12, 31),
+    date(2026, 1, 1),
+]
+
+
+def birthdays_around(today: date) -> list[datetime]:
+    """
+    Days around the birthdays turning MIN_AGE and MAX_AGE + 1 today, and
+    every Feb 28, Feb 29 and Mar 1 from 15 to 35 years ago
+    """
+    days = set()
+    for years in (MIN_AGE, MAX_AGE + 1):
+        anniversary = subtract_years(today, years)
+        days.update(anniversary + timedelta(days=i) for i in range(-4, 5))
+    for year in range(today.year - 35, today.year - 14):
+        days.update([date(year, 2, 28), date(year, 3, 1)])
+        if year % 4 == 0:
+            days.add(date(year, 2, 29))
+    return [datetime(day.year, day.month, day.day) for day in sorted(days)]
+
+
+async def birth_dates_where(clause) -> list[datetime]:
+    async with session_factory() as session:
+        query = select(User.birth_date).where(clause).order_by(User.birth_date)
+        return list((await session.scalars(query)).all())
+
+
+@pytest.mark.parametrize("today", TODAYS, ids=str)
+async def test_age_between_matches_the_database_age(make_users, today):
+    await make_users([{"birth_date": day} for day in birthdays_around(today)])
+    age = func.date_part("year", func.age(literal(today), User.birth_date))
+
+    expected = await birth_dates_where(age.between(MIN_AGE, MAX_AGE))
+
+    assert await birth_dates_where(User.age_between(MIN_AGE, MAX_AGE, today)) == (
+        expected
+    )
+    assert expected
+
+
+async def test_age_between_matches_age_today(make_users):
+    today = date.today()
+    await make_users([{"birth_date": day} for day in birthdays_around(today)])
+
+    assert await birth_dates_where(User.age_between(MIN_AGE, MAX_AGE)) == (
+        await birth_dates_where(User.age.between(MIN_AGE, MAX_AGE))
+    )
+
+
+async def test_age_between_boundaries(make_users):
+    today = date(2024, 2, 29)
+    await make_users(
+        [
+            {"birth_date": datetime(*day)}
+            for day in [
+                # turned 18 yesterday and turns 18 tomorrow
+                (2006, 2, 28),
+                (2006, 3, 1),
+                # turns 31 tomorrow and turned 31 yesterday
+                (1993, 3, 1),
+                (1993, 2, 28),
+                # born on Feb 29, 20 years old today
+                (2004, 2, 29),
+            ]
+        ]
+    )
+
+    assert await birth_dates_where(User.age_between(MIN_AGE, MAX_AGE, today)) == [
+        datetime(1993, 3, 1),
+        datetime(2004, 2, 29),
+        datetime(2006, 2, 28),
+    ]
@@ -0,0 +1,212 @@
+import asyncio
+import contextlib
+import multiprocessing
+import time
+
+import pytest
+
+from sqlalchemy import text
+
+from api.backplane import PostgresBackplane
+from shared.core.config import settings
+from shared.core.db import session_factory
+
+PRESENCE_INTERVAL = 0.2
+
+
+def run_worker(connection, user_ids: list[str]) -> None:
+    """
+    An API worker in its own process with the given users connected. It
+    reports the messages delivered to it and takes commands over the pipe.
+    """
+    asyncio.run(worker(connection, set(user_ids)))
+
+
+async def worker(connection, users: set[str]) -> None:
+    backplane = PostgresBackplane()
+
+    async def deliver(user_id: str, message: str) -> None:
+        connection.send(("delivered", user_id, message))
+
+    task = asyncio.create_task(backplane.run(deliver, lambda: users))
+    while True:
+        command, *args = await asyncio.to_thread(connection.recv)
+        if command == "stop":
+            break
+        if command == "connect":
+            users.add(args[0])
+            await backplane.announce(args[0], True)
+        elif command == "disconnect":
+            users.discard(args[0])
+            await backplane.announce(args[0], False)
+        elif command == "publish":
+            await backplane.publish(*args)
+        elif command == "is_connected":
+            connection.send(("is_connected", backplane.is_connected(args[0])))
+    task.cancel()
+
+
+class Worker:
+    def __init__(self, *user_ids: str):
+        context = multiprocessing.get_context("spawn")
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=run_worker, args=(child_connection, list(user_ids))
+        )
+        self.process.start()
+
+    def send(self, *command) -> None:
+        self.connection.send(command)
+
+    async def receive(self, timeout: float = 5) -> tuple:
+        assert await asyncio.to_thread(self.connection.poll, timeout)
+        return self.connection.recv()
+
+    def stop(self) -> None:
+        if self.process.is_alive():
+            self.send("stop")
+            self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+
+
+async def wait_until(condition, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.02)
+
+
+async def listen_connections() -> list[int]:
+    async with session_factory() as session:
+        query = text(
+            "SELECT pid FROM pg_stat_activity"
+            " WHERE datname = current_database() AND query LIKE 'LISTEN%'"
+        )
+        return list(await session.scalars(query))
+
+
+@pytest.fixture
+def delivered() -> list[tuple[str, str]]:
+    return []
+
+
+@pytest.fixture
+async def backplane(db, monkeypatch, delivered):
+    """The backplane of this process, the workers read the settings from env"""
+    monkeypatch.setenv("POSTGRES_DB", settings.POSTGRES_DB)
+    monkeypatch.setenv("WEBSOCKET_PRESENCE_INTERVAL", str(PRESENCE_INTERVAL))
+    monkeypatch.setattr(settings, "WEBSOCKET_PRESENCE_INTERVAL", PRESENCE_INTERVAL)
+
+    async def deliver(user_id: str, message: str) -> None:
+        delivered.append((user_id, message))
+
+    backplane = PostgresBackplane()
+    task = asyncio.create_task(backplane.run(deliver, lambda: ["carol"]))
+    yield backplane
+
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+
+
+@pytest.fixture
+async def start_worker(backplane):
+    workers: list[Worker] = []
+
+    def start(*user_ids: str) -> Worker:
+        workers.append(Worker(*user_ids))
+        return workers[-1]
+
+    yield start
+
+    for worker in workers:
+        await asyncio.to_thread(worker.stop)
+
+
+async def test_presence_is_shared_between_workers(
+    backplane, start_worker, delivered
+):
+    alice = start_worker("alice")
+    await wait_until(lambda: backplane.is_connected("alice"))
+
+    bob = start_worker("bob")
+    await wait_until(lambda: backplane.is_connected("bob"))
+    # a worker started later learns the users connected to the others
+    for user_id in ("alice", "carol"):
+        bob.send("is_connected", user_id)
+        assert await bob.receive() == ("is_connected", True)
+    bob.send("is_connected", "bob")
+    assert await bob.receive() == ("is_connected", False)
+
+    alice.send("publish", "bob", "hi")
+    assert await bob.receive() == ("delivered", "bob", "hi")
+    await wait_until(lambda: delivered)
+    assert delivered == [("bob", "hi")]
+
+    alice.send("connect", "dave")
+    await wait_until(lambda: backplane.is_connected("dave"))
+    alice.send("disconnect", "dave")
+    await wait_until(lambda: not backplane.is_connected("dave"))
+    assert backplane.is_connected("alice")
+
+
+async def test_long_messages_are_reassembled(
+    backplane, start_worker, delivered
+):
+    alice = start_worker("alice")
+    await wait_until(lambda: backplane.is_connected("alice"))
+
+    # multibyte characters, several times PAYLOAD_LIMIT bytes
+    message = "привет 👋 " * 2000
+    await backplane.publish("alice", message)
+    assert await alice.receive() == ("delivered", "alice", message)
+
+    alice.send("publish", "carol", message)
+    await wait_until(lambda: delivered)
+    assert delivered == [("carol", message)]
+
+
+async def test_crashed_worker_users_expire(backplane, start_worker):
+    alice = start_worker("alice")
+    await wait_until(lambda: backplane.is_connected("alice"))
+
+    # heartbeats keep the users of a live worker connected
+    await asyncio.sleep(5 * PRESENCE_INTERVAL)
+    assert backplane.is_connected("alice")
+
+    alice.process.kill()
+    # forgotten after three missed heartbeats, not on the next reconnect
+    await wait_until(
+        lambda: not backplane.is_connected("alice"), timeout=10 * PRESENCE_INTERVAL
+    )
+
+
+async def test_connection_is_replaced_and_closed(db, monkeypatch):
+    monkeypatch.setattr(PostgresBackplane, "RECONNECT_DELAY", 0.05)
+    backplane = PostgresBackplane()
+    task = asyncio.create_task(backplane.run(lambda *args: None, list))
+    for _ in range(250):
+        if pids := await listen_connections():
+            break
+        await asyncio.sleep(0.02)
+    assert len(pids) == 1
+
+    # the server drops the connection, the backplane listens on a new one
+    async with session_factory() as session:
+        await session.execute(text(f"SELECT pg_terminate_backend({pids[0]})"))
+    for _ in range(250):
+        new_pids = await listen_connections()
+        if new_pids and new_pids != pids:
+            break
+        await asyncio.sleep(0.02)
+    assert len(new_pids) == 1 and new_pids != pids
+
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+    for _ in range(50):
+        if not await listen_connections():
+            break
+        await asyncio.sleep(0.02)
+    assert await listen_connections() == []
@@ -0,0 +1,175 @@
+import asyncio
+import contextlib
+import importlib.util
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from sqlalchemy import delete, func, text, update
+from sqlalchemy.exc import InterfaceError
+
+from shared import bans
+from shared.core.config import settings
+from shared.core.db import engine, session_factory
+from shared.models.user import Ban
+
+MIGRATION = (
+    settings.BASE_DIR
+    / "shared/alembic/versions/e5d93b7f1a26_notify_ban_changes.py"
+)
+
+
+def create_trigger(connection) -> None:
+    """Apply the migration adding the ban_changed trigger, create_all lacks it"""
+    spec = importlib.util.spec_from_file_location("notify_ban_changes", MIGRATION)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+    with Operations.context(MigrationContext.configure(connection)):
+        migration.upgrade()
+
+
+async def wait_until(condition, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.02)
+
+
+async def listen_connections() -> int:
+    async with session_factory() as session:
+        query = text(
+            "SELECT count(*) FROM pg_stat_activity"
+            " WHERE datname = current_database() AND query LIKE 'LISTEN%'"
+        )
+        return await session.scalar(query)
+
+
+@pytest.fixture
+async def registry(db, monkeypatch):
+    async with engine.begin() as connection:
+        await connection.run_sync(create_trigger)
+
+    changed: list[int] = []
+    monkeypatch.setattr(bans, "expiry_changed", asyncio.Event())
+    monkeypatch.setattr(bans, "ban_listeners", [changed.append])
+    task = asyncio.create_task(bans.run_ban_registry())
+    await wait_until(lambda: bans.is_loaded)
+    yield changed
+
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+    bans.banned.clear()
+    bans.expiry_heap.clear()
+    async with engine.begin() as connection:
+        await connection.exec_driver_sql("DROP TRIGGER ban_changed ON ban")
+        await connection.exec_driver_sql("DROP FUNCTION notify_ban_changed()")
+
+
+async def add_ban(telegram_id: int, expires_at: datetime | None = None) -> int:
+    async with session_factory() as session:
+        ban = Ban(user_telegram_id=telegram_id, reason="spam", expires_at=expires_at)
+        session.add(ban)
+        await session.commit()
+        return ban.id
+
+
+async def test_ban_changes_reach_the_registry(registry):
+    ban_id = await add_ban(1)
+    await wait_until(lambda: bans.is_banned(1))
+    assert registry == [1]
+    assert bans.get_banned_ids() == [1]
+
+    # a longer ban doesn't get shortened by an expiring one
+    await add_ban(1, datetime.now(timezone.utc) + timedelta(hours=1))
+    await wait_until(lambda: len(registry) == 2)
+    assert bans.banned[1] is None
+
+    async with session_factory() as session:
+        await session.execute(delete(Ban).where(Ban.id == ban_id))
+        await session.commit()
+    await wait_until(lambda: len(registry) == 3)
+    assert bans.is_banned(1)
+
+    async with session_factory() as session:
+        await session.execute(delete(Ban))
+        await session.commit()
+    await wait_until(lambda: not bans.is_banned(1))
+    assert bans.get_banned_ids() == []
+
+
+async def test_bans_expire(registry):
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=0.3)
+    await add_ban(1, expires_at)
+    await add_ban(2, expires_at + timedelta(hours=1))
+    await wait_until(lambda: bans.is_banned(1) and bans.is_banned(2))
+
+    await wait_until(lambda: 1 not in bans.banned)
+    assert datetime.now(timezone.utc) >= expires_at
+    # refreshes run concurrently and may finish in any order
+    assert sorted(registry[:2]) == [1, 2]
+    assert registry[2:] == [1]
+    assert bans.is_banned(2)
+
+    # a ban extended before it expires stays
+    async with session_factory() as session:
+        query = update(Ban).where(Ban.user_telegram_id == 2).values(
+            expires_at=func.now() + timedelta(hours=2)
+        )
+        await session.execute(query)
+        await session.commit()
+    await wait_until(lambda: len(registry) == 4)
+    assert bans.banned[2] > expires_at + timedelta(hours=1)
+
+
+async def test_loaded_bans_are_used_by_queries(registry):
+    await add_ban(1)
+    await add_ban(2, datetime.now(timezone.utc) - timedelta(hours=1))
+    await wait_until(lambda: len(registry) == 2)
+
+    assert bans.get_banned_ids() == [1]
+    assert str(bans.get_not_banned_clause()).endswith("!= ALL (:banned_ids)")
+
+
+async def test_registry_reloads_after_errors(registry, monkeypatch):
+    monkeypatch.setattr(bans, "RECONNECT_DELAY", 0.05)
+    load_bans = bans.load_bans
+    failures = [InterfaceError("SELECT", {}, Exception("connection lost"))]
+
+    async def flaky_load_bans():
+        if failures:
+            raise failures.pop()
+        await load_bans()
+
+    async def failing_refresh_ban(telegram_id: int):
+        raise InterfaceError("SELECT", {}, Exception("connection lost"))
+
+    monkeypatch.setattr(bans, "load_bans", flaky_load_bans)
+    monkeypatch.setattr(bans, "refresh_ban", failing_refresh_ban)
+    await add_ban(1)
+
+    # the failed refresh drops the connection, the failed load is retried
+    await wait_until(lambda: not bans.is_loaded)
+    await wait_until(lambda: bans.is_loaded)
+    assert not failures
+    assert bans.is_banned(1)
+
+
+async def test_cancelling_closes_the_connection(db, monkeypatch):
+    monkeypatch.setattr(bans, "expiry_changed", asyncio.Event())
+    task = asyncio.create_task(bans.run_ban_registry())
+    await wait_until(lambda: bans.is_loaded)
+    assert await listen_connections() == 1
+
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+
+    assert not bans.is_loaded
+    for _ in range(50):
+        if not await listen_connections():
+            break
+        await asyncio.sleep(0.02)
+    assert await listen_connections() == 0
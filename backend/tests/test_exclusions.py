@@ -0,0 +1,151 @@
+import asyncio
+import tracemalloc
+import uuid
+
+import pytest
+
+from shared.core.config import settings
+from shared.core.db import session_factory
+from shared.enums import ReactionType
+from shared.matching.algorithm import get_potential_matches_query
+from shared.matching.exclusions import (add_exclusion, exclusions,
+                                        get_excluded_ids,
+                                        get_exclusions_query,
+                                        invalidate_exclusions,
+                                        pending_changes)
+from shared.models.user import Report, User
+from shared.queries import create_or_update_reaction
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    exclusions.clear()
+    pending_changes.clear()
+    yield
+    exclusions.clear()
+    pending_changes.clear()
+
+
+async def load_excluded_ids(user_id: uuid.UUID) -> set[uuid.UUID]:
+    async with session_factory() as session:
+        return set((await session.scalars(get_exclusions_query(user_id))).all())
+
+
+async def report(user: User, reported: User) -> None:
+    async with session_factory() as session:
+        session.add(Report(from_user_id=user.id, to_user_id=reported.id, reason="-"))
+        await session.commit()
+    add_exclusion(user.id, reported.id)
+    add_exclusion(reported.id, user.id)
+
+
+async def test_excluded_ids_are_exact(make_user, without_decks):
+    me = await make_user()
+    liked, disliked, disliked_me, liked_me, reported, reported_me, _ = [
+        await make_user() for _ in range(7)
+    ]
+    await create_or_update_reaction(me, liked, ReactionType.like)
+    await create_or_update_reaction(me, disliked, ReactionType.dislike)
+    await create_or_update_reaction(disliked_me, me, ReactionType.dislike)
+    await create_or_update_reaction(liked_me, me, ReactionType.like)
+    await report(me, reported)
+    await report(reported_me, me)
+
+    # no false positives: a user who liked me is still suggested
+    assert await get_excluded_ids(me.id) == {
+        liked.id,
+        disliked.id,
+        disliked_me.id,
+        reported.id,
+        reported_me.id,
+    }
+
+
+async def test_cached_set_follows_reactions_and_reports(make_user, without_decks):
+    me, *others = [await make_user() for _ in range(5)]
+    await get_excluded_ids(me.id)
+    assert me.id in exclusions
+
+    await create_or_update_reaction(me, others[0], ReactionType.like)
+    await create_or_update_reaction(others[1], me, ReactionType.dislike)
+    await create_or_update_reaction(others[2], me, ReactionType.like)
+    await report(others[3], me)
+
+    assert await get_excluded_ids(me.id) == await load_excluded_ids(me.id)
+
+
+async def test_taking_back_a_dislike_invalidates(make_user, without_decks):
+    me, match = await make_user(), await make_user()
+    await create_or_update_reaction(me, match, ReactionType.dislike)
+    assert me.id in await get_excluded_ids(match.id)
+
+    await create_or_update_reaction(me, match, ReactionType.like)
+
+    assert match.id not in exclusions
+    assert me.id not in await get_excluded_ids(match.id)
+
+
+async def test_changes_during_a_load_are_kept(make_user):
+    me = await make_user()
+    excluded_id = uuid.uuid4()
+
+    load = asyncio.create_task(get_excluded_ids(me.id))
+    await asyncio.sleep(0)  # the load is waiting for the database now
+    add_exclusion(me.id, excluded_id)
+
+    assert excluded_id in await load
+    assert excluded_id in exclusions[me.id]
+
+
+async def test_invalidation_during_a_load_skips_caching(make_user):
+    me = await make_user()
+
+    load = asyncio.create_task(get_excluded_ids(me.id))
+    await asyncio.sleep(0)
+    invalidate_exclusions(me.id)
+    await load
+
+    assert me.id not in exclusions
+
+
+async def test_cache_keeps_most_recently_used_users(make_user, monkeypatch):
+    monkeypatch.setattr(settings, "EXCLUSION_CACHE_SIZE", 2)
+    first, second, third = [await make_user() for _ in range(3)]
+
+    await get_excluded_ids(first.id)
+    await get_excluded_ids(second.id)
+    await get_excluded_ids(first.id)
+    await get_excluded_ids(third.id)
+
+    assert list(exclusions) == [first.id, third.id]
+
+
+async def test_candidate_query_matches_subqueries(make_user, without_decks):
+    me, *others = [await make_user() for _ in range(12)]
+    for other in others[:3]:
+        await create_or_update_reaction(me, other, ReactionType.like)
+    await create_or_update_reaction(others[3], me, ReactionType.dislike)
+    await create_or_update_reaction(others[4], me, ReactionType.like)
+    await report(others[5], me)
+
+    async with session_factory() as session:
+        excluded_ids = await get_excluded_ids(me.id)
+        query = get_potential_matches_query(me, excluded_ids)
+        cached = set((await session.scalars(query.with_only_columns(User.id))).all())
+        query = get_potential_matches_query(me)
+        uncached = set((await session.scalars(query.with_only_columns(User.id))).all())
+
+    assert cached == uncached == {other.id for other in others[4:5] + others[6:]}
+
+
+def test_memory_per_excluded_id():
+    # the module documents about 160 bytes per cached id
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        ids = {uuid.uuid4() for _ in range(100_000)}
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+    assert 100 < used / len(ids) < 200
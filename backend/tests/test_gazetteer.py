@@ -0,0 +1,173 @@
+import csv
+import random
+import statistics
+import time
+import tracemalloc
+from pathlib import Path
+
+import pytest
+
+from shared import gazetteer as gazetteer_module
+from shared.core.config import settings
+from shared.enums import UILanguages
+from shared.gazetteer import get_gazetteer, load_gazetteer
+from shared.geo import get_geo_cell
+
+HEADER = ["place_id", "latitude", "longitude", "name_en", "name_ru", "name_uz"]
+# degrees of latitude per km
+KM = 1 / 111.195
+
+
+def write_gazetteer(path: Path, rows: list[tuple], header=HEADER) -> Path:
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        writer.writerows(rows)
+    return path
+
+
+@pytest.fixture
+def gazetteer(tmp_path):
+    return load_gazetteer(
+        write_gazetteer(
+            tmp_path / "localities.csv",
+            [
+                ("samarkand", 39.65, 66.96, "Samarkand", "Самарканд", "Samarqand"),
+                ("tashkent", 41.3, 69.24, "Tashkent", "Ташкент", "Toshkent"),
+                ("chirchiq", 41.47, 69.58, "Chirchiq", "", ""),
+                # the same cell as Tashkent
+                ("yunusabad", 41.36, 69.29, "Yunusabad", "Юнусабад", "Yunusobod"),
+            ],
+        )
+    )
+
+
+def test_localities_are_sorted_by_cell(gazetteer):
+    assert list(gazetteer.cells) == sorted(gazetteer.cells)
+    for row, place_id in enumerate(gazetteer.place_ids):
+        assert gazetteer.rows[place_id] == row
+        assert gazetteer.cells[row] == get_geo_cell(
+            gazetteer.latitudes[row], gazetteer.longitudes[row]
+        )
+
+
+def test_names_follow_their_place(gazetteer):
+    assert gazetteer.get_name("tashkent", UILanguages.ru) == "Ташкент"
+    assert gazetteer.get_name("samarkand", UILanguages.uz) == "Samarqand"
+    # empty and unknown names are left to the remote API
+    assert gazetteer.get_name("chirchiq", UILanguages.ru) is None
+    assert gazetteer.get_name("paris", UILanguages.en) is None
+
+
+def test_missing_name_columns_and_empty_files(tmp_path):
+    gazetteer = load_gazetteer(
+        write_gazetteer(
+            tmp_path / "partial.csv",
+            [("tashkent", 41.3, 69.24, "Tashkent")],
+            header=HEADER[:4],
+        )
+    )
+    assert gazetteer.get_name("tashkent", UILanguages.en) == "Tashkent"
+    assert gazetteer.get_name("tashkent", UILanguages.uz) is None
+
+    empty = load_gazetteer(write_gazetteer(tmp_path / "empty.csv", []))
+    assert empty.place_ids == []
+    assert empty.find_place_id(41.3, 69.24) is None
+
+
+def test_nearest_locality_is_found(gazetteer):
+    assert gazetteer.find_place_id(41.31, 69.25) == "tashkent"
+    assert gazetteer.find_place_id(41.35, 69.28) == "yunusabad"
+    assert gazetteer.find_place_id(41.45, 69.55) == "chirchiq"
+
+
+def test_only_localities_within_the_max_distance(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "GAZETTEER_MAX_DISTANCE", 30)
+    gazetteer = load_gazetteer(
+        write_gazetteer(tmp_path / "localities.csv", [("tashkent", 41.3, 69.24)])
+    )
+
+    # the nearest one, even a few cells away
+    assert gazetteer.find_place_id(41.3 + 29 * KM, 69.24) == "tashkent"
+    assert gazetteer.find_place_id(41.3 - 29 * KM, 69.24) == "tashkent"
+    # the remote API is asked for the rest
+    assert gazetteer.find_place_id(41.3 + 31 * KM, 69.24) is None
+    assert gazetteer.find_place_id(0, 0) is None
+
+
+@pytest.mark.parametrize(
+    "point, near, far",
+    [
+        # the corner of four cells, the nearest one is in another cell
+        ((41.2501, 69.2501), (41.2499, 69.2499), (41.26, 69.26)),
+        # across the antimeridian
+        ((10.0, 179.999), (10.0, -179.999), (10.0, 179.9)),
+        # across the north pole
+        ((89.99, 0.0), (89.99, 180.0), (89.9, 0.0)),
+    ],
+)
+def test_lookup_crosses_cell_boundaries(tmp_path, point, near, far):
+    gazetteer = load_gazetteer(
+        write_gazetteer(tmp_path / "localities.csv", [("near", *near), ("far", *far)])
+    )
+    assert get_geo_cell(*point) != get_geo_cell(*near)
+
+    assert gazetteer.find_place_id(*point) == "near"
+
+
+def test_gazetteer_is_loaded_once(tmp_path, monkeypatch):
+    path = write_gazetteer(tmp_path / "localities.csv", [("tashkent", 41.3, 69.24)])
+    monkeypatch.setattr(gazetteer_module, "gazetteer", None)
+    monkeypatch.setattr(settings, "GAZETTEER_PATH", None)
+    assert get_gazetteer() is None
+
+    monkeypatch.setattr(settings, "GAZETTEER_PATH", path)
+    loaded = get_gazetteer()
+    assert loaded.place_ids == ["tashkent"]
+    assert get_gazetteer() is loaded
+
+
+@pytest.mark.benchmark
+def test_load_time_memory_and_lookup_latency(tmp_path):
+    # about the size of GeoNames' cities500, every locality of 500+ people
+    count = 200_000
+    rng = random.Random(17)
+    path = write_gazetteer(
+        tmp_path / "localities.csv",
+        [
+            (
+                f"place{i}",
+                round(rng.uniform(-60, 70), 6),
+                round(rng.uniform(-180, 180), 6),
+                f"Place {i}",
+                f"Место {i}",
+                f"Joy {i}",
+            )
+            for i in range(count)
+        ],
+    )
+
+    started_at = time.perf_counter()
+    load_gazetteer(path)
+    load_time = time.perf_counter() - started_at
+    # tracing slows the load down, so it is measured apart
+    tracemalloc.start()
+    gazetteer = load_gazetteer(path)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = []
+    for _ in range(10_000):
+        latitude, longitude = rng.uniform(-60, 70), rng.uniform(-180, 180)
+        started_at = time.perf_counter()
+        gazetteer.find_place_id(latitude, longitude)
+        timings.append(time.perf_counter() - started_at)
+    lookup = statistics.median(timings)
+    print(
+        f"\n{count} localities: loaded in {load_time:.2f} s,"
+        f" {retained / 2**20:.0f} MiB retained, {peak / 2**20:.0f} MiB peak,"
+        f" lookup {lookup * 10**6:.0f} µs"
+    )
+
+    assert len(gazetteer.place_ids) == count
+    assert lookup < 0.001
@@ -0,0 +1,182 @@
+import random
+import statistics
+import time
+from datetime import datetime
+from math import asin, atan2, cos, degrees, radians, sin
+
+import pytest
+from sqlalchemy import select
+
+from shared.core.config import settings
+from shared.core.db import session_factory
+from shared.geo import (EARTH_RADIUS, get_geo_cell, get_geo_cells_within,
+                        haversine_distance)
+from shared.matching.algorithm import (get_best_matches,
+                                       get_distance_expression,
+                                       get_potential_matches_query,
+                                       rank_candidates)
+from shared.matching.exclusions import get_excluded_ids
+from shared.models.user import User
+
+# near the antimeridian, at high latitudes and around the poles
+ORIGINS = [
+    (0, 179.95),
+    (-36.85, -179.9),
+    (65.0, 180.0),
+    (78.2, 15.6),
+    (-77.8, 166.7),
+    (89.95, -30.0),
+    (-89.99, 0.0),
+]
+RADII = [10, 50, 300]
+
+
+def destination(
+    latitude: float, longitude: float, distance: float, bearing: float
+) -> tuple[float, float]:
+    """The point `distance` km away from the given one along the bearing"""
+    lat1, lon1, angle = radians(latitude), radians(longitude), distance / EARTH_RADIUS
+    bearing = radians(bearing)
+    lat2 = asin(sin(lat1) * cos(angle) + cos(lat1) * sin(angle) * cos(bearing))
+    lon2 = lon1 + atan2(
+        sin(bearing) * sin(angle) * cos(lat1), cos(angle) - sin(lat1) * sin(lat2)
+    )
+    return degrees(lat2), (degrees(lon2) + 180) % 360 - 180
+
+
+def points_around(
+    rng: random.Random, latitude: float, longitude: float, radius: float, count: int
+) -> list[tuple[float, float]]:
+    """Points up to twice the radius away, none right on the circle"""
+    points = []
+    while len(points) < count:
+        distance = rng.uniform(0, 2 * radius)
+        if abs(distance - radius) > 0.01:
+            points.append(
+                destination(latitude, longitude, distance, rng.uniform(0, 360))
+            )
+    return points
+
+
+@pytest.mark.parametrize("radius", RADII)
+@pytest.mark.parametrize("latitude, longitude", ORIGINS)
+def test_cells_cover_the_circle(latitude, longitude, radius):
+    cells = set(get_geo_cells_within(latitude, longitude, radius))
+    rng = random.Random(f"{latitude}, {longitude}, {radius}")
+
+    for point in points_around(rng, latitude, longitude, radius, 2000):
+        if haversine_distance(latitude, longitude, *point) <= radius:
+            assert get_geo_cell(*point) in cells, point
+
+
+@pytest.mark.parametrize("radius", RADII)
+@pytest.mark.parametrize("latitude, longitude", ORIGINS)
+async def test_prefilter_matches_the_distance_filter(
+    make_user, make_users, latitude, longitude, radius
+):
+    me = await make_user(latitude, longitude, max_distance_km=radius)
+    rng = random.Random(f"{latitude}, {longitude}, {radius}")
+    points = points_around(rng, latitude, longitude, radius, 300)
+    await make_users([{"latitude": lat, "longitude": lon} for lat, lon in points])
+
+    async with session_factory() as session:
+        prefiltered = set(
+            (await session.scalars(get_potential_matches_query(me))).all()
+        )
+        query = select(User).where(
+            User.id != me.id,
+            get_distance_expression(latitude, longitude) <= radius,
+        )
+        expected = set((await session.scalars(query)).all())
+
+    assert {user.id for user in prefiltered} == {user.id for user in expected}
+    # the database cells are the Python ones
+    assert all(
+        user.geo_cell == get_geo_cell(user.latitude, user.longitude)
+        for user in prefiltered
+    )
+    assert len(expected) > 10
+
+
+@pytest.fixture
+async def rings(make_user, monkeypatch):
+    """
+    A user and candidates east of them at 5, 50, 100 and 300 km, each one
+    in the next ring of cells. The nearest one has the lowest rating, so it
+    only comes first while the search stays in the innermost ring.
+    """
+    radii = [10, 60, 120]
+    monkeypatch.setattr(settings, "MATCH_SEARCH_RADII", radii)
+    birth_date = datetime(1995, 1, 1)
+    me = await make_user(birth_date=birth_date)
+    candidates = {}
+    for distance, rating in [(5, 1000), (50, 1800), (100, 1700), (300, 1600)]:
+        latitude, longitude = destination(me.latitude, me.longitude, distance, 90)
+        candidates[distance] = await make_user(
+            latitude, longitude, birth_date=birth_date, rating=rating
+        )
+
+    # the cells of a ring reach further than its radius, but not this far
+    for radius, distance in zip(radii, [50, 100, 300]):
+        cells = get_geo_cells_within(me.latitude, me.longitude, radius)
+        candidate = candidates[distance]
+        assert get_geo_cell(candidate.latitude, candidate.longitude) not in cells
+    return me, candidates
+
+
+@pytest.mark.parametrize(
+    "limit, expected",
+    [(1, [5]), (2, [50, 5]), (3, [50, 100, 5]), (10, [50, 100, 5, 300])],
+)
+async def test_search_widens_through_the_radii(rings, limit, expected):
+    me, candidates = rings
+
+    matches = await get_best_matches(me, limit=limit)
+
+    assert [match.id for match in matches] == [candidates[d].id for d in expected]
+
+
+async def test_last_ring_keeps_the_max_distance(rings):
+    me, candidates = rings
+    me.preferences.max_distance_km = 80
+
+    matches = await get_best_matches(me, limit=10)
+
+    assert [match.id for match in matches] == [candidates[50].id, candidates[5].id]
+
+
+async def median_seconds(call, repeat: int = 5) -> float:
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        await call()
+        timings.append(time.perf_counter() - started_at)
+    return statistics.median(timings)
+
+
+@pytest.mark.benchmark
+async def test_prefilter_is_faster_than_a_full_scan(make_user, make_users):
+    # users spread over Uzbekistan, the current one in Tashkent
+    rng = random.Random(5)
+    count = 100_000
+    await make_users(
+        [
+            {"latitude": rng.uniform(37.2, 45.6), "longitude": rng.uniform(56, 73)}
+            for _ in range(count)
+        ]
+    )
+    me = await make_user()
+
+    async def full_scan():
+        async with session_factory() as session:
+            query = get_potential_matches_query(me, await get_excluded_ids(me.id))
+            return await rank_candidates(session, query, me, me.preferences, 10)
+
+    prefiltered = await median_seconds(lambda: get_best_matches(me, limit=10))
+    unbounded = await median_seconds(full_scan)
+    print(
+        f"{count} users: prefiltered {prefiltered * 1000:.1f} ms,"
+        f" full scan {unbounded * 1000:.1f} ms"
+    )
+
+    assert prefiltered * 5 < unbounded
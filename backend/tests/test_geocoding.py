@@ -0,0 +1,175 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from shared import geocoding
+from shared.core.config import settings
+from shared.enums import UILanguages
+from shared.gazetteer import load_gazetteer
+from shared.geocoding import (GeocodingError, get_place, get_place_id,
+                              get_places, request_geocoding)
+
+LOCALITY = {
+    "place_id": "tashkent",
+    "types": ["locality", "political"],
+    "formatted_address": "Tashkent, Uzbekistan",
+    "geometry": {"location": {"lat": 41.3, "lng": 69.24}},
+    "address_components": [{"long_name": "Tashkent"}],
+}
+
+
+class FakeGeocoding:
+    """
+    A local Geocoding API answering with the queued responses in order,
+    each a (status, body) or a delay in seconds before a slow OK answer
+    """
+
+    def __init__(self):
+        self.responses: list[tuple[int, dict] | float] = []
+        self.requests: list[dict] = []
+        self.running = self.max_running = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests.append(dict(request.query))
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            response = self.responses.pop(0) if self.responses else 0.05
+            if isinstance(response, float):
+                await asyncio.sleep(response)
+                response = (200, {"status": "OK", "results": [LOCALITY]})
+            status, body = response
+            return web.json_response(body, status=status)
+        finally:
+            self.running -= 1
+
+
+@pytest.fixture
+async def fake_geocoding(monkeypatch):
+    fake = FakeGeocoding()
+    app = web.Application()
+    app.router.add_get("/geocode/json", fake.handle)
+    server = TestServer(app)
+    await server.start_server()
+
+    url = str(server.make_url("/geocode/json"))
+    monkeypatch.setattr(settings, "GEOCODING_URL", url)
+    monkeypatch.setattr(settings, "GOOGLE_API_KEY", "key")
+    monkeypatch.setattr(settings, "GEOCODING_TIMEOUT", 0.5)
+    monkeypatch.setattr(settings, "GEOCODING_BACKOFF", 0.01)
+    monkeypatch.setattr(geocoding, "semaphore", asyncio.Semaphore(2))
+    geocoding.results.clear()
+    yield fake
+
+    await geocoding.close_http_session()
+    await server.close()
+
+
+def ok(*results) -> tuple[int, dict]:
+    return 200, {"status": "OK", "results": list(results)}
+
+
+async def test_request_returns_results(fake_geocoding):
+    fake_geocoding.responses = [ok(LOCALITY)]
+
+    assert await request_geocoding({"address": "tashkent"}) == [LOCALITY]
+    assert fake_geocoding.requests == [{"address": "tashkent", "key": "key"}]
+
+
+@pytest.mark.parametrize(
+    "failure",
+    [
+        (500, {}),
+        (429, {}),
+        (200, {"status": "OVER_QUERY_LIMIT"}),
+        (200, {"status": "UNKNOWN_ERROR"}),
+        0.6,  # slower than GEOCODING_TIMEOUT
+    ],
+)
+async def test_transient_failures_are_retried(fake_geocoding, failure):
+    fake_geocoding.responses = [failure, failure, ok(LOCALITY)]
+
+    assert await request_geocoding({"address": "tashkent"}) == [LOCALITY]
+    assert len(fake_geocoding.requests) == 3
+
+
+async def test_gives_up_after_the_retries(fake_geocoding):
+    fake_geocoding.responses = [(500, {})] * (settings.GEOCODING_RETRIES + 2)
+
+    with pytest.raises(GeocodingError):
+        await request_geocoding({"address": "tashkent"})
+    assert len(fake_geocoding.requests) == settings.GEOCODING_RETRIES + 1
+
+
+@pytest.mark.parametrize(
+    "rejection",
+    [(200, {"status": "REQUEST_DENIED"}), (400, {}), (403, {}), (404, {})],
+)
+async def test_rejected_requests_are_not_retried(fake_geocoding, rejection):
+    fake_geocoding.responses = [rejection]
+
+    with pytest.raises(GeocodingError):
+        await request_geocoding({"address": "tashkent"})
+    assert len(fake_geocoding.requests) == 1
+
+
+async def test_concurrent_requests_are_limited(fake_geocoding):
+    results = await asyncio.gather(
+        *(request_geocoding({"address": f"city {i}"}) for i in range(8))
+    )
+
+    assert results == [[LOCALITY]] * 8
+    assert fake_geocoding.max_running == 2
+
+
+async def test_get_place(fake_geocoding):
+    fake_geocoding.responses = [ok(LOCALITY), (200, {"status": "REQUEST_DENIED"})]
+
+    assert await get_place("tashkent", UILanguages.ru) == (41.3, 69.24, "Tashkent")
+    assert fake_geocoding.requests[0]["language"] == "ru"
+    with pytest.raises(ValueError):
+        await get_place("tashkent")
+
+
+async def test_results_are_cached(fake_geocoding, db):
+    fake_geocoding.responses = [ok(LOCALITY, {**LOCALITY, "types": ["country"]})]
+
+    for city_name in ["Tashkent", "  tashkent "]:
+        cities = await get_places(city_name)
+        assert cities == [("Tashkent, Uzbekistan", "tashkent")]
+
+    # the database tier answers once the process forgets the result
+    geocoding.results.clear()
+    assert await get_places("TASHKENT") == cities
+    assert len(fake_geocoding.requests) == 1
+
+
+async def test_nearby_points_share_a_lookup(fake_geocoding, db):
+    fake_geocoding.responses = [ok(LOCALITY)]
+
+    assert await get_place_id(41.3001, 69.2401) == "tashkent"
+    assert await get_place_id(41.3004, 69.2398) == "tashkent"
+    assert len(fake_geocoding.requests) == 1
+
+
+async def test_failed_reverse_lookup_is_not_fatal(fake_geocoding, db):
+    fake_geocoding.responses = [(500, {})] * (settings.GEOCODING_RETRIES + 1)
+
+    assert await get_place_id(41.3, 69.24) is None
+
+
+async def test_gazetteer_misses_fall_back_to_the_api(
+    fake_geocoding, db, tmp_path, monkeypatch
+):
+    path = tmp_path / "localities.csv"
+    path.write_text("place_id,latitude,longitude\nsamarkand,39.65,66.96\n")
+    monkeypatch.setattr(geocoding, "get_gazetteer", lambda: load_gazetteer(path))
+    fake_geocoding.responses = [ok(LOCALITY)]
+
+    assert await get_place_id(39.66, 66.97) == "samarkand"
+    assert not fake_geocoding.requests
+
+    assert await get_place_id(41.3, 69.24) == "tashkent"
+    assert len(fake_geocoding.requests) == 1
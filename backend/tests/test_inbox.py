@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import update
+
+from shared.core.db import session_factory
+from shared.models.chat import Chat
+from shared.queries import get_inbox, mark_chat_read
+
+NOW = datetime.now(timezone.utc)
+
+
+async def inbox(user, before=None, limit: int = 20):
+    async with session_factory() as session:
+        return await get_inbox(session, user.id, before=before, limit=limit)
+
+
+@pytest.fixture
+async def chats(make_user, make_chat, make_message):
+    """
+    Three chats of me, most recently active first: one with messages, one
+    with a message and one without messages active at the same time
+    """
+    me, ann, bob, eve = [await make_user() for _ in range(4)]
+    with_messages = await make_chat(me, ann)
+    await make_message(with_messages, ann, "hi", NOW - timedelta(hours=3))
+    await make_message(with_messages, me, "hello", NOW - timedelta(hours=2, minutes=30))
+    await make_message(with_messages, ann, "how are you", NOW - timedelta(hours=1))
+    empty = await make_chat(me, bob)
+    async with session_factory() as session:
+        query = (
+            update(Chat)
+            .where(Chat.id == empty.id)
+            .values(created_at=NOW - timedelta(hours=2))
+        )
+        await session.execute(query)
+        await session.commit()
+    # the same activity time as the empty chat, the id breaks the tie
+    tied = await make_chat(me, eve)
+    await make_message(tied, eve, "hey", NOW - timedelta(hours=2))
+    # someone else's chat
+    await make_message(await make_chat(ann, bob), bob, "psst")
+    return me, (with_messages, ann), (tied, eve), (empty, bob)
+
+
+async def test_inbox_shows_the_peer_and_last_message(chats):
+    me, *expected = chats
+
+    result = await inbox(me)
+
+    assert [(c.chat.id, c.peer.id) for c in result] == [
+        (chat.id, peer.id) for chat, peer in expected
+    ]
+    (_, ann), _, _ = expected
+    assert result[0].last_message.text == "how are you"
+    assert result[0].last_message.user_id == ann.id
+    assert result[0].last_activity_at == NOW - timedelta(hours=1)
+    assert result[1].last_message.text == "hey"
+    assert result[2].last_message is None
+    assert result[2].last_activity_at == NOW - timedelta(hours=2)
+
+
+async def test_unread_count_without_a_read_cursor(chats):
+    me, (chat, ann), (tied, _), (empty, _) = chats
+
+    result = await inbox(me)
+
+    # the user's own message doesn't count
+    assert [c.unread_count for c in result] == [2, 1, 0]
+    assert result[0].last_read_message_id is None
+
+    async with session_factory() as session:
+        first = result[0].last_message.id - 2
+        await mark_chat_read(session, me.id, chat.id, first)
+    result = await inbox(me)
+    assert result[0].unread_count == 1
+    assert result[0].last_read_message_id == first
+
+    # the peer's cursors, for the receipts of the user's messages
+    async with session_factory() as session:
+        await mark_chat_read(session, ann.id, chat.id, first + 1)
+    result = await inbox(me)
+    assert result[0].peer_last_read_message_id == first + 1
+    assert result[0].peer_last_delivered_message_id == first + 1
+
+
+@pytest.mark.parametrize("limit", [1, 2])
+async def test_pages_follow_activity_and_id(chats, limit):
+    me, *expected = chats
+
+    pages, before = [], None
+    while page := await inbox(me, before=before, limit=limit):
+        pages.append([c.chat.id for c in page])
+        before = (page[-1].last_activity_at, page[-1].chat.id)
+
+    assert sum(pages, []) == [chat.id for chat, _ in expected]
+    assert all(len(page) <= limit for page in pages)
+
+
+async def test_inbox_endpoint(chats, api_client):
+    me, (chat, ann), (tied, _), (empty, _) = chats
+    client = api_client(me)
+
+    response = await client.get("/chats/inbox", params={"limit": 2})
+    assert response.status_code == 200
+    first_page = response.json()
+    assert [c["id"] for c in first_page] == [chat.id, tied.id]
+    assert first_page[0]["peer"]["id"] == str(ann.id)
+    assert first_page[0]["unread_count"] == 2
+    assert first_page[0]["last_message"]["text"] == "how are you"
+
+    last = first_page[-1]
+    params = {"before_activity_at": last["last_activity_at"], "before_id": last["id"]}
+    response = await client.get("/chats/inbox", params=params)
+    assert [c["id"] for c in response.json()] == [empty.id]
+    assert response.json()[0]["last_message"] is None
+
+
+@pytest.mark.parametrize("param", ["before_activity_at", "before_id"])
+async def test_inbox_endpoint_needs_the_whole_cursor(chats, api_client, param):
+    me, *_ = chats
+    params = {"before_activity_at": NOW.isoformat(), "before_id": 1}
+
+    response = await api_client(me).get("/chats/inbox", params={param: params[param]})
+
+    assert response.status_code == 400
@@ -0,0 +1,207 @@
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import delete, insert
+
+from shared.core.db import session_factory
+from shared.enums import Genders, ReactionType, UILanguages
+from shared.models.user import Reaction, User
+from shared.queries import get_last_reacted_match, get_matches
+
+NOW = datetime.now(timezone.utc)
+
+
+async def add_reactions(*reactions: tuple[User, User, ReactionType, datetime]):
+    async with session_factory() as session:
+        for from_user, to_user, reaction_type, updated_at in reactions:
+            session.add(
+                Reaction(
+                    from_user_id=from_user.id,
+                    to_user_id=to_user.id,
+                    reaction_type=reaction_type,
+                    added_rating=0,
+                    updated_at=updated_at,
+                )
+            )
+        await session.commit()
+
+
+async def add_match(user: User, match: User, at: datetime, their_at=None) -> None:
+    await add_reactions(
+        (user, match, ReactionType.like, at),
+        (match, user, ReactionType.like, their_at or at),
+    )
+
+
+def ids(rows) -> list[uuid.UUID]:
+    return [row.User.id for row in rows]
+
+
+def cursor(row) -> tuple[datetime, uuid.UUID]:
+    return row.matched_at, row.User.id
+
+
+@pytest.fixture
+async def matches(make_user, without_decks):
+    """
+    A user with five matches and the matches, latest first. Three of them
+    matched at the same time and follow in descending id order.
+    """
+    me = await make_user()
+    others = [await make_user() for _ in range(5)]
+    latest, *tied, oldest = others
+    tied.sort(key=lambda user: user.id, reverse=True)
+
+    await add_match(me, latest, NOW - timedelta(hours=1))
+    # matched at the later of the two likes
+    for match in tied:
+        await add_match(me, match, NOW - timedelta(hours=3), NOW - timedelta(hours=2))
+    await add_match(me, oldest, NOW - timedelta(hours=4))
+
+    # a one-sided like and a mutual dislike aren't matches
+    stranger, foe = await make_user(), await make_user()
+    await add_reactions(
+        (stranger, me, ReactionType.like, NOW),
+        (me, foe, ReactionType.dislike, NOW),
+        (foe, me, ReactionType.like, NOW),
+    )
+    return me, [latest, *tied, oldest]
+
+
+async def test_matches_are_ordered_by_time_and_id(matches):
+    me, expected = matches
+
+    rows = await get_matches(me)
+
+    assert ids(rows) == [user.id for user in expected]
+    assert [row.matched_at for row in rows] == [
+        NOW - timedelta(hours=hours) for hours in (1, 2, 2, 2, 4)
+    ]
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3])
+async def test_pages_backwards_and_forwards_without_gaps(matches, limit):
+    me, expected = matches
+    expected = [user.id for user in expected]
+
+    pages, before = [], None
+    while page := await get_matches(me, limit=limit, before=before):
+        pages.append(ids(page))
+        before = cursor(page[-1])
+    assert sum(pages, []) == expected
+    assert all(len(page) <= limit for page in pages)
+
+    # forwards from the oldest, oldest first
+    oldest = (await get_matches(me))[-1]
+    pages, after = [], cursor(oldest)
+    while page := await get_matches(me, limit=limit, after=after):
+        pages.append(ids(page))
+        after = cursor(page[-1])
+    assert sum(pages, []) == expected[-2::-1]
+
+
+async def test_inclusive_cursor_returns_the_row_itself(matches):
+    me, expected = matches
+    rows = await get_matches(me)
+
+    # from the middle of the tied matches
+    shown = rows[2]
+    assert ids(await get_matches(me, limit=2, before=cursor(shown))) == [
+        expected[3].id,
+        expected[4].id,
+    ]
+    rows = await get_matches(me, limit=2, before=cursor(shown), inclusive=True)
+    assert ids(rows) == [expected[2].id, expected[3].id]
+
+    # after 👎 the shown match is gone and the next older one takes its place
+    async with session_factory() as session:
+        query = delete(Reaction).where(
+            Reaction.from_user_id == me.id, Reaction.to_user_id == shown.User.id
+        )
+        await session.execute(query)
+        await session.commit()
+    rows = await get_matches(me, limit=1, before=cursor(shown), inclusive=True)
+    assert ids(rows) == [expected[3].id]
+
+
+async def test_last_reacted_match_steps_back_through_ties(make_user, without_decks):
+    me = await make_user()
+    others = [await make_user() for _ in range(4)]
+    for user in others[:3]:
+        await add_reactions((me, user, ReactionType.like, NOW - timedelta(hours=1)))
+    await add_reactions((me, others[3], ReactionType.dislike, NOW))
+    expected = [others[3].id] + sorted((u.id for u in others[:3]), reverse=True)
+
+    stepped, before = [], None
+    while row := await get_last_reacted_match(me, before=before):
+        stepped.append(row.User.id)
+        before = (row.reacted_at, row.User.id)
+
+    assert stepped == expected
+
+
+async def add_many_matches(user: User, count: int) -> None:
+    """Bulk insert count matches of the user, a second apart"""
+    users = [
+        {
+            "id": uuid.uuid4(),
+            "telegram_id": 10**6 + i,
+            "name": "Test",
+            "birth_date": datetime(2000, 1, 1),
+            "gender": Genders.female,
+            "latitude": 41.3,
+            "longitude": 69.24,
+            "ui_language": UILanguages.en,
+        }
+        for i in range(count)
+    ]
+    reactions = []
+    for i, match in enumerate(users):
+        at = NOW - timedelta(seconds=i)
+        for pair in [(user.id, match["id"]), (match["id"], user.id)]:
+            reactions.append(
+                {
+                    "from_user_id": pair[0],
+                    "to_user_id": pair[1],
+                    "reaction_type": ReactionType.like,
+                    "added_rating": 0,
+                    "updated_at": at,
+                }
+            )
+    async with session_factory() as session:
+        await session.execute(insert(User), users)
+        await session.execute(insert(Reaction), reactions)
+        await session.commit()
+
+
+async def page_latency(call, repeat: int = 15) -> float:
+    """Median seconds of a call"""
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        await call()
+        timings.append(time.perf_counter() - started_at)
+    return statistics.median(timings)
+
+
+async def test_deep_pages_cost_the_same_as_the_first(make_user, without_decks):
+    me = await make_user()
+    count = 3000
+    await add_many_matches(me, count)
+    rows = await get_matches(me)
+    assert len(rows) == count
+
+    latencies = {}
+    for depth in (0, count // 2, count - 10):
+        before = cursor(rows[depth - 1]) if depth else None
+        latencies[depth] = await page_latency(
+            lambda: get_matches(me, limit=2, before=before)
+        )
+    print(", ".join(f"page at {d}: {t * 1000:.2f} ms" for d, t in latencies.items()))
+
+    # no offset to skip, a page deep down reads as much as the first one
+    first = latencies[0]
+    assert all(t <= 2 * first + 0.005 for t in latencies.values())
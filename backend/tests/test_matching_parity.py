@@ -0,0 +1,77 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from shared.core.config import settings
+from shared.core.db import session_factory
+from shared.enums import Genders, PreferredGenders, ScoringModes
+from shared.matching.algorithm import (get_potential_matches_query,
+                                       get_total_score_expression,
+                                       rank_candidates, score_candidates)
+from shared.models.user import User
+
+# Postgres rounds ties half away from zero while Python rounds the binary
+# float, so a score lying on a rounding tie may differ in its last digit
+TOLERANCE = 0.001 + 1e-9
+
+
+@pytest.fixture
+async def population(make_user):
+    """A user in Tashkent and 300 candidates up to ~80 km around them"""
+    rng = random.Random(1)
+    current_user = await make_user(
+        gender=Genders.male, birth_date=datetime(1995, 6, 15)
+    )
+    for _ in range(300):
+        await make_user(
+            latitude=41.3 + rng.uniform(-0.7, 0.7),
+            longitude=69.24 + rng.uniform(-0.7, 0.7),
+            birth_date=datetime(1980, 1, 1) + timedelta(days=rng.randint(0, 9000)),
+            rating=rng.randint(600, 2400),
+            gender=rng.choice(list(Genders)),
+            preferred_gender=rng.choice(list(PreferredGenders)),
+        )
+    return current_user
+
+
+@pytest.mark.parametrize("min_age, max_age", [(None, None), (20, 35)])
+async def test_sql_scores_match_python_scores(population, min_age, max_age):
+    current_user = population
+    preferences = current_user.preferences
+    preferences.min_age, preferences.max_age = min_age, max_age
+
+    query = get_potential_matches_query(current_user)
+    async with session_factory() as session:
+        candidates = (await session.scalars(query)).all()
+        score = get_total_score_expression(current_user, preferences)
+        res = await session.execute(query.with_only_columns(User.id, score))
+        sql_scores = {id: float(score) for id, score in res.all()}
+
+    assert len(candidates) > 50
+    python_scores = score_candidates(current_user, preferences, candidates)
+    for candidate, python_score in zip(candidates, python_scores):
+        assert sql_scores[candidate.id] == pytest.approx(python_score, abs=TOLERANCE)
+
+
+@pytest.mark.parametrize("mode", [ScoringModes.database, ScoringModes.numpy])
+async def test_ranking_matches_python_ranking(population, monkeypatch, mode):
+    current_user = population
+    preferences = current_user.preferences
+    query = get_potential_matches_query(current_user)
+
+    async def rank(scoring_mode: ScoringModes) -> list[User]:
+        monkeypatch.setattr(settings, "SCORING_MODE", scoring_mode)
+        async with session_factory() as session:
+            return await rank_candidates(
+                session, query, current_user, preferences, limit=20
+            )
+
+    expected = await rank(ScoringModes.python)
+    ranked = await rank(mode)
+
+    # candidates tied on their score may come in any order
+    expected_scores = score_candidates(current_user, preferences, expected)
+    ranked_scores = score_candidates(current_user, preferences, ranked)
+    assert len(ranked) == len(expected) == 20
+    assert ranked_scores == pytest.approx(expected_scores, abs=TOLERANCE)
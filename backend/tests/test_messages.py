@@ -0,0 +1,153 @@
+import asyncio
+import json
+
+import pytest
+
+from api import websocket
+from api.backplane import Backplane
+from api.websocket import ConnectionManager, sync_messages
+from shared.core.db import session_factory
+from shared.queries import get_chat_messages
+from shared.validators import Params
+
+
+async def messages(**kwargs) -> list[int]:
+    async with session_factory() as session:
+        return [message.id for message in await get_chat_messages(session, **kwargs)]
+
+
+@pytest.fixture
+async def chats(make_user, make_chat, make_message):
+    """
+    Two chats of me with interleaved messages, and a chat of others.
+    Returns the users, the chats and the message ids of each chat.
+    """
+    me, ann, bob = [await make_user() for _ in range(3)]
+    with_ann, with_bob, others = [
+        await make_chat(me, ann),
+        await make_chat(me, bob),
+        await make_chat(ann, bob),
+    ]
+    ids = {with_ann.id: [], with_bob.id: [], others.id: []}
+    for n in range(7):
+        for chat, user in [(with_ann, ann), (with_bob, me), (others, bob)]:
+            ids[chat.id].append((await make_message(chat, user, f"{n}")).id)
+    return (me, ann), (with_ann, with_bob, others), ids
+
+
+async def test_pages_backwards_without_gaps(chats):
+    _, (chat, _, _), ids = chats
+
+    assert await messages(chat_id=chat.id, limit=3) == ids[chat.id][-3:]
+
+    pages, before_id = [], None
+    while page := await messages(chat_id=chat.id, before_id=before_id, limit=3):
+        pages.insert(0, page)
+        before_id = page[0]
+
+    assert sum(pages, []) == ids[chat.id]
+    assert [len(page) for page in pages] == [1, 3, 3]
+
+
+async def test_pages_forwards_without_gaps(chats):
+    _, (chat, _, _), ids = chats
+
+    pages, after_id = [], 0
+    while page := await messages(chat_id=chat.id, after_id=after_id, limit=3):
+        pages.append(page)
+        after_id = page[-1]
+
+    assert sum(pages, []) == ids[chat.id]
+    assert [len(page) for page in pages] == [3, 3, 1]
+
+
+async def test_messages_of_every_chat_of_a_user(chats):
+    (me, _), (with_ann, with_bob, _), ids = chats
+    mine = sorted(ids[with_ann.id] + ids[with_bob.id])
+
+    assert await messages(user_id=me.id, after_id=0, limit=100) == mine
+    assert await messages(user_id=me.id, after_id=mine[5], limit=4) == mine[6:10]
+
+
+async def test_messages_endpoint(chats, api_client):
+    (me, _), (chat, _, others), ids = chats
+    client = api_client(me)
+
+    response = await client.get(
+        f"/chats/{chat.id}/messages", params={"before_id": ids[chat.id][-1], "limit": 2}
+    )
+    assert [m["id"] for m in response.json()] == ids[chat.id][-3:-1]
+
+    response = await client.get(
+        f"/chats/{chat.id}/messages", params={"limit": Params.messages_page_max_size}
+    )
+    assert response.status_code == 200
+    response = await client.get(
+        f"/chats/{chat.id}/messages",
+        params={"limit": Params.messages_page_max_size + 1},
+    )
+    assert response.status_code == 422
+
+    response = await client.get(f"/chats/{others.id}/messages")
+    assert response.status_code == 403
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.received: list[dict] = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        self.received.append(json.loads(message))
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+@pytest.fixture
+async def connected(chats, monkeypatch):
+    """My websocket on a manager of a single worker"""
+    (me, _), _, _ = chats
+    manager = ConnectionManager(Backplane())
+    monkeypatch.setattr(websocket, "manager", manager)
+    ws = FakeWebSocket()
+    await manager.connect(str(me.id), ws)
+    yield ws
+
+    await manager.disconnect(str(me.id), ws)
+
+
+async def sync(user, ws: FakeWebSocket, payload: dict) -> dict:
+    await sync_messages(user.id, ws, payload)
+    async with asyncio.timeout(5):
+        while not ws.received:
+            await asyncio.sleep(0.01)
+    return ws.received.pop(0)["payload"]
+
+
+async def test_sync_pages_with_has_more(chats, connected, monkeypatch):
+    (me, _), (chat, _, _), ids = chats
+    monkeypatch.setattr(Params, "messages_page_max_size", 4)
+
+    payload = await sync(me, connected, {"chat_id": chat.id})
+    assert [m["id"] for m in payload["messages"]] == ids[chat.id][:4]
+    assert payload["has_more"]
+
+    after_id = payload["messages"][-1]["id"]
+    payload = await sync(me, connected, {"chat_id": chat.id, "after_id": after_id})
+    assert [m["id"] for m in payload["messages"]] == ids[chat.id][4:]
+    assert not payload["has_more"]
+
+
+async def test_sync_skips_chats_of_others(chats, connected):
+    (me, _), (with_ann, with_bob, others), ids = chats
+
+    payload = await sync(me, connected, {"chat_id": others.id})
+    assert payload == {"chat_id": others.id, "messages": [], "has_more": False}
+
+    payload = await sync(me, connected, {})
+    assert [m["id"] for m in payload["messages"]] == sorted(
+        ids[with_ann.id] + ids[with_bob.id]
+    )
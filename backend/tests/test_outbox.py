@@ -0,0 +1,266 @@
+import asyncio
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+import pytest
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from sqlalchemy import select
+
+from bot import outbox
+from bot import utils as bot_utils
+from bot.outbox import TokenBucket, dispatch_batch
+from shared.core.config import settings
+from shared.core.db import session_factory
+from shared.models.outbox import OutboxMessage
+from shared.outbox import enqueue_message
+
+RATE = 20
+CHAT_RATE = 5
+# arrival times jitter around the paced send times, the first request also
+# opens the connection
+JITTER = 0.04
+
+
+class FakeTelegram:
+    """
+    A local Bot API enforcing the global and per chat rate limits with 429s,
+    like Telegram does. Errors queued for a chat are answered first.
+    """
+
+    def __init__(self):
+        self.sent: list[tuple[int, str]] = []
+        # when each chat's requests arrived, and when the accepted ones did
+        self.requests: dict[int, list[float]] = defaultdict(list)
+        self.accepted: dict[int, list[float]] = defaultdict(list)
+        self.errors: dict[int, list[tuple[int, dict]]] = defaultdict(list)
+        self.rejected = 0
+        self.limited = True
+        self.connections: set[tuple[str, int]] = set()
+
+    def is_limited(self, chat_id: int, now: float) -> bool:
+        accepted = self.accepted[chat_id]
+        if accepted and now - accepted[-1] < 1 / CHAT_RATE - JITTER:
+            return True
+        # evenly paced messages fit RATE + 1 into a second, counting both ends
+        times = [t for chat in self.accepted.values() for t in chat]
+        return len([t for t in times if now - t < 1]) > RATE
+
+    async def send_message(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        chat_id = int(data["chat_id"])
+        now = time.monotonic()
+        self.requests[chat_id].append(now)
+        self.connections.add(request.transport.get_extra_info("peername"))
+
+        if self.errors[chat_id]:
+            status, body = self.errors[chat_id].pop(0)
+            return web.json_response(body, status=status)
+
+        if self.limited and self.is_limited(chat_id, now):
+            self.rejected += 1
+            status, body = retry_after(1)
+            return web.json_response(body, status=status)
+
+        self.accepted[chat_id].append(now)
+        self.sent.append((chat_id, data["text"]))
+        message = {
+            "message_id": len(self.sent),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": data["text"],
+        }
+        return web.json_response({"ok": True, "result": message})
+
+
+def error(status: int, description: str) -> tuple[int, dict]:
+    return status, {"ok": False, "error_code": status, "description": description}
+
+
+def retry_after(seconds: int) -> tuple[int, dict]:
+    status, body = error(429, f"Too Many Requests: retry after {seconds}")
+    return status, {**body, "parameters": {"retry_after": seconds}}
+
+
+@pytest.fixture
+async def fake_telegram(monkeypatch, db):
+    fake = FakeTelegram()
+    app = web.Application()
+    app.router.add_post("/bot{token}/sendMessage", fake.send_message)
+    server = TestServer(app)
+    await server.start_server()
+
+    monkeypatch.setattr(settings, "BOT_API_URL", f"http://{server.host}:{server.port}")
+    monkeypatch.setattr(settings, "OUTBOX_RATE", RATE)
+    monkeypatch.setattr(settings, "OUTBOX_CHAT_RATE", CHAT_RATE)
+    monkeypatch.setattr(bot_utils, "bot", None)
+    monkeypatch.setattr(outbox, "global_bucket", TokenBucket(RATE))
+    outbox.chat_buckets.clear()
+    yield fake
+
+    await bot_utils.close_bot()
+    await server.close()
+
+
+async def queued() -> list[OutboxMessage]:
+    async with session_factory() as session:
+        query = select(OutboxMessage).order_by(OutboxMessage.id)
+        return list((await session.scalars(query)).all())
+
+
+async def dispatch_all(timeout: float = 10) -> None:
+    async with asyncio.timeout(timeout):
+        while await queued():
+            if not await dispatch_batch():
+                await asyncio.sleep(0.05)
+
+
+async def test_delivers_everything_within_rate_limits(fake_telegram):
+    # two busy chats hit the per chat limit, the rest the global one
+    expected = [(chat_id, f"message {n}") for chat_id in (1, 2) for n in range(6)]
+    expected += [(chat_id, "message 0") for chat_id in range(3, 15)]
+    for chat_id, text in expected:
+        await enqueue_message(chat_id, text)
+
+    await dispatch_all()
+
+    assert fake_telegram.rejected == 0
+    assert sorted(fake_telegram.sent) == sorted(expected)
+
+
+async def test_retry_after_pauses_the_chat(fake_telegram):
+    fake_telegram.errors[1] = [retry_after(1)]
+    await enqueue_message(1, "first")
+    await enqueue_message(1, "second")
+    await enqueue_message(2, "other chat")
+
+    await dispatch_batch()
+
+    # the rejected message is rescheduled, the rest of the chat waits its turn
+    assert [m.payload["text"] for m in await queued()] == ["first", "second"]
+    assert fake_telegram.sent == [(2, "other chat")]
+
+    # both are due when the pause ends, a retried message may lose its place
+    await dispatch_all()
+    assert sorted(fake_telegram.sent[1:]) == [(1, "first"), (1, "second")]
+    rejected_at, resumed_at = fake_telegram.requests[1][:2]
+    assert resumed_at - rejected_at >= 1 - JITTER
+
+
+async def test_waiting_chats_do_not_hold_up_the_batch(fake_telegram):
+    fake_telegram.errors[1] = [retry_after(5)]
+    await enqueue_message(1, "paused")
+    await dispatch_batch()
+
+    for n in range(3):
+        await enqueue_message(1, f"busy {n}")
+    await enqueue_message(2, "other chat")
+    started_at = time.monotonic()
+    assert await dispatch_batch() == 4
+
+    assert time.monotonic() - started_at < 1
+    assert fake_telegram.sent == [(2, "other chat")]
+    # the chat's messages wait for the pause in the queue, one turn apart,
+    # and waiting isn't counted as an attempt
+    paused, *busy = await queued()
+    assert [m.attempts for m in busy] == [0, 0, 0]
+    assert busy[0].next_attempt_at > paused.next_attempt_at - timedelta(seconds=1)
+    assert busy[0].next_attempt_at < busy[1].next_attempt_at < busy[2].next_attempt_at
+
+
+async def test_batch_is_sent_within_the_lease(fake_telegram, monkeypatch):
+    monkeypatch.setattr(settings, "OUTBOX_LEASE", 1)
+    for chat_id in range(1, 16):
+        await enqueue_message(chat_id, "hi")
+
+    assert await dispatch_batch() == RATE // 2
+
+
+async def test_dedup_key_coalesces_queued_messages(fake_telegram):
+    for _ in range(3):
+        await enqueue_message(1, "You have new likes", dedup_key="likes:1")
+    await enqueue_message(2, "You have new likes", dedup_key="likes:2")
+    assert len(await queued()) == 2
+
+    await dispatch_all()
+    assert sorted(fake_telegram.sent) == [
+        (1, "You have new likes"),
+        (2, "You have new likes"),
+    ]
+
+    # once sent, the key is free again
+    await enqueue_message(1, "You have new likes", dedup_key="likes:1")
+    assert len(await queued()) == 1
+
+
+async def test_failed_messages_do_not_fail_the_batch(fake_telegram):
+    fake_telegram.errors[1] = [error(400, "Bad Request: chat not found")]
+    fake_telegram.errors[2] = [error(500, "Internal Server Error")]
+    await enqueue_message(1, "dropped")
+    await enqueue_message(2, "retried")
+    await enqueue_message(3, "sent")
+    async with session_factory() as session:
+        payload = {"text": "broken", "reply_markup": {"inline_keyboard": "x"}}
+        session.add(OutboxMessage(chat_id=4, payload=payload))
+        await session.commit()
+
+    assert await dispatch_batch() == 4
+
+    assert fake_telegram.sent == [(3, "sent")]
+    assert [(m.chat_id, m.attempts) for m in await queued()] == [(2, 1), (4, 1)]
+
+
+async def test_gives_up_after_max_attempts(fake_telegram, monkeypatch):
+    monkeypatch.setattr(settings, "OUTBOX_MAX_ATTEMPTS", 1)
+    fake_telegram.errors[1] = [error(500, "Internal Server Error")]
+    await enqueue_message(1, "lost")
+
+    await dispatch_batch()
+
+    assert await queued() == []
+    assert fake_telegram.sent == []
+
+
+async def send_with_a_bot_per_message(chat_id: int, text: str) -> None:
+    """bot.utils.send_message as it was before the bot was shared"""
+    api = TelegramAPIServer.from_base(settings.BOT_API_URL)
+    bot = Bot(token=settings.BOT_TOKEN, session=AiohttpSession(api=api))
+    try:
+        await bot.send_message(chat_id, text)
+    finally:
+        await bot.session.close()
+
+
+@pytest.mark.benchmark
+async def test_notification_throughput(fake_telegram):
+    fake_telegram.limited = False
+    count, concurrency = 500, 50
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def measure(send) -> tuple[float, int]:
+        fake_telegram.connections.clear()
+
+        async def notify(n: int):
+            async with semaphore:
+                await send(n, f"message {n}")
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(notify(n) for n in range(count)))
+        rate = count / (time.perf_counter() - started_at)
+        return rate, len(fake_telegram.connections)
+
+    before, before_connections = await measure(send_with_a_bot_per_message)
+    after, after_connections = await measure(bot_utils.send_message)
+    print(
+        f"\n{count} notifications, {concurrency} at a time:"
+        f" bot per message {before:.0f}/s over {before_connections} connections,"
+        f" shared bot {after:.0f}/s over {after_connections} connections"
+    )
+
+    assert len(fake_telegram.sent) == 2 * count
+    assert after_connections <= settings.BOT_CONNECTION_LIMIT
+    assert after > 5 * before
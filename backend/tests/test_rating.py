@@ -0,0 +1,65 @@
+import asyncio
+
+from sqlalchemy import select
+
+from shared.core.config import settings
+from shared.core.db import session_factory
+from shared.enums import ReactionType
+from shared.matching.rating import get_rating_change
+from shared.models.user import Reaction, User
+from shared.queries import create_or_update_reaction
+
+
+async def get_rating(user: User) -> int:
+    async with session_factory() as session:
+        return await session.scalar(select(User.rating).where(User.id == user.id))
+
+
+async def test_concurrent_likes_match_sequential_replay(make_user, without_decks):
+    popular = await make_user()
+    swipers = [await make_user() for _ in range(200)]
+    # the stale instance every handler would have loaded
+    popular.rating = settings.DEFAULT_RATING
+
+    await asyncio.gather(
+        *(
+            create_or_update_reaction(swiper, popular, ReactionType.like)
+            for swiper in swipers
+        )
+    )
+
+    # swipers share one rating, so any order of likes gives the same changes
+    rating, changes = settings.DEFAULT_RATING, []
+    for _ in swipers:
+        changes.append(
+            get_rating_change(rating, settings.DEFAULT_RATING, ReactionType.like)
+        )
+        rating += changes[-1]
+
+    async with session_factory() as session:
+        query = select(Reaction.added_rating).where(Reaction.to_user_id == popular.id)
+        added_ratings = (await session.scalars(query)).all()
+    assert await get_rating(popular) == rating
+    assert sorted(added_ratings) == sorted(changes)
+
+
+async def test_concurrent_flips_keep_rating_consistent(make_user, without_decks):
+    popular = await make_user()
+    swipers = [await make_user() for _ in range(100)]
+    for swiper in swipers:
+        await create_or_update_reaction(swiper, popular, ReactionType.like)
+
+    await asyncio.gather(
+        *(
+            create_or_update_reaction(swiper, popular, reaction_type)
+            for swiper in swipers
+            for reaction_type in (ReactionType.dislike, ReactionType.like)
+        )
+    )
+
+    # no change got lost: the rating is the sum of the stored changes
+    async with session_factory() as session:
+        query = select(Reaction.added_rating).where(Reaction.to_user_id == popular.id)
+        added_ratings = (await session.scalars(query)).all()
+    assert len(added_ratings) == len(swipers)
+    assert await get_rating(popular) == settings.DEFAULT_RATING + sum(added_ratings)
@@ -0,0 +1,47 @@
+import asyncio
+
+from sqlalchemy import select
+
+from shared.core.db import session_factory
+from shared.enums import ReactionType
+from shared.models.user import Reaction
+from shared.queries import create_or_update_reaction
+
+
+async def test_concurrent_mutual_likes_match_once(make_user, without_decks):
+    pairs = [(await make_user(), await make_user()) for _ in range(50)]
+
+    results = await asyncio.gather(
+        *(
+            create_or_update_reaction(user, match, ReactionType.like)
+            for pair in pairs
+            for user, match in (pair, pair[::-1])
+        )
+    )
+
+    # every like notifies once, the second like of a pair as the match
+    for first, second in zip(results[::2], results[1::2]):
+        assert first.is_created and second.is_created
+        assert first.should_notify and second.should_notify
+        assert sorted([first.is_mutual, second.is_mutual]) == [False, True]
+
+
+async def test_repeated_likes_do_not_notify_again(make_user, without_decks):
+    user, match = await make_user(), await make_user()
+    await create_or_update_reaction(user, match, ReactionType.like)
+    await create_or_update_reaction(match, user, ReactionType.like)
+
+    results = await asyncio.gather(
+        create_or_update_reaction(user, match, ReactionType.like),
+        create_or_update_reaction(match, user, ReactionType.like),
+    )
+    # a like taken back and given again was notified already
+    await create_or_update_reaction(user, match, ReactionType.dislike)
+    result = await create_or_update_reaction(user, match, ReactionType.like)
+
+    assert all(r.is_mutual and not r.is_changed for r in results)
+    assert result.is_mutual and result.is_changed
+    assert not any(r.should_notify for r in [*results, result])
+    async with session_factory() as session:
+        query = select(Reaction.is_match_notified)
+        assert (await session.scalars(query)).all() == [True, True]
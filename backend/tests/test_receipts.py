@@ -0,0 +1,146 @@
+import asyncio
+import random
+
+import pytest
+
+from api import receipts
+from api.receipts import AckBuffer
+from shared.core.db import session_factory
+from shared.queries import Receipt, mark_chat_read, update_receipts
+
+
+async def update(*acks) -> list[Receipt]:
+    async with session_factory() as session:
+        return await update_receipts(session, list(acks))
+
+
+async def mark_read(user, chat, message_id: int) -> Receipt | None:
+    async with session_factory() as session:
+        return await mark_chat_read(session, user.id, chat.id, message_id)
+
+
+@pytest.fixture
+async def conversation(make_user, make_chat, make_message):
+    """A chat of alice and bob with five messages of bob and their ids"""
+    alice, bob = await make_user(), await make_user()
+    chat = await make_chat(alice, bob)
+    ids = [(await make_message(chat, bob)).id for _ in range(5)]
+    return chat, alice, bob, ids
+
+
+async def test_cursors_only_move_forward(conversation):
+    chat, alice, _, ids = conversation
+
+    assert await update((chat.id, alice.id, ids[3], ids[1])) == [
+        Receipt(chat.id, alice.id, ids[3], ids[1])
+    ]
+    assert await update((chat.id, alice.id, ids[0], ids[0])) == [
+        Receipt(chat.id, alice.id, ids[3], ids[1])
+    ]
+    assert await mark_read(alice, chat, ids[0]) == Receipt(
+        chat.id, alice.id, ids[3], ids[1]
+    )
+
+    # reading a message delivers it
+    assert await update((chat.id, alice.id, 0, ids[4])) == [
+        Receipt(chat.id, alice.id, ids[4], ids[4])
+    ]
+
+
+async def test_mark_chat_read_moves_both_cursors(conversation):
+    chat, alice, _, ids = conversation
+
+    assert await mark_read(alice, chat, ids[2]) == Receipt(
+        chat.id, alice.id, ids[2], ids[2]
+    )
+    assert await update((chat.id, alice.id, ids[3], 0)) == [
+        Receipt(chat.id, alice.id, ids[3], ids[2])
+    ]
+
+
+async def test_cursors_are_capped_at_the_last_message(
+    conversation, make_user, make_chat, make_message
+):
+    chat, alice, bob, ids = conversation
+    last_id = ids[-1]
+    # a later message of another chat doesn't lift the cap
+    other_chat = await make_chat(alice, await make_user())
+    await make_message(other_chat, alice)
+
+    assert await update((chat.id, alice.id, last_id + 10, last_id + 10)) == [
+        Receipt(chat.id, alice.id, last_id, last_id)
+    ]
+    assert await mark_read(bob, chat, last_id + 10) == Receipt(
+        chat.id, bob.id, last_id, last_id
+    )
+
+    empty_chat = await make_chat(alice, bob)
+    assert await mark_read(alice, empty_chat, 10) == Receipt(
+        empty_chat.id, alice.id, 0, 0
+    )
+
+
+async def test_acks_of_non_members_are_ignored(conversation, make_user):
+    chat, alice, _, ids = conversation
+    outsider = await make_user()
+
+    receipts = await update(
+        (chat.id, outsider.id, ids[2], ids[2]), (chat.id, alice.id, ids[2], 0)
+    )
+
+    assert receipts == [Receipt(chat.id, alice.id, ids[2], 0)]
+    assert await mark_read(outsider, chat, ids[2]) is None
+
+
+async def test_buffered_acks_are_coalesced(conversation):
+    chat, alice, bob, ids = conversation
+    buffer = AckBuffer()
+    for message_id in ids:
+        buffer.ack(chat.id, alice.id, delivered_id=message_id)
+    buffer.ack(chat.id, alice.id, read_id=ids[1])
+    buffer.ack(chat.id, bob.id, read_id=ids[2])
+    buffer.ack(chat.id, bob.id, read_id=ids[0])
+
+    sent = []
+
+    async def send(receipts: list[Receipt]) -> None:
+        sent.extend(receipts)
+
+    assert await buffer.flush(send) == 2
+    assert sorted(sent, key=lambda r: r.user_id == bob.id) == [
+        Receipt(chat.id, alice.id, ids[4], ids[1]),
+        Receipt(chat.id, bob.id, ids[2], ids[2]),
+    ]
+    assert await buffer.flush(send) == 0
+
+
+async def test_failed_flush_keeps_the_acks(conversation, monkeypatch):
+    chat, alice, _, ids = conversation
+    buffer = AckBuffer()
+    buffer.ack(chat.id, alice.id, delivered_id=ids[2])
+
+    async def failing_update_receipts(session, acks):
+        raise ConnectionRefusedError
+
+    monkeypatch.setattr(receipts, "update_receipts", failing_update_receipts)
+    with pytest.raises(ConnectionRefusedError):
+        await buffer.flush(lambda receipts: asyncio.sleep(0))
+
+    # merged with the acks that came in meanwhile
+    buffer.ack(chat.id, alice.id, read_id=ids[1])
+    assert buffer.pending == {(chat.id, alice.id): [ids[2], ids[1]]}
+
+
+async def test_concurrent_flushes_do_not_deadlock(make_user, make_chat, make_message):
+    acks = []
+    for _ in range(20):
+        alice, bob = await make_user(), await make_user()
+        chat = await make_chat(alice, bob)
+        message = await make_message(chat, alice)
+        acks += [(chat.id, alice.id, message.id, 0), (chat.id, bob.id, 0, message.id)]
+
+    # every flush touches every row, in orders of its own
+    batches = [random.sample(acks, len(acks)) for _ in range(10)]
+    results = await asyncio.gather(*(update(*batch) for batch in batches))
+
+    assert all(len(receipts) == len(acks) for receipts in results)
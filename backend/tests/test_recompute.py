@@ -0,0 +1,147 @@
+import logging
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select, update
+
+from shared.core.config import settings
+from shared.core.db import session_factory
+from shared.enums import ReactionType
+from shared.matching import recompute
+from shared.matching.rating import get_rating_change
+from shared.matching.recompute import recompute_ratings
+from shared.models.user import Reaction, User
+from shared.queries import create_or_update_reaction
+
+NOW = datetime.now(timezone.utc)
+
+
+async def snapshot() -> tuple[dict, dict]:
+    """Users' (rating, updated_at) and reactions' (added_rating, updated_at)"""
+    async with session_factory() as session:
+        users = await session.execute(select(User.id, User.rating, User.updated_at))
+        reactions = await session.execute(
+            select(Reaction.id, Reaction.added_rating, Reaction.updated_at)
+        )
+        return (
+            {id: (rating, at) for id, rating, at in users},
+            {id: (added_rating, at) for id, added_rating, at in reactions},
+        )
+
+
+@pytest.fixture
+async def reactions(make_user):
+    """
+    Reactions of four users with stale added_rating and live ratings, inserted
+    out of their updated_at order. Returns the users and the expected ratings
+    and added_rating of each reaction id.
+    """
+    users = [await make_user() for _ in range(4)]
+    a, b, c, d = users
+    # (from, to, type, minutes ago), inserted in this order
+    swipes = [
+        (c, a, ReactionType.like, 10),
+        (a, b, ReactionType.like, 50),
+        (b, a, ReactionType.dislike, 40),
+        (d, a, ReactionType.like, 30),
+        (a, c, ReactionType.dislike, 20),
+        (d, b, ReactionType.like, 5),
+    ]
+    async with session_factory() as session:
+        rows = [
+            Reaction(
+                from_user_id=from_user.id,
+                to_user_id=to_user.id,
+                reaction_type=reaction_type,
+                added_rating=99,
+                updated_at=NOW - timedelta(minutes=minutes),
+            )
+            for from_user, to_user, reaction_type, minutes in swipes
+        ]
+        session.add_all(rows)
+        await session.execute(update(User).values(rating=1234))
+        await session.commit()
+
+    ratings = {user.id: settings.DEFAULT_RATING for user in users}
+    added_ratings = {}
+    for reaction in sorted(rows, key=lambda r: r.updated_at):
+        change = get_rating_change(
+            ratings[reaction.to_user_id],
+            ratings[reaction.from_user_id],
+            reaction.reaction_type,
+        )
+        ratings[reaction.to_user_id] += change
+        added_ratings[reaction.id] = change
+    return users, ratings, added_ratings
+
+
+async def test_ratings_are_replayed_in_updated_at_order(reactions):
+    users, ratings, added_ratings = reactions
+    users_before, reactions_before = await snapshot()
+
+    drifts = await recompute_ratings()
+
+    users_after, reactions_after = await snapshot()
+    assert {id: rating for id, (rating, _) in users_after.items()} == ratings
+    assert {id: added for id, (added, _) in reactions_after.items()} == added_ratings
+    # the replay order and the keyset pages stay as they were
+    assert {id: at for id, (_, at) in users_after.items()} == {
+        id: at for id, (_, at) in users_before.items()
+    }
+    assert {id: at for id, (_, at) in reactions_after.items()} == {
+        id: at for id, (_, at) in reactions_before.items()
+    }
+    assert drifts == {id: rating - 1234 for id, rating in ratings.items()}
+
+    # a second run finds nothing to fix
+    assert await recompute_ratings() == {}
+
+
+async def test_batches_are_bounded(reactions, monkeypatch):
+    users, ratings, added_ratings = reactions
+    write_batch = recompute.write_batch
+    writes: list[tuple[str, int]] = []
+
+    async def recorded_write_batch(model, column, values, dry_run):
+        writes.append((column, len(values)))
+        await write_batch(model, column, values, dry_run)
+
+    monkeypatch.setattr(recompute, "write_batch", recorded_write_batch)
+    await recompute_ratings(batch_size=2)
+
+    # a write for every partition of the stream, then the users in batches
+    assert writes == [("added_rating", 2)] * 3 + [("rating", 2)] * 2
+    users_after, reactions_after = await snapshot()
+    assert {id: rating for id, (rating, _) in users_after.items()} == ratings
+    assert {id: added for id, (added, _) in reactions_after.items()} == added_ratings
+
+
+async def test_dry_run_reports_the_drift_only(reactions, caplog):
+    users, ratings, _ = reactions
+    before = await snapshot()
+
+    with caplog.at_level(logging.INFO, logger=recompute.__name__):
+        drifts = await recompute_ratings(dry_run=True)
+
+    assert await snapshot() == before
+    assert drifts == {id: rating - 1234 for id, rating in ratings.items()}
+    biggest = max(drifts.values(), key=abs)
+    assert "Users: 4 total, 4 with a drifted rating" in caplog.text
+    assert f"Drift: max {biggest}," in caplog.text
+    assert "Dry run, nothing was written" in caplog.text
+
+
+async def test_live_reactions_leave_no_drift(make_user, without_decks):
+    users = [await make_user() for _ in range(5)]
+    for user in users:
+        for match in users:
+            if user != match:
+                if (user.telegram_id + match.telegram_id) % 3:
+                    reaction_type = ReactionType.like
+                else:
+                    reaction_type = ReactionType.dislike
+                await create_or_update_reaction(user, match, reaction_type)
+    before = await snapshot()
+
+    assert await recompute_ratings() == {}
+    assert await snapshot() == before
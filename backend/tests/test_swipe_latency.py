@@ -0,0 +1,78 @@
+import random
+import statistics
+import time
+
+import pytest
+
+from shared.core.config import settings
+from shared.core.db import session_factory
+from shared.enums import ScoringModes
+from shared.matching.algorithm import (calculate_total_score, get_best_matches,
+                                       get_potential_matches_query)
+from shared.models.user import User
+
+POOL_SIZES = [100, 1000, 10_000]
+
+
+async def swipe_with_a_session_per_candidate(current_user: User) -> User | None:
+    """
+    get_best_match as it was before scoring took the preferences once, every
+    candidate checked out a session to await them
+    """
+    async with session_factory() as session:
+        session.add(current_user)
+        await current_user.awaitable_attrs.preferences
+        query = get_potential_matches_query(current_user)
+        candidates = (await session.scalars(query)).all()
+
+    scored = []
+    for candidate in candidates:
+        async with session_factory() as session:
+            session.add(current_user)
+            preferences = await current_user.awaitable_attrs.preferences
+        score = calculate_total_score(current_user, preferences, candidate)
+        scored.append((score, candidate))
+    return max(scored, key=lambda x: x[0])[1] if scored else None
+
+
+async def median_seconds(call, repeat: int = 5) -> float:
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        await call()
+        timings.append(time.perf_counter() - started_at)
+    return statistics.median(timings)
+
+
+@pytest.mark.benchmark
+async def test_swipe_latency_against_pool_size(make_user, make_users, monkeypatch):
+    # the whole pool is scored, no radius narrows it
+    monkeypatch.setattr(settings, "MATCH_SEARCH_RADII", [])
+    rng = random.Random(2)
+    me = await make_user()
+    pool = 0
+    print()
+    for size in POOL_SIZES:
+        await make_users(
+            [
+                {
+                    "latitude": 41.3 + rng.uniform(-0.5, 0.5),
+                    "longitude": 69.24 + rng.uniform(-0.5, 0.5),
+                    "rating": rng.randint(600, 2400),
+                }
+                for _ in range(size - pool)
+            ]
+        )
+        pool = size
+
+        before = await median_seconds(lambda: swipe_with_a_session_per_candidate(me))
+        after = {}
+        for mode in ScoringModes:
+            monkeypatch.setattr(settings, "SCORING_MODE", mode)
+            after[mode] = await median_seconds(lambda: get_best_matches(me))
+        print(
+            f"{size:>6} candidates: session per candidate {before * 1000:.1f} ms, "
+            + ", ".join(f"{m.name} {t * 1000:.1f} ms" for m, t in after.items())
+        )
+
+        assert after[ScoringModes.python] < before
@@ -0,0 +1,88 @@
+import random
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytest
+
+from shared.enums import PreferredGenders
+from shared.matching.algorithm import score_candidates
+from shared.matching.vectorized import calculate_ages, score_pool, top_k
+from shared.models.user import Preferences, User
+
+
+def make_pool(size: int, seed: int = 1) -> list[User]:
+    rng = random.Random(seed)
+    return [
+        User(
+            latitude=41.3 + rng.uniform(-0.7, 0.7),
+            longitude=69.24 + rng.uniform(-0.7, 0.7),
+            birth_date=datetime(1980, 1, 1) + timedelta(days=rng.randint(0, 9000)),
+            rating=rng.randint(600, 2400),
+        )
+        for _ in range(size)
+    ]
+
+
+def score_pool_of(current_user: User, preferences: Preferences, pool: list[User], k=1):
+    return score_pool(
+        current_user,
+        preferences,
+        np.array([user.latitude for user in pool]),
+        np.array([user.longitude for user in pool]),
+        np.array([user.birth_date for user in pool], dtype="datetime64[D]"),
+        np.array([user.rating for user in pool]),
+        k=k,
+    )
+
+
+@pytest.fixture
+def current_user() -> User:
+    return User(latitude=41.3, longitude=69.24, birth_date=datetime(1995, 6, 15))
+
+
+@pytest.mark.parametrize("min_age", [None, 20])
+def test_scores_match_reference(current_user, min_age):
+    preferences = Preferences(
+        min_age=min_age, max_age=min_age and 35, preferred_gender=PreferredGenders.both
+    )
+    pool = make_pool(5000)
+
+    scores, _ = score_pool_of(current_user, preferences, pool)
+
+    assert scores.tolist() == score_candidates(current_user, preferences, pool)
+
+
+def test_top_k_matches_reference_ranking(current_user):
+    preferences = Preferences(preferred_gender=PreferredGenders.both)
+    pool = make_pool(5000, seed=2)
+
+    scores, best = score_pool_of(current_user, preferences, pool, k=50)
+
+    expected = sorted(
+        (i for i, score in enumerate(scores) if score > 0),
+        key=lambda i: scores[i],
+        reverse=True,
+    )[:50]
+    assert scores[best].tolist() == [scores[i] for i in expected]
+    # only candidates tied with the 50th may be swapped for another
+    above_last = [i for i in expected if scores[i] > scores[expected[-1]]]
+    assert best[: len(above_last)].tolist() == above_last
+
+
+def test_top_k_edge_cases():
+    scores = np.array([0.5, 0, 0.7, 0.5])
+
+    assert top_k(scores, 0).tolist() == []
+    assert top_k(scores, 10).tolist() == [2, 0, 3]
+    assert top_k(np.zeros(3), 2).tolist() == []
+    assert top_k(np.array([]), 1).tolist() == []
+
+
+def test_ages_match_user_age():
+    # three years of birthdays, including a Feb 29
+    birth_dates = [date(2003, 1, 1) + timedelta(days=i) for i in range(3 * 366)]
+
+    ages = calculate_ages(np.array(birth_dates, dtype="datetime64[D]"))
+
+    expected = [User(birth_date=birth_date).age for birth_date in birth_dates]
+    assert ages.tolist() == expected
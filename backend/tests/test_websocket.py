@@ -0,0 +1,139 @@
+import asyncio
+import time
+
+import pytest
+
+from api.backplane import Backplane
+from api.websocket import ConnectionManager
+from shared.core.config import settings
+
+HEALTHY_CLIENTS = 50
+MESSAGES = 200
+SEND_TIMEOUT = 0.2
+
+
+class FakeWebSocket:
+    """
+    A client taking every frame after delay seconds, or never taking one when
+    stalled, like one whose TCP window filled up
+    """
+
+    def __init__(self, delay: float = 0, stalled: bool = False):
+        self.delay = delay
+        self.stalled = stalled
+        self.received: list[tuple[float, str]] = []
+        self.close_codes: list[int] = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        if self.stalled:
+            await asyncio.Event().wait()
+        await asyncio.sleep(self.delay)
+        self.received.append((time.monotonic(), message))
+
+    async def close(self, code: int = 1000):
+        self.close_codes.append(code)
+        if self.stalled:
+            await asyncio.Event().wait()
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(settings, "WEBSOCKET_SEND_QUEUE_SIZE", 20)
+    monkeypatch.setattr(settings, "WEBSOCKET_SEND_TIMEOUT", SEND_TIMEOUT)
+
+
+async def wait_until(condition, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+async def broadcast(slow_clients: dict[str, FakeWebSocket]) -> float:
+    """
+    Send MESSAGES messages to the healthy clients and the slow ones, check
+    every healthy client got all of them in order and return their p99
+    latency in seconds
+    """
+    manager = ConnectionManager(Backplane())
+    healthy = {f"user{i}": FakeWebSocket() for i in range(HEALTHY_CLIENTS)}
+    for user_id, websocket in {**healthy, **slow_clients}.items():
+        await manager.connect(user_id, websocket)
+
+    sent_at = []
+    for i in range(MESSAGES):
+        sent_at.append(time.monotonic())
+        for user_id in [*healthy, *slow_clients]:
+            await manager.send_message(user_id, str(i))
+        # queueing never waits for a client
+        assert time.monotonic() - sent_at[-1] < 0.05
+        await asyncio.sleep(0.002)
+
+    websockets = healthy.values()
+    await wait_until(lambda: all(len(ws.received) == MESSAGES for ws in websockets))
+    latencies = []
+    for websocket in websockets:
+        assert [message for _, message in websocket.received] == [
+            str(i) for i in range(MESSAGES)
+        ]
+        latencies += [t - sent_at[int(message)] for t, message in websocket.received]
+
+    for user_id, websocket in {**healthy, **slow_clients}.items():
+        await manager.disconnect(user_id, websocket)
+    return sorted(latencies)[int(len(latencies) * 0.99)]
+
+
+async def test_slow_clients_do_not_delay_the_others():
+    baseline = await broadcast({})
+
+    stalled = FakeWebSocket(stalled=True)
+    lagging = FakeWebSocket(delay=0.05)
+    p99 = await broadcast({"stalled": stalled, "lagging": lagging})
+
+    assert p99 <= max(2 * baseline, 0.02)
+    # the stalled client hit the send timeout, the lagging one overflowed
+    # its queue, both are told to come back later
+    assert stalled.close_codes[0] == 1013
+    assert lagging.close_codes[0] == 1013
+    assert len(lagging.received) < MESSAGES
+
+
+async def test_stalled_client_is_disconnected_after_send_timeout():
+    manager = ConnectionManager(Backplane())
+    stalled = FakeWebSocket(stalled=True)
+    await manager.connect("stalled", stalled)
+
+    started_at = time.monotonic()
+    await manager.send_message("stalled", "hello")
+    await wait_until(lambda: stalled.close_codes)
+
+    assert stalled.close_codes == [1013]
+    assert SEND_TIMEOUT <= time.monotonic() - started_at < 2 * SEND_TIMEOUT
+
+
+class FailingBackplane(Backplane):
+    """A backplane whose database is down, with the user on another worker"""
+
+    async def publish(self, user_id: str, message: str) -> None:
+        raise ConnectionRefusedError
+
+    async def announce(self, user_id: str, is_online: bool) -> None:
+        raise ConnectionRefusedError
+
+    def is_connected(self, user_id: str) -> bool:
+        return True
+
+
+async def test_backplane_errors_fall_back_to_local_delivery():
+    manager = ConnectionManager(FailingBackplane())
+    websocket = FakeWebSocket()
+    await manager.connect("alice", websocket)
+
+    await manager.send_message("alice", "hello")
+    await wait_until(lambda: websocket.received)
+
+    assert [message for _, message in websocket.received] == ["hello"]
+    await manager.disconnect("alice", websocket)